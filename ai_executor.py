@@ -0,0 +1,480 @@
+"""AI 探索の実行バックエンド
+
+OthelloAI.choose_move は CPU を使い切る処理なので、gevent のワーカー上で
+そのまま呼ぶとイベントループ全体（＝同じワーカーの全ルーム）が止まる。
+AIExecutor は探索をワーカープロセスのプールへ送り、結果を協調的に待つ。
+
+  AI_BACKEND=process  プロセスプールで探索（デフォルト）
+  AI_BACKEND=inline   従来どおり呼び出し元で探索
+  AI_POOL_SIZE        プールのプロセス数（デフォルト: CPU 数）
+  AI_PONDER_WIDTH     先読みする人間の候補手の数（0 で先読みしない。デフォルト: 2）
+  AI_ANALYSIS_CACHE   検討結果（analyze）を覚えておく局面数（デフォルト: 256）
+
+先読み（pondering）: AI が指した後、人間が指しそうな手を ponder() で数手選び、
+それぞれの局面の探索を人間の手番のうちにプールで始めておく。人間が実際に
+そのどれかを指したら choose_move はその結果を待つだけで済む。外れた探索は
+共有メモリ上の中断フラグで打ち切る。
+
+検討（analyze）: 全合法手の評価値（OthelloAI.analyze）を同じプールで計算する。
+結果は局面の zobrist_key と予算ごとに LRU で覚えておき、同じ局面のヒントを
+何度求められても・同じルームの観戦者が同時に求めても探索は1回で済ませる。
+着手後の評価値（evaluate）もプールで計算し、イベントループでは計算しない。
+
+プールへの投入には優先度を付ける: AI の手番の探索 > 評価値 > 検討 > 先読み。
+ProcessPoolExecutor の中の待ち行列は到着順なので、プールで同時に走らせるのは
+pool_size 個までにして、残りはこちらの待ち行列で優先度順に並べておく。
+検討と先読みは最後の1プロセスを使わない（AI の手番の探索のために空けておく）。
+先読みは待たせる意味が無いので、すぐ始められるときだけ始める。
+待っている投入は、誰かが探索の完了を待つ（wait）たびに空いたプロセスへ送る。
+"""
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+import search_stats
+from othello import OthelloGame
+from othello_ai import OthelloAI
+from search_stats import SearchStats
+
+logger = logging.getLogger(__name__)
+
+BACKEND_PROCESS = "process"
+BACKEND_INLINE = "inline"
+
+# プールへの投入の優先度（小さいほど先に走らせる）
+PRIORITY_MOVE = 0     # AI の手番の探索
+PRIORITY_EVAL = 1     # 着手後の評価値
+PRIORITY_ANALYZE = 2  # 検討
+PRIORITY_PONDER = 3   # 先読み
+
+
+def encode_position(game: OthelloGame) -> Tuple[int, int, int]:
+    """プロセス間で受け渡す局面表現 (black, white, turn)"""
+    return game.black, game.white, game.turn
+
+
+def decode_position(position: Tuple[int, int, int]) -> OthelloGame:
+    return OthelloGame.from_bitboards(*position)
+
+
+# ワーカープロセス側: レベルごとに AI を使い回し、置換表を次の探索に引き継ぐ
+_worker_ais = {}
+_worker_flags = {}  # 共有メモリ名 → 中断フラグ配列（ワーカーごとに1回だけ開く）
+
+
+def _stop_flag(stop):
+    """stop = (共有メモリ名, スロット番号) から「中断フラグが立ったか」を返す関数を作る"""
+    if stop is None:
+        return None
+    name, slot = stop
+    shm = _worker_flags.get(name)
+    if shm is None:
+        shm = _worker_flags[name] = shared_memory.SharedMemory(name=name)
+    buf = shm.buf
+    return lambda: buf[slot] != 0
+
+
+def _worker_ai(level, collect_stats=False) -> OthelloAI:
+    ai = _worker_ais.get(level)
+    if ai is None:
+        ai = _worker_ais[level] = OthelloAI(level=level)
+    ai.collect_stats = collect_stats
+    return ai
+
+
+def _search(level, position, time_limit, node_limit, collect_stats=False, stop=None):
+    """(最善手, 探索統計の dict) を返す。stop は中断フラグの (共有メモリ名, スロット番号)"""
+    ai = _worker_ai(level, collect_stats)
+    move = ai.choose_move(decode_position(position), time_limit, node_limit,
+                          stop=_stop_flag(stop))
+    return move, ai.last_stats.as_dict()
+
+
+def _analyze(level, position, time_limit, node_limit):
+    """全合法手の評価値（OthelloAI.analyze の戻り値）を返す"""
+    return _worker_ai(level).analyze(decode_position(position), time_limit, node_limit)
+
+
+def _evaluate(level, position):
+    """白から見た評価値を返す"""
+    return _worker_ai(level).evaluate(decode_position(position))
+
+
+def _search_split(level, position, time_limit, node_limit, root_mask, collect_stats=False,
+                  stop=None):
+    """ルート分割の1分担: root_mask の手だけを探索し、
+    (深さごとの結果, 探索統計の dict) を返す"""
+    ai = _worker_ai(level, collect_stats)
+    ai.choose_move(decode_position(position), time_limit, node_limit, root_mask,
+                   stop=_stop_flag(stop))
+    return ai.last_results, ai.last_stats.as_dict()
+
+
+def _forward(inner: Future, future: Future):
+    """プールでの結果 inner を、投入したときに返した future に移す"""
+    if inner.cancelled():
+        future.set_exception(CancelledError())
+    elif inner.exception() is not None:
+        future.set_exception(inner.exception())
+    else:
+        future.set_result(inner.result())
+
+
+class PonderJob:
+    """先読み中の1局面（人間が指した後の局面）の探索"""
+    __slots__ = ("level", "future", "slot")
+
+    def __init__(self, level, future, slot):
+        self.level = level
+        self.future = future
+        self.slot = slot
+
+
+class AIExecutor:
+    MAX_CANCEL_SLOTS = 256  # 同時に走らせられる先読み探索の数の上限
+    PONDER_MIN_TIME = 0.1   # 持ち時間がこれ未満のレベルは先読みしない
+
+    def __init__(self, backend: Optional[str] = None, pool_size: Optional[int] = None,
+                 sleep=time.sleep, poll_interval: float = 0.01, ponder_width: Optional[int] = None):
+        """sleep には待機中に他の処理へ制御を渡す関数（socketio.sleep など）を渡す"""
+        self.backend = backend or os.environ.get("AI_BACKEND", BACKEND_PROCESS)
+        if self.backend not in (BACKEND_PROCESS, BACKEND_INLINE):
+            raise ValueError(f"unknown AI backend: {self.backend}")
+        self.pool_size = pool_size or int(os.environ.get("AI_POOL_SIZE", 0)) or os.cpu_count() or 1
+        self.sleep = sleep
+        self.poll_interval = poll_interval
+        self.ponder_width = (int(os.environ.get("AI_PONDER_WIDTH", 2))
+                             if ponder_width is None else ponder_width)
+        self._pool = None
+        # プールに送る前の投入: (優先度, 通し番号, Future, 関数, 引数) のヒープ
+        self._queue = []
+        self._queue_seq = itertools.count()
+        self._inflight = set()  # プールで走っている投入の Future
+        # 検討・先読みに使わせないプロセス数
+        self.reserved = 1 if self.pool_size > 1 else 0
+        # 先読み: ルームID → {人間が指した後の局面の zobrist_key: PonderJob}
+        self._ponders: Dict[str, Dict[int, PonderJob]] = {}
+        self._flags = None  # 中断フラグの共有メモリ（スロットごとに1バイト）
+        self._slots: Dict[int, object] = {}  # 使用中のスロット → Future
+        self.ponder_hits = 0
+        self.ponder_misses = 0
+        # 検討: (zobrist_key, レベル, 持ち時間, ノード数) → 結果（古いものが先頭）
+        self.analysis_cache_size = int(os.environ.get("AI_ANALYSIS_CACHE", 256))
+        self._analyses: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._analyzing: Dict[Tuple, object] = {}  # 計算中の検討 → Future
+        self._inline_ais: Dict[object, OthelloAI] = {}  # inline で検討に使う AI（レベルごと）
+        self.analysis_hits = 0
+        self.analysis_misses = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # gunicorn の fork 後に各ワーカーで作られるよう、最初の探索時に起動する
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.pool_size,
+                mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def submit(self, ai: OthelloAI, game: OthelloGame, time_limit=None, node_limit=None):
+        """探索をプールに投入して Future を返す（結果は (最善手, 探索統計の dict)）"""
+        return self._submit(PRIORITY_MOVE, _search, ai.level, encode_position(game),
+                            time_limit, node_limit, ai.collect_stats)
+
+    def _submit(self, priority, fn, *args) -> Future:
+        """fn(*args) を優先度 priority で投入する。返す Future は、プールに送られると
+        実行中になり、プールでの結果をそのまま受け取る"""
+        future = Future()
+        heapq.heappush(self._queue, (priority, next(self._queue_seq), future, fn, args))
+        self._dispatch()
+        return future
+
+    def _capacity(self, priority) -> int:
+        return self.pool_size - (self.reserved if priority >= PRIORITY_ANALYZE else 0)
+
+    def _idle(self, priority) -> bool:
+        """優先度 priority の投入が待たずに始められるか"""
+        self._inflight = {f for f in self._inflight if not f.done()}
+        return not self._queue and len(self._inflight) < self._capacity(priority)
+
+    def _dispatch(self):
+        """待っている投入を、空いているプロセスの数だけ優先度順にプールへ送る"""
+        self._inflight = {f for f in self._inflight if not f.done()}
+        while self._queue:
+            priority, _, future, fn, args = self._queue[0]
+            if len(self._inflight) >= self._capacity(priority):
+                break
+            heapq.heappop(self._queue)
+            if not future.set_running_or_notify_cancel():
+                continue  # 送る前に取り消された
+            try:
+                inner = self._get_pool().submit(fn, *args)
+            except BrokenProcessPool as e:
+                self._pool = None
+                future.set_exception(e)
+                continue
+            self._inflight.add(inner)
+            inner.add_done_callback(lambda inner, future=future: _forward(inner, future))
+
+    def pool_load(self) -> Dict[str, int]:
+        """プールで走っている投入の数と、送られるのを待っている投入の数"""
+        self._inflight = {f for f in self._inflight if not f.done()}
+        return {"pool_size": self.pool_size, "running": len(self._inflight),
+                "queued": len(self._queue)}
+
+    def _submit_stoppable(self, fn, *args):
+        """中断フラグのスロットを確保して fn(*args, (共有メモリ名, スロット番号)) を
+        AI の手番の探索として投入し、(Future, スロット番号) を返す。
+        スロットが空いていなければ中断できない探索になる"""
+        slot = self._acquire_slot()
+        future = self._submit(PRIORITY_MOVE, fn, *args,
+                              (self._flags.name, slot) if slot is not None else None)
+        if slot is not None:
+            self._slots[slot] = future
+        return future, slot
+
+    def wait(self, future, stop=None, jobs=()):
+        """Future の完了を self.sleep で譲りながら待つ。stop が真を返したら
+        jobs（(Future, スロット番号) の列）の探索に中断フラグを立てる
+        （探索は途中の結果を返して終わる。終わった探索のスロットには触らない）"""
+        while not future.done():
+            self._dispatch()
+            if stop is not None and stop():
+                for f, slot in jobs:
+                    self._stop_slot(f, slot)
+                stop = None
+            self.sleep(self.poll_interval)
+        return future.result()
+
+    def choose_move(self, ai: OthelloAI, game: OthelloGame, time_limit=None, node_limit=None,
+                    room=None, stop=None):
+        """最善手を返す。探索統計はワーカーから受け取って ai.last_stats に入れる。
+        room を渡すと、そのルームで先読みしていた探索が使えればその結果を返す。
+        stop（引数なしの関数）が真を返したら探索を打ち切る（ジョブの取り消し用。
+        返す手は途中までの探索の結果なので、呼び出し側で捨てること）"""
+        if self.backend == BACKEND_INLINE:
+            return ai.choose_move(game, time_limit, node_limit, stop=stop)
+        try:
+            if room is not None:
+                job = self._take_ponder(room, game)
+                if job is not None and job.level != ai.level:
+                    # レベルが変わった: 先読みは使えないので、これからの探索と競わせない
+                    self._cancel(job)
+                    job = None
+                if job is not None:
+                    move, stats = self.wait(job.future, stop, ((job.future, job.slot),))
+                    self.ponder_hits += 1
+                    ai.last_stats = SearchStats.from_dict(stats)
+                    ai.last_stats.pondered = True
+                    search_stats.log_stats(logger, ai.last_stats)
+                    return move
+            if ai.parallel > 1 and not ai.in_endgame(game):
+                return self._parallel_choose_move(ai, game, time_limit, node_limit, stop)
+            future, slot = self._submit_stoppable(_search, ai.level, encode_position(game),
+                                                  time_limit, node_limit, ai.collect_stats)
+            move, stats = self.wait(future, stop, ((future, slot),))
+            ai.last_stats = SearchStats.from_dict(stats)
+            search_stats.log_stats(logger, ai.last_stats)
+            return move
+        except BrokenProcessPool:
+            logger.exception("AI process pool is broken; searching in-process")
+            self._pool = None
+            return ai.choose_move(game, time_limit, node_limit, stop=stop)
+
+    def _parallel_choose_move(self, ai: OthelloAI, game: OthelloGame, time_limit, node_limit,
+                              stop=None):
+        """ルートの合法手を ai.parallel 個に分けて別々のプロセスで探索する。
+        手順付けした順に配るので、有望な手が1つのプロセスに偏らない。
+        node_limit は分担ごとの上限として扱う"""
+        start = time.perf_counter()
+        move = ai.book_move(game)
+        if move is not None:
+            ai.last_stats = SearchStats(ai.level, detailed=ai.collect_stats)
+            ai.last_stats.mode = search_stats.MODE_BOOK
+            ai.last_stats.elapsed = time.perf_counter() - start
+            search_stats.log_stats(logger, ai.last_stats)
+            return move
+        moves = ai.get_sorted_moves(game, game.turn)
+        n = min(ai.parallel, self.pool_size, len(moves))
+        if n <= 1:
+            future, slot = self._submit_stoppable(_search, ai.level, encode_position(game),
+                                                  time_limit, node_limit, ai.collect_stats)
+            move, stats = self.wait(future, stop, ((future, slot),))
+            ai.last_stats = SearchStats.from_dict(stats)
+            search_stats.log_stats(logger, ai.last_stats)
+            return move
+        masks = [0] * n
+        for i, (_, sq, _) in enumerate(moves):
+            masks[i % n] |= 1 << sq
+        position = encode_position(game)
+        jobs = [self._submit_stoppable(_search_split, ai.level, position, time_limit, node_limit,
+                                       mask, ai.collect_stats)
+                for mask in masks]
+        results, stats = zip(*(self.wait(f, stop, jobs) for f, _ in jobs))
+        _, move, depth = OthelloAI.merge_root_results(results, game.turn == 1)
+        ai.last_stats = SearchStats.merge((SearchStats.from_dict(s) for s in stats),
+                                          depth, time.perf_counter() - start)
+        search_stats.log_stats(logger, ai.last_stats)
+        return move
+
+    # ------------------------------------------------------------------
+    # 検討・評価値
+    # ------------------------------------------------------------------
+    def analyze(self, level, game: OthelloGame, time_limit=None, node_limit=None) -> Dict:
+        """レベル level の AI で全合法手の評価値を求める（OthelloAI.analyze の戻り値）。
+        同じ局面・予算の結果が残っていればそれを返し、計算中ならその完了を待つ"""
+        key = (game.zobrist_key(), level, time_limit, node_limit)
+        result = self._analyses.get(key)
+        if result is not None:
+            self._analyses.move_to_end(key)
+            self.analysis_hits += 1
+            return result
+        future = self._analyzing.get(key)
+        if future is not None:
+            self.analysis_hits += 1
+            return self.wait(future)
+        self.analysis_misses += 1
+        if self.backend == BACKEND_INLINE:
+            result = self._inline_ai(level).analyze(game, time_limit, node_limit)
+        else:
+            try:
+                future = self._analyzing[key] = self._submit(
+                    PRIORITY_ANALYZE, _analyze, level, encode_position(game), time_limit,
+                    node_limit)
+                result = self.wait(future)
+            except BrokenProcessPool:
+                logger.exception("AI process pool is broken; analyzing in-process")
+                self._pool = None
+                result = self._inline_ai(level).analyze(game, time_limit, node_limit)
+            finally:
+                self._analyzing.pop(key, None)
+        self._analyses[key] = result
+        while len(self._analyses) > self.analysis_cache_size:
+            self._analyses.popitem(last=False)
+        return result
+
+    def _inline_ai(self, level) -> OthelloAI:
+        ai = self._inline_ais.get(level)
+        if ai is None:
+            ai = self._inline_ais[level] = OthelloAI(level=level)
+        return ai
+
+    def evaluate(self, ai: OthelloAI, game: OthelloGame) -> float:
+        """ai の評価関数で白から見た評価値を求める"""
+        if self.backend == BACKEND_INLINE:
+            return ai.evaluate(game)
+        try:
+            return self.wait(self._submit(PRIORITY_EVAL, _evaluate, ai.level,
+                                          encode_position(game)))
+        except BrokenProcessPool:
+            logger.exception("AI process pool is broken; evaluating in-process")
+            self._pool = None
+            return ai.evaluate(game)
+
+    # ------------------------------------------------------------------
+    # 先読み
+    # ------------------------------------------------------------------
+    def ponder(self, ai: OthelloAI, game: OthelloGame, room):
+        """人間の手番の局面 game で、人間が指しそうな手を ponder_width 手選び、
+        その後の AI の手番の局面の探索をプールで始める。前回の先読みは取り消す"""
+        self.cancel_ponder(room)
+        if (self.backend != BACKEND_PROCESS or self.ponder_width <= 0
+                or ai.time_limit < self.PONDER_MIN_TIME):
+            return
+        moves = ai.get_sorted_moves(game, game.turn)
+        if not moves:
+            return
+        # 人間側から見て評価の高い手ほど指されやすいとみなす
+        scores = ai._evaluate_children(game, moves)
+        ranked = sorted(zip(scores, moves), key=lambda sm: sm[0] * game.turn, reverse=True)
+        jobs = {}
+        try:
+            for _, (_, sq, flips) in ranked[:self.ponder_width]:
+                child = game.copy()
+                child.apply_move(sq, flips)
+                if not child.has_valid_move(child.turn):
+                    continue  # AI がパスする局面は探索しない
+                if not self._idle(PRIORITY_PONDER):
+                    break  # プールが空いていなければ先読みしない
+                slot = self._acquire_slot()
+                if slot is None:
+                    break
+                future = self._submit(
+                    PRIORITY_PONDER, _search, ai.level, encode_position(child), None, None,
+                    ai.collect_stats, (self._flags.name, slot))
+                self._slots[slot] = future
+                jobs[child.zobrist_key()] = PonderJob(ai.level, future, slot)
+        except BrokenProcessPool:
+            logger.exception("AI process pool is broken; pondering disabled for this move")
+            self._pool = None
+        if jobs:
+            self._ponders[room] = jobs
+
+    def cancel_ponder(self, room):
+        """ルームの先読みを取り消す（走っている探索には中断フラグを立てる）"""
+        for job in self._ponders.pop(room, {}).values():
+            self._cancel(job)
+
+    def _take_ponder(self, room, game: OthelloGame) -> Optional[PonderJob]:
+        """game の局面を先読みしていればその探索を返し、残りは取り消す"""
+        jobs = self._ponders.pop(room, None)
+        if not jobs:
+            return None
+        hit = jobs.pop(game.zobrist_key(), None)
+        for job in jobs.values():
+            self._cancel(job)
+        if hit is None:
+            self.ponder_misses += 1
+        elif hit.future.cancelled():
+            hit = None
+        return hit
+
+    def _cancel(self, job: PonderJob):
+        job.future.cancel()  # まだ始まっていなければキューから外すだけ
+        self._stop_slot(job.future, job.slot)
+
+    def _stop_slot(self, future, slot):
+        """future の探索に中断フラグを立てる。終わった探索のスロットは
+        別の探索に渡っていることがあるので、フラグには触らずスロットを返すだけにする"""
+        if slot is None or self._slots.get(slot) is not future:
+            return
+        if future.done():
+            del self._slots[slot]
+        else:
+            self._flags.buf[slot] = 1
+
+    def _acquire_slot(self) -> Optional[int]:
+        """空いている中断フラグのスロットを確保する（終わった探索のスロットは再利用）"""
+        if self._flags is None:
+            self._flags = shared_memory.SharedMemory(create=True, size=self.MAX_CANCEL_SLOTS)
+            self._flags.buf[:] = bytes(self.MAX_CANCEL_SLOTS)
+        for slot in range(self.MAX_CANCEL_SLOTS):
+            future = self._slots.get(slot)
+            if future is None or future.done():
+                self._slots.pop(slot, None)
+                self._flags.buf[slot] = 0
+                return slot
+        return None
+
+    def shutdown(self):
+        for room in list(self._ponders):
+            self.cancel_ponder(room)
+        while self._queue:
+            heapq.heappop(self._queue)[2].cancel()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        if self._flags is not None:
+            self._flags.close()
+            self._flags.unlink()
+            self._flags = None
+        self._slots.clear()
+        self._inflight.clear()
+        self._analyses.clear()
+        self._analyzing.clear()
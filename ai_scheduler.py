@@ -0,0 +1,187 @@
+"""AI の手番の処理（ジョブ）の受付と実行
+
+handle_move は白番になるたびに AI のジョブを AIScheduler に渡す。
+
+  - 1ルームにつき同時に1ジョブまで。実行中・待機中のルームに重ねて投入されたら
+    新しいジョブは作らず、今のジョブが終わった後に1回だけ実行し直す
+    （実行し直したジョブは AI の手番でなければ何もしない）
+  - 同時に探索するジョブは max_jobs 個まで。超えた分は到着順に待たせる
+  - cancel(room) でルームのジョブを取り消す。待機中なら列から外し、実行中なら
+    AIJob.cancelled が真になる。探索は AIExecutor.choose_move の stop で
+    これを見て打ち切り、ジョブは結果を捨てて終わる（切断・start_ai_game のとき）
+  - 探索が終わって待ち時間（演出）に入ったジョブは release() で枠を返す
+
+ここで数えるのは AI の手番のジョブだけ。プロセスプールの使い方（先読み・検討・
+評価値との優先度と同時実行数）は AIExecutor が決める。
+
+単一実行の保証はプロセス内だけ（複数ワーカーでは各ワーカーが自分のルームの
+ジョブだけを見る）。
+
+  AI_MAX_JOBS  同時に探索するジョブ数（デフォルト: CPU 数）
+"""
+import logging
+import os
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AIJob:
+    """1ルームの AI の手番1回分"""
+    __slots__ = ("room", "fn", "args", "submitted_at", "started_at", "cancelled", "rerun",
+                 "_released", "_scheduler")
+
+    def __init__(self, scheduler: "AIScheduler", room, fn: Callable, args):
+        self.room = room
+        self.fn = fn
+        self.args = args
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.cancelled = False
+        self.rerun = False  # 実行中に同じルームへ投入された（終わったら実行し直す）
+        self._released = False
+        self._scheduler = scheduler
+
+    def is_cancelled(self) -> bool:
+        """探索の stop に渡す関数"""
+        return self.cancelled
+
+    def release(self):
+        """探索が終わったら呼ぶ。同時実行の枠を返し、待っているジョブを始める
+        （ルームのジョブとしては fn が戻るまで残る）"""
+        if not self._released and self.started_at is not None:
+            self._released = True
+            self._scheduler._release()
+
+
+class AIScheduler:
+    WAIT_SAMPLES = 1024  # 待ち時間のパーセンタイルに使う直近のジョブ数
+
+    def __init__(self, start_task: Callable, max_jobs: Optional[int] = None):
+        """start_task は fn(*args) をバックグラウンドで始める関数
+        （socketio.start_background_task など）"""
+        self.start_task = start_task
+        self.max_jobs = max_jobs or int(os.environ.get("AI_MAX_JOBS", 0)) or os.cpu_count() or 1
+        self._jobs: Dict[object, AIJob] = {}  # ルーム → 待機中・実行中のジョブ
+        self._queue: Deque[AIJob] = deque()
+        self._running = 0
+        # 統計
+        self.submitted = 0
+        self.started = 0
+        self.coalesced = 0   # 実行中・待機中のルームへの投入（ジョブは増やさない）
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self._waits: Deque[float] = deque(maxlen=self.WAIT_SAMPLES)
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, room, fn: Callable, *args) -> Optional[AIJob]:
+        """fn(job, *args) をルーム room のジョブとして投入する。
+        すでにジョブがあれば新しいジョブは作らず None を返す"""
+        job = self._jobs.get(room)
+        if job is not None and not job.cancelled:
+            job.rerun = True
+            self.coalesced += 1
+            return None
+        job = self._jobs[room] = AIJob(self, room, fn, args)
+        self.submitted += 1
+        self._queue.append(job)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        self._pump()
+        return job
+
+    def cancel(self, room) -> bool:
+        """ルームのジョブを取り消す。取り消すジョブがあれば True"""
+        job = self._jobs.pop(room, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        job.rerun = False
+        self.cancelled += 1
+        if job.started_at is None:
+            try:
+                self._queue.remove(job)
+            except ValueError:
+                pass
+        return True
+
+    def active(self, room) -> bool:
+        return room in self._jobs
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def oldest_wait(self) -> float:
+        """待ち行列の先頭のジョブが待っている秒数（空なら 0）"""
+        return time.monotonic() - self._queue[0].submitted_at if self._queue else 0.0
+
+    def _pump(self):
+        while self._running < self.max_jobs and self._queue:
+            job = self._queue.popleft()
+            if job.cancelled:
+                continue
+            job.started_at = time.monotonic()
+            self.started += 1
+            wait = job.started_at - job.submitted_at
+            self._waits.append(wait)
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self._running += 1
+            self.start_task(self._run, job)
+
+    def _run(self, job: AIJob):
+        try:
+            if not job.cancelled:
+                job.fn(job, *job.args)
+        except Exception:
+            self.failed += 1
+            job.rerun = False
+            logger.exception("[AI] job for room %s failed", job.room)
+        else:
+            if not job.cancelled:
+                self.completed += 1
+        finally:
+            job.release()
+            if self._jobs.get(job.room) is job:
+                del self._jobs[job.room]
+            if job.rerun and not job.cancelled:
+                self.submit(job.room, job.fn, *job.args)
+
+    def _release(self):
+        self._running -= 1
+        self._pump()
+
+    def metrics(self) -> Dict:
+        """待ち行列の長さ・待ち時間（秒）などの統計"""
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+
+        return {
+            "max_jobs": self.max_jobs,
+            "running": self._running,
+            "queued": len(self._queue),
+            "oldest_wait": self.oldest_wait(),
+            "rooms": len(self._jobs),
+            "max_queue_depth": self.max_queue_depth,
+            "submitted": self.submitted,
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "wait_avg": self.total_wait / self.started if self.started else 0.0,
+            "wait_p50": percentile(0.5),
+            "wait_p95": percentile(0.95),
+            "wait_max": self.max_wait,
+        }
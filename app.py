@@ -1,9 +1,17 @@
-from flask import Flask, render_template, request
-from flask_socketio import SocketIO, emit, join_room
+from flask import Flask, jsonify, render_template, request
+from flask_socketio import SocketIO, emit, join_room, leave_room
+import logging
+import math
 import os
 import time
-
-from game_manager import GameManager
+from collections import Counter
+
+import protocol
+from ai_executor import AIExecutor
+from ai_scheduler import AIScheduler
+from broadcast import Broadcaster
+from game_manager import GameManager, AI_PLAYER_ID
+from search_budget import SearchBudget
 from othello_ai import OthelloAI
 from othello import OthelloGame
 
@@ -12,16 +20,65 @@ from othello import OthelloGame
 # -----------------------------------------------------------------------------
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY")
-socketio = SocketIO(app)
+# 複数ワーカーで動かすときは SOCKETIO_MESSAGE_QUEUE（例: redis://localhost:6379/0）を設定し、
+# ルームへの送信を全ワーカーに届ける（GAME_STORE も共有ストアにすること。game_store.py 参照）
+socketio = SocketIO(app, message_queue=os.environ.get("SOCKETIO_MESSAGE_QUEUE"))
+logger = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------------------
 # Game Manager & Constants
 # -----------------------------------------------------------------------------
 game_manager = GameManager()
-AI_PLAYER_ID = "AI"
+# AI 探索はプロセスプールで実行し、待機中は socketio.sleep で他のルームに譲る
+# （AI_BACKEND=inline で従来どおりこのプロセス内で探索）
+ai_executor = AIExecutor(sleep=socketio.sleep)
+# AI の手番（run_ai_move）は1ルーム1ジョブまで、同時に探索するのは AI_MAX_JOBS 個まで
+ai_scheduler = AIScheduler(socketio.start_background_task)
+# AI の持ち時間（AI_ADAPTIVE_BUDGET=1 で、混んでいるときは短く・空いたら元に戻す）
+search_budget = SearchBudget(ai_scheduler, ai_executor)
+# ルームへの送信。ペイロードは局面の版ごとに1回だけ作り、観戦者にはまとめて送る
+broadcaster = Broadcaster(socketio, lambda game_id: game_manager.store.get(game_id))
 # Human move delay parameters
 BASE_DELAY    = 1.0   # seconds
 PER_FLIP_SEC  = 0.1   # additional seconds per flipped stone
+# 検討（analyze イベント）の AI のレベルと持ち時間。持ち時間は要求で変えられるが
+# ANALYSIS_MAX_TIME 秒まで。ANALYSIS_TIME_STEP 秒単位に丸める（少しずつ違う持ち時間で
+# 検討のキャッシュを素通りさせない）
+ANALYSIS_LEVEL    = int(os.environ.get("ANALYSIS_LEVEL", 3))
+ANALYSIS_TIME     = float(os.environ.get("ANALYSIS_TIME", 0.5))
+ANALYSIS_MAX_TIME = float(os.environ.get("ANALYSIS_MAX_TIME", 2.0))
+ANALYSIS_TIME_STEP = 0.25
+# 同時に計算する検討の数の上限（クライアントごと・ルームごと）
+ANALYSIS_MAX_PER_SID  = int(os.environ.get("ANALYSIS_MAX_PER_SID", 1))
+ANALYSIS_MAX_PER_ROOM = int(os.environ.get("ANALYSIS_MAX_PER_ROOM", 4))
+analyses_running = Counter()  # ("sid", sid) / ("room", game_id) → 計算中の検討の数
+# 接続（sid）→ その接続で参加したプレイヤーのID（クライアントがタブごとに sessionStorage
+# に持つ。接続し直すと sid は変わるが、同じタブならプレイヤーIDは変わらない。
+# 別のタブは別のプレイヤーとして参加する）
+sid_players = {}
+
+
+def join_game_room(game_id, proto):
+    """プロトコルに応じたルームに入る（v2 は game_id + "#v2"）"""
+    if proto == protocol.PROTOCOL_V2:
+        leave_room(game_id)
+        join_room(protocol.v2_room(game_id))
+    else:
+        join_room(game_id)
+
+
+def is_player(game_data, player_id):
+    return any(p.id == player_id for p in game_data.players)
+
+
+def forget_room(game_id):
+    """削除したルーム（切断・期限切れ・上限超過）の AI の処理と送信のキャッシュを捨てる"""
+    ai_scheduler.cancel(game_id)
+    ai_executor.cancel_ponder(game_id)
+    broadcaster.forget(game_id)
+
+
+game_manager.on_removed = forget_room
 
 # -----------------------------------------------------------------------------
 # Routes
@@ -30,6 +87,30 @@ PER_FLIP_SEC  = 0.1   # additional seconds per flipped stone
 def index():
     return render_template("othello.html")
 
+
+@app.route("/metrics")
+def metrics():
+    """AI のジョブの待ち行列・キャッシュ・送信の統計（このワーカーの分）"""
+    return jsonify({
+        "ai_jobs": ai_scheduler.metrics(),
+        "search_budget": search_budget.metrics(),
+        "ai_executor": {
+            "backend": ai_executor.backend,
+            "pool": ai_executor.pool_load(),
+            "ponder_hits": ai_executor.ponder_hits,
+            "ponder_misses": ai_executor.ponder_misses,
+            "analysis_hits": ai_executor.analysis_hits,
+            "analysis_misses": ai_executor.analysis_misses,
+        },
+        "broadcast": {
+            "built": broadcaster.built,
+            "reused": broadcaster.reused,
+            "flushes": broadcaster.flushes,
+            "coalesced": broadcaster.coalesced,
+        },
+        "memory": game_manager.memory_usage(),
+    })
+
 # -----------------------------------------------------------------------------
 # Socket.IO Events: Connection
 # -----------------------------------------------------------------------------
@@ -37,6 +118,21 @@ def index():
 def handle_connect():
     emit("connection_established", {"message": "Connected"})
 
+
+@socketio.on("disconnect")
+def handle_disconnect():
+    # 参加していたルームで離席中にし、RECONNECT_GRACE 秒のうちに戻らなければ外す
+    player_id = sid_players.pop(request.sid, request.sid)
+    for game_id in game_manager.disconnect(player_id):
+        socketio.start_background_task(expire_player, game_id, player_id)
+
+
+def expire_player(game_id, player_id):
+    """離席したまま戻らなかったプレイヤーを外す。人間が残らないルームは AI ごと削除する
+    （後始末は forget_room）"""
+    socketio.sleep(game_manager.reconnect_grace)
+    game_manager.expire_away(game_id, player_id)
+
 # -----------------------------------------------------------------------------
 # Socket.IO Events: Room Management
 # -----------------------------------------------------------------------------
@@ -55,120 +151,144 @@ def on_start_ai(data):
     level = data.get("level", 4)
     game_id = data.get("game_id")
     client_player_id = data.get("player_id")
+    proto = protocol.requested_protocol(data)
 
     if not game_id:
         game_id = game_manager.create_game()
         emit("room_created", {"game_id": game_id}, room=request.sid)
 
-    join_room(game_id)
+    join_game_room(game_id, proto)
     game_data = game_manager.get_game(game_id)
     if not game_data:
         emit("error", {"message": "Game not found"}, room=request.sid)
         return
 
-    # Reset players
-    game_data["players"] = []
+    sid_players[request.sid] = client_player_id
+    # Reset players（前の対局の AI の手番は取り消す）
+    ai_scheduler.cancel(game_id)
+    ai_executor.cancel_ponder(game_id)
+    game_manager.reset_players(game_id)
     # Add human (Black)
     game_manager.add_player(game_id, client_player_id, name="Human")
     # Add AI (White)
     ai = OthelloAI(level=level)
-    game_data["ai"] = ai
+    game_manager.add_ai(game_id, ai)
     game_manager.add_player(game_id, AI_PLAYER_ID, name="Computer")
     # Start with Black
-    game_data["game"].turn = -1
+    game_data = game_manager.get_game(game_id)
+    game_data.set_turn(-1)
+    if not game_manager.save_game(game_id, game_data):
+        emit("error", {"message": "Game was updated elsewhere; please retry"}, room=request.sid)
+        return
+
+    emit("joined", joined_payload(game_id, game_data, -1, proto), room=request.sid)
+
+    broadcaster.publish(game_id, game_data, "game_state", broadcaster.state(game_id, game_data))
 
-    emit("joined", {
+
+def joined_payload(game_id, game_data, color, proto, since=None):
+    """joined イベントの内容。v2 では盤面をスナップショットで送る
+    （同じルームに入り直すクライアントが since を渡したら、その後の差分だけを送る）"""
+    payload = {
         "game_id": game_id,
-        "players": [{"id": p.id, "name": p.name} for p in game_data["players"]],
-        "your_color": -1,
-        "board": game_data["game"].board,
-        "turn": game_data["game"].turn
-    }, room=request.sid)
+        "players": broadcaster.players(game_id, game_data),
+        "your_color": color,
+    }
+    if proto == protocol.PROTOCOL_V2:
+        payload["v"] = protocol.PROTOCOL_V2
+        deltas = protocol.replay(game_data, since) if since is not None else None
+        if deltas:
+            payload["deltas"] = protocol.deltas_payload(game_id, game_data, deltas)
+        else:
+            payload["snapshot"] = broadcaster.snapshot(game_id, game_data)
+    else:
+        payload["board"] = game_data.game.board
+        payload["turn"] = game_data.game.turn
+    return payload
 
-    emit("game_state", {
-        "board": game_data["game"].board,
-        "turn": game_data["game"].turn,
-        "players": [{"id": p.id, "name": p.name} for p in game_data["players"]],
-        "status": "ongoing"
-    }, room=game_id)
+
+@socketio.on("resync")
+def handle_resync(data):
+    """v2 のクライアントが差分を取りこぼしたときに送り直す。since（最後に反映した seq）が
+    あればその後の差分を棋譜から作って送り、作れなければスナップショットを送る"""
+    game_id = data.get("game_id")
+    game_data = game_manager.get_game(game_id)
+    if not game_data:
+        emit("error", {"message": f"Game not found: {game_id}"}, room=request.sid)
+        return
+    deltas = protocol.replay(game_data, data.get("since"))
+    if deltas is not None:
+        emit("game_deltas", protocol.deltas_payload(game_id, game_data, deltas), room=request.sid)
+    else:
+        emit("game_snapshot", broadcaster.snapshot(game_id, game_data), room=request.sid)
 
 
 # -----------------------------------------------------------------------------
 # Socket.IO Events: Join Game
 @socketio.on("join_game")
 def handle_join_game(data):
-    print(f"\n=== JOIN GAME REQUEST ===")  # デバッグ開始
-    print(f"Received data: {data}")  # 受信データ表示
-    
     game_id = data["game_id"]
     player_id = data["player_id"]
     name = data.get("name", "Player")
-
-    print(f"Attempting to join game: {game_id} as player: {player_id}")
+    proto = protocol.requested_protocol(data)
 
     game_data = game_manager.get_game(game_id)
     if not game_data:
-        error_msg = f"Game not found: {game_id}"
-        print(error_msg)
-        emit("error", {"message": error_msg}, room=request.sid)
+        emit("error", {"message": f"Game not found: {game_id}"}, room=request.sid)
         return
 
-    print(f"Current players in game: {[p.id for p in game_data['players']]}")
-
-    # 既存プレイヤーチェック
-    existing_player = next((p for p in game_data["players"] if p.id == player_id), None)
+    # 既存プレイヤーチェック（接続し直したプレイヤーは同じ色で戻る）
+    existing_player = game_manager.find_player(game_data, player_id)
     if existing_player:
-        print(f"Player already in game: {player_id}")
-        color = -1 if game_data["players"][0].id == player_id else 1
+        if existing_player.away is not None:
+            game_data = game_manager.rejoin(game_id, player_id) or game_data
     else:
         if not game_manager.add_player(game_id, player_id, name):
-            error_msg = f"Game is full: {game_id}"
-            print(error_msg)
-            emit("error", {"message": error_msg}, room=request.sid)
+            emit("error", {"message": f"Game is full: {game_id}"}, room=request.sid)
             return
-        color = -1 if len(game_data["players"]) == 1 else 1
-        print(f"Added new player: {player_id} as {'Black' if color == -1 else 'White'}")
-
-    join_room(game_id)
-    print(f"Player {player_id} joined room: {game_id}")
+        game_data = game_manager.get_game(game_id)
+    player = game_manager.find_player(game_data, player_id) if game_data else None
+    if player is None:
+        emit("error", {"message": f"Game not found: {game_id}"}, room=request.sid)
+        return
+    color = player.color
+    sid_players[request.sid] = player_id
+    logger.debug("player %s joined %s as %s", player_id, game_id,
+                 "black" if color == -1 else "white")
 
-    players = game_data["players"]
-    print(f"Current player count: {len(players)}")
+    join_game_room(game_id, proto)
+    players = game_data.players
 
     # 参加者に送信
-    join_payload = {
-        "game_id": game_id,
-        "players": [{"id": p.id, "name": p.name} for p in players],
-        "your_color": color,
-        "board": game_data["game"].board,
-        "turn": game_data["game"].turn
-    }
-    print(f"Sending 'joined' event to player: {join_payload}")
-    emit("joined", join_payload, room=request.sid)
+    emit("joined", joined_payload(game_id, game_data, color, proto, data.get("since")),
+         room=request.sid)
 
     # 全員にブロードキャスト
-    state_payload = {
-        "board": game_data["game"].board,
-        "turn": game_data["game"].turn,
-        "players": [{"id": p.id, "name": p.name} for p in players],
-        "status": "ongoing"
-    }
-    print(f"Broadcasting 'game_state' to room: {state_payload}")
-    emit("game_state", state_payload, room=game_id)
+    broadcaster.publish(game_id, game_data, "game_state", broadcaster.state(game_id, game_data))
 
     # 2人揃ったらゲーム開始
-    if len(players) == 2 and not game_data.get("ai"):
-        print("Two players joined - starting game")
+    if len(players) == 2 and game_data.ai is None:
         emit("game_started", {
             "game_id": game_id,
-            "board": game_data["game"].board,
+            "board": game_data.game.board,
             "turn": -1,
-            "players": [{"id": p.id, "name": p.name} for p in players]
-        }, room=game_id)
+            "players": broadcaster.players(game_id, game_data)
+        }, room=[game_id, protocol.v2_room(game_id)])
+
 
-    print("=== JOIN GAME COMPLETE ===\n")
+@socketio.on("watch_game")
+def handle_watch_game(data):
+    """観戦: プレイヤーにならずに局面を受け取る（読み取り専用。人数の上限は無い）"""
+    game_id = data.get("game_id")
+    game_data = game_manager.get_game(game_id)
+    if not game_data:
+        emit("error", {"message": f"Game not found: {game_id}"}, room=request.sid)
+        return
+    join_room(protocol.watch_room(game_id))
+    emit("watching", {"game_id": game_id, "players": broadcaster.players(game_id, game_data)},
+         room=request.sid)
+    broadcaster.watch(game_id, request.sid)
 
-    
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Socket.IO Events: Move Handling
@@ -181,139 +301,246 @@ def handle_move(data):
 
     game_data = game_manager.get_game(game_id)
     # … your existing validation here …
+    if not game_data:
+        emit("error", {"message": f"Game not found: {game_id}"}, room=request.sid)
+        return
+    if not is_player(game_data, player_id):
+        emit("error", {"message": "Spectators cannot make moves"}, room=request.sid)
+        return
 
     # 1) Apply the human move and broadcast immediately
-    
-    result = game_data["game"].make_move(row, col)
-    # handle_move関数内のhuman_payloadを修正
-    human_payload = {
-    "board": game_data["game"].board,
-    "turn": game_data["game"].turn,
-    "last_move": [row, col],
-    "status": result["status"],
-    "players": [{"id": p.id, "name": p.name} for p in game_data["players"]],
-    # 評価値と手番情報を追加
-    "eval": -game_data["ai"].evaluate(game_data["game"]) if "ai" in game_data else 0,
-    "last_move_color": -1  # 人間は常に黒
-    }
-    emit("game_state", human_payload, room=game_id)
+    color = game_data.game.turn
+    result = game_data.play(row, col)
+    if result["status"] not in ("success", "pass", "game_over"):
+        # 不正な手: 局面は変わらないので v2 のクライアントには現在の局面を送り直す
+        if protocol.requested_protocol(data) == protocol.PROTOCOL_V2:
+            emit("game_snapshot", broadcaster.snapshot(game_id, game_data), room=request.sid)
+            return
+    else:
+        if not game_manager.save_game(game_id, game_data):
+            emit("error", {"message": "Game was updated elsewhere; please retry"},
+                 room=request.sid)
+            return
+        if result["status"] == "game_over":
+            game_manager.archive_game(game_data)
+    human_payload = dict(
+        broadcaster.state(game_id, game_data, result["status"]),
+        last_move=[row, col],
+        last_move_color=-1,  # 人間は常に黒
+    )
+    # AI 対戦の評価値はプールで計算して後から move_eval で送る（send_move_eval）
+    if game_data.ai is None:
+        human_payload["eval"] = 0
+    if "move" in result:
+        extra = {"eval": 0} if game_data.ai is None else {}
+        if result["status"] == "game_over":
+            extra["score"] = result["score"]
+        broadcaster.publish(game_id, game_data, "game_state", human_payload, protocol.delta(
+            game_data, result["move"], color, result["flips"], result["status"], **extra))
+    else:
+        emit("game_state", human_payload, room=game_id)
+
+    if game_data.ai is not None and "move" in result:
+        socketio.start_background_task(send_move_eval, game_id, game_data.seq, game_data.ai,
+                                       game_data.game.copy(), color)
 
     # 2) If it’s an AI game and not over, schedule the AI move in background
-    if "ai" in game_data and result["status"] != "game_over" and game_data["game"].turn == 1:
-        # start background task so this handler returns immediately
-        socketio.start_background_task(run_ai_move, game_id)
+    if game_data.ai is not None and result["status"] != "game_over" and game_data.game.turn == 1:
+        # ジョブとして投入し、このハンドラはすぐ返す（探索中に重ねて来ても1回にまとめる）
+        ai_scheduler.submit(game_id, run_ai_move, game_id)
 
 
-def run_ai_move(game_id):
+def send_move_eval(game_id, seq, ai, game, color):
+    """color が打った後の局面 game（通し番号 seq）の評価値を送る。
+    クライアントはこれを受けて評価音を鳴らす"""
+    payload = {"game_id": game_id, "seq": seq, "color": color,
+               "eval": -ai_executor.evaluate(ai, game)}
+    socketio.emit("move_eval", payload, room=game_id)
+    socketio.emit("move_eval", payload, room=protocol.v2_room(game_id))
+
+
+def run_ai_move(job, game_id):
+    """ai_scheduler のジョブ。job.cancelled になったら結果を捨てて終わる"""
+    started = time.monotonic()
     game_data = game_manager.get_game(game_id)
     if not game_data:
         return
 
-    # 1) 現在の turn を再取得（White=1 のはず）
-    turn = game_data["game"].turn
+    # 1) 現在の turn を再取得（White=1 でなければ、まとめられた投入なので何もしない）
+    turn = game_data.game.turn
+    if turn != 1 or game_data.ai is None or game_data.game.check_game_over():
+        return
 
     # 2) White に合法手が無いならパス
     #    （has_valid_move が False のときだけパス）
-    if not game_data["game"].has_valid_move(turn):
-        game_data["game"].turn = -1
-        socketio.emit("game_state", {
-            "board":   game_data["game"].board,
-            "turn":    -1,
-            "status":  "pass",
-            "players": [{"id": p.id, "name": p.name} for p in game_data["players"]]
-        }, room=game_id)
+    if not game_data.game.has_valid_move(turn):
+        ai_pass(game_id, game_data, turn)
         return
 
     # 3) AI is thinking… を通知
     socketio.emit("ai_thinking", {}, room=game_id)
-
-    # 4) 反転検出用に盤面をコピー
-    before = [row[:] for row in game_data["game"].board]
+    socketio.emit("ai_thinking", {}, room=protocol.v2_room(game_id))
 
     # 5) Minimax で最良手を探す
-    best = game_data["ai"].choose_move(game_data["game"])
-    print(f"[AI] minimax chose: {best}")  # デバッグログ
+    # （探索の統計は game_data.ai.last_stats。ログ出力は AI_STATS_LOG_LEVEL で設定）
+    # 前の手の後に先読みしていた局面なら、その探索の結果を使う
+    seq = game_data.seq
+    time_limit = search_budget.time_limit(game_data.ai)
+    best = ai_executor.choose_move(game_data.ai, game_data.game, time_limit, room=game_id,
+                                   stop=job.is_cancelled)
+    # 探索中に取り消された・局面が変わった（メモリストアではレコードを共有している）
+    if job.cancelled or game_data.seq != seq:
+        return
+    budget = search_budget.used(game_data.ai, time_limit, game_data.ai.last_stats)
 
     # ← ここを追加 →
-    valid = game_data["game"].valid_moves(turn)
+    valid = game_data.game.valid_moves(turn)
     # minimax が返した手が不正 or None のときは合法手から取得
     if best not in valid:
-        print(f"[AI] chosen move {best} not in valid moves, falling back")
+        logger.warning("[AI] chosen move %s not in valid moves, falling back", best)
         best = valid[0] if valid else None
 
     # それでも None ならパス処理
     if best is None:
-        game_data["game"].turn = -turn
-        socketio.emit("game_state", {
-            "board":   game_data["game"].board,
-            "turn":    game_data["game"].turn,
-            "status":  "pass",
-            "players": [{"id": p.id, "name": p.name} for p in game_data["players"]]
-        }, room=game_id)
-        return
-
-        # 正常に一手を打つ
-        r, c = best
-        print(f"[AI] FINAL move to apply: {best}")
-        ai_res = game_data["game"].make_move(r, c)
-        print(f"[AI] make_move status: {ai_res['status']}")
-        
-               # after ボードの状況を出力
-        print(f"[AI] board after:  {game_data['game'].board[r][c]}, turn now: {game_data['game'].turn}, ai_res: {ai_res}")
-    
-    # 7) それでも見つからなければ最終パス
-    if best is None:
-        game_data["game"].turn = -1
-        socketio.emit("game_state", {
-            "board":   game_data["game"].board,
-            "turn":    -1,
-            "status":  "pass",
-            "players": [{"id": p.id, "name": p.name} for p in game_data["players"]]
-        }, room=game_id)
+        ai_pass(game_id, game_data, turn)
         return
 
     # 8) White の一手を打つ
     r, c   = best
-    ai_res = game_data["game"].make_move(r, c)
-    after  = game_data["game"].board
+    ai_res = game_data.play(r, c)
+    if not game_manager.save_game(game_id, game_data):
+        return  # 探索中に局面が変わった・ルームが削除された
+    if ai_res["status"] == "game_over":
+        game_manager.archive_game(game_data)
     # 評価値を取得するために一時的に評価
-    eval_score = game_data["ai"].evaluate(game_data["game"])
-    # 9) new_stone と flips リストを検出
-    new_stone = None
-    flips     = []
-    for y in range(8):
-        for x in range(8):
-            if before[y][x] == 0 and after[y][x] == turn:
-                new_stone = {"y": y, "x": x}
-            elif before[y][x] != 0 and before[y][x] != after[y][x]:
-                flips.append({"y": y, "x": x})
-
-    # 10) delay を置いてから emit
+    eval_score = ai_executor.evaluate(game_data.ai, game_data.game)
+    # 人間の手番になったら、人間が指しそうな手の後の局面を先読みしておく
+    # （下の演出用の待ち時間の間にも進む）
+    if ai_res["status"] == "success" and game_data.game.turn == -turn:
+        ai_executor.ponder(game_data.ai, game_data.game, game_id)
+    # 9) new_stone と flips リスト（反転した石はエンジンが返したマスクから作る）
+    new_stone = {"y": r, "x": c}
+    flips     = [{"y": sq // 8, "x": sq % 8} for sq in protocol.squares(ai_res["flips"])]
+
+    # 10) delay を置いてから emit（探索にかかった時間も待ち時間に含める）
+    # 待っている間は探索しないので、同時実行の枠は先に返す
+    job.release()
     delay = BASE_DELAY + PER_FLIP_SEC * len(flips)
-    time.sleep(delay)
+    socketio.sleep(max(0.0, delay - (time.monotonic() - started)))
+    if job.cancelled:
+        return
 
     payload = {
-        "board":      after,
-        "turn":       game_data["game"].turn,
+        **broadcaster.state(game_id, game_data, ai_res["status"]),
         "last_move":  [r, c],
-        "status":     ai_res["status"],
-        "players":    [{"id": p.id, "name": p.name} for p in game_data["players"]],
         "new_stone":  new_stone,
         "flips":      flips,
         "eval": -eval_score, # 評価値の符号を反転（AIは白のため）
         "last_move_color": 1,  # AIは常に白
-        "scores": {
-            "white": sum(cell == 1 for row in after for cell in row),
-            "black": sum(cell == -1 for row in after for cell in row)
-        }
+        "scores": game_data.game.scores(),
+        "budget": budget,  # 実際に使った持ち時間と、その予算で探索できた深さ
     }
+    extra = {"eval": -eval_score, "budget": budget}
     if ai_res["status"] == "game_over":
-        payload["score"] = {
+        payload["score"] = extra["score"] = {
             "white": int(ai_res["score"]["white"]),
             "black": int(ai_res["score"]["black"])
         }
 
-    socketio.emit("ai_move", payload, room=game_id)
+    broadcaster.publish(game_id, game_data, "ai_move", payload, protocol.delta(
+        game_data, ai_res["move"], turn, ai_res["flips"], ai_res["status"], **extra))
+
+
+def ai_pass(game_id, game_data, turn):
+    """AI（turn）に打てる手が無いので手番を人間に戻す"""
+    game_data.pass_turn()
+    if not game_manager.save_game(game_id, game_data):
+        return
+    broadcaster.publish(game_id, game_data, "game_state",
+                        broadcaster.state(game_id, game_data, "pass"),
+                        protocol.delta(game_data, None, turn, 0, "pass"))
+
+
+@socketio.on("analyze")
+def handle_analyze(data):
+    """ヒント・検討: 今の局面の全合法手の評価値を要求したクライアントに返す。
+    time（秒。ANALYSIS_TIME_STEP 単位に丸める）・level で予算を指定できる。
+    計算中の検討はクライアントごと・ルームごとに上限まで"""
+    game_id = data.get("game_id")
+    game_data = game_manager.get_game(game_id)
+    if not game_data:
+        emit("error", {"message": f"Game not found: {game_id}"}, room=request.sid)
+        return
+    try:
+        time_limit = float(data.get("time", ANALYSIS_TIME))
+    except (TypeError, ValueError):
+        time_limit = ANALYSIS_TIME
+    if not math.isfinite(time_limit):
+        time_limit = ANALYSIS_TIME
+    time_limit = min(max(round(time_limit / ANALYSIS_TIME_STEP), 1) * ANALYSIS_TIME_STEP,
+                     ANALYSIS_MAX_TIME)
+    level = data.get("level", ANALYSIS_LEVEL)
+    if not isinstance(level, (int, float)) or level not in OthelloAI.LEVEL_BUDGET or level == 0.5:
+        level = ANALYSIS_LEVEL
+    keys = (("sid", request.sid), ("room", game_id))
+    if (analyses_running[keys[0]] >= ANALYSIS_MAX_PER_SID
+            or analyses_running[keys[1]] >= ANALYSIS_MAX_PER_ROOM):
+        emit("error", {"message": "Too many analyses in progress"}, room=request.sid)
+        return
+    for key in keys:
+        analyses_running[key] += 1
+    socketio.start_background_task(run_analysis, request.sid, game_id, game_data.seq,
+                                   game_data.game.copy(), level, time_limit)
+
+
+def run_analysis(sid, game_id, seq, game, level, time_limit):
+    # 同じ局面・予算の検討は ai_executor が覚えているので、観戦者が同時に求めても1回で済む
+    try:
+        result = ai_executor.analyze(level, game, time_limit)
+    finally:
+        for key in (("sid", sid), ("room", game_id)):
+            analyses_running[key] -= 1
+            if analyses_running[key] <= 0:
+                del analyses_running[key]
+    socketio.emit("analysis", {
+        "game_id": game_id,
+        "seq": seq,
+        "turn": game.turn,
+        "level": level,
+        "time": time_limit,
+        "depth": result["depth"],
+        "mode": result["mode"],
+        "moves": result["moves"],
+    }, room=sid)
+
+
+@socketio.on("undo")
+def handle_undo(data):
+    """AI 対戦で人間（黒）の最後の手の前まで戻す（人間の手番のときだけ）"""
+    game_id = data.get("game_id")
+    game_data = game_manager.get_game(game_id)
+    if not game_data:
+        emit("error", {"message": f"Game not found: {game_id}"}, room=request.sid)
+        return
+    if not is_player(game_data, data.get("player_id")):
+        emit("error", {"message": "Spectators cannot undo moves"}, room=request.sid)
+        return
+    if game_data.ai is None or game_data.game.turn != -1 or game_data.game.check_game_over():
+        emit("error", {"message": "Undo is only available on your turn in an AI game"},
+             room=request.sid)
+        return
+    index = game_data.log.last_move_by(-1)
+    if index is None:
+        emit("error", {"message": "Nothing to undo"}, room=request.sid)
+        return
+
+    ai_executor.cancel_ponder(game_id)
+    game_data.undo(len(game_data.log) - index)
+    if not game_manager.save_game(game_id, game_data):
+        emit("error", {"message": "Game was updated elsewhere; please retry"}, room=request.sid)
+        return
+    # 局面が戻るので v2 のクライアントにはスナップショットを送る
+    broadcaster.publish(game_id, game_data, "game_state", broadcaster.state(game_id, game_data))
 
 
 
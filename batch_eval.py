@@ -0,0 +1,117 @@
+"""兄弟局面をまとめて評価する NumPy 実装
+
+OthelloAI.evaluate と同じ項（位置評価・モビリティ・コーナー・フロンティア・石数差）を、
+uint64 のビットボード配列に対して1回のベクトル演算で計算する。
+NumPy が無い環境では available() が False になり、呼び出し側は1局面ずつ評価する。
+"""
+from othello import VALUE_TABLE
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy はオプション
+    np = None
+
+
+def available() -> bool:
+    return np is not None
+
+
+if np is not None:
+    _U64 = np.uint64
+    _INNER_COLS = 0x7E7E7E7E7E7E7E7E
+    _FULL = 0xFFFFFFFFFFFFFFFF
+    _ONE, _EIGHT = _U64(1), _U64(8)
+    _NOT_A_FILE = _U64(0xFEFEFEFEFEFEFEFE)
+    _NOT_H_FILE = _U64(0x7F7F7F7F7F7F7F7F)
+    _CORNERS = (1 << 0) | (1 << 7) | (1 << 56) | (1 << 63)
+
+    # 4方向（横・縦・斜め2本）を1つの配列演算で処理するためのシフト量と相手石マスク
+    _DIR_SHIFTS = np.array([1, 8, 7, 9], dtype=_U64)[:, None]
+    _DIR_MASKS = np.array([_INNER_COLS, _FULL, _INNER_COLS, _INNER_COLS], dtype=_U64)[:, None]
+
+    # 位置評価は「同じ重みのマス」ごとのマスクに分けて popcount する。
+    # 先頭に全体・コーナーのマスクも並べ、石数・コーナー数も同じ popcount で求める
+    _weights = [w for row in VALUE_TABLE for w in row]
+    _weight_values = [w for w in sorted(set(_weights)) if w != 0]
+    _COUNT_MASKS = np.array(
+        [_FULL, _CORNERS] +
+        [sum(1 << sq for sq in range(64) if _weights[sq] == w) for w in _weight_values],
+        dtype=_U64)[None, :]
+    _WEIGHT_VALUES = np.array(_weight_values, dtype=np.int64)
+
+    if hasattr(np, "bitwise_count"):
+        _popcount = np.bitwise_count
+    else:  # NumPy < 2.0
+        _POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+        def _popcount(x):
+            return _POP8[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+
+def pack_boards(boards):
+    """(N, 8, 8) の盤面（黒=-1, 白=1, 空=0）を (blacks, whites) の uint64 配列に変換"""
+    arr = np.asarray(boards).reshape(-1, 64)
+    blacks = np.packbits(arr == -1, axis=1, bitorder="little").view("<u8").ravel()
+    whites = np.packbits(arr == 1, axis=1, bitorder="little").view("<u8").ravel()
+    return blacks.astype(_U64), whites.astype(_U64)
+
+
+def as_bitboards(values):
+    """Python int のリストなどを uint64 配列にする"""
+    return np.asarray(values, dtype=_U64)
+
+
+def legal_moves(p, o):
+    """bitboard.legal_moves のベクトル版（8方向を (4, N) の配列でまとめて走査）"""
+    m = o[None, :] & _DIR_MASKS
+    pp = p[None, :]
+    t = m & (pp << _DIR_SHIFTS)
+    for _ in range(5):
+        t |= m & (t << _DIR_SHIFTS)
+    moves = t << _DIR_SHIFTS
+    t = m & (pp >> _DIR_SHIFTS)
+    for _ in range(5):
+        t |= m & (t >> _DIR_SHIFTS)
+    moves |= t >> _DIR_SHIFTS
+    return np.bitwise_or.reduce(moves, axis=0) & ~(p | o)
+
+
+def neighbours(x):
+    """bitboard.neighbours のベクトル版"""
+    e = (x << _ONE) & _NOT_A_FILE
+    w = (x >> _ONE) & _NOT_H_FILE
+    row = x | e | w
+    return e | w | (row << _EIGHT) | (row >> _EIGHT)
+
+
+def evaluate(blacks, whites, weight_table):
+    """白から見た評価値を float64 配列で返す。
+
+    weight_table は石数 (0..64) ごとの (w_pos, w_mob, w_cor, w_fro, w_diff) を並べた
+    (65, 5) の配列で、OthelloAI.evaluate と同じ重みを使うこと。
+    """
+    n = len(blacks)
+    stones = np.concatenate((whites, blacks))      # [白..., 黒...]
+    others = np.concatenate((blacks, whites))
+
+    # 石数・コーナー・重みごとの石数を白黒まとめて popcount
+    counts = _popcount(stones[:, None] & _COUNT_MASKS).astype(np.int64)
+    diff = counts[:n] - counts[n:]                  # 白 - 黒
+    white_count, black_count = counts[:n, 0], counts[n:, 0]
+    position_score = diff[:, 2:] @ _WEIGHT_VALUES
+    corner_score = 100 * diff[:, 1]
+
+    # モビリティとフロンティア（空きマスに隣接する石）
+    mobility = _popcount(legal_moves(stones, others)).astype(np.int64)
+    mobility_score = mobility[:n] - mobility[n:]
+    empty_nb = neighbours(~(blacks | whites))
+    front = _popcount(stones & np.concatenate((empty_nb, empty_nb))).astype(np.int64)
+    frontier_penalty = front[n:] - front[:n]
+
+    weights = weight_table[white_count + black_count]
+    # evaluate と同じ順序で足し合わせ、スカラー版と同じ浮動小数点結果にする
+    return (position_score * weights[:, 0] +
+            mobility_score * weights[:, 1] +
+            corner_score * weights[:, 2] +
+            frontier_penalty * weights[:, 3] +
+            (white_count - black_count) * weights[:, 4])
@@ -0,0 +1,244 @@
+"""エンジンのベンチマーク
+
+  perft   初期局面から深さ d までの局面数を数え、既知の値と照合する。
+          合法手生成・着手の正しさの確認と、その速度の計測を兼ねる。
+          パスも1手として数える。
+            bitboard : 探索用 API（apply_move / undo_move）
+            api      : 従来 API（valid_moves / make_move。局面はコピーする）
+  search  固定の中盤・終盤局面をレベルごとに choose_move で探索し、
+          NPS・深さごとの到達時間・置換表ヒット率を記録する。
+
+結果は JSON で書き出すので、--compare で過去の結果と比べられる。
+
+    python benchmark.py --out bench.json
+    python benchmark.py --perft-depth 9 --levels 3 4 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from typing import Dict, List
+
+import batch_eval
+import bitboard
+from othello import OthelloGame
+from othello_ai import EVALUATORS, OthelloAI
+
+# 初期局面からの perft の既知の値（パスも1手として数える）
+PERFT_RESULTS = {
+    1: 4, 2: 12, 3: 56, 4: 244, 5: 1396, 6: 8200, 7: 55092,
+    8: 390216, 9: 3005288, 10: 24571284, 11: 212258800,
+}
+
+# 探索ベンチマークの局面（初期局面からの棋譜。列 a-h・行 1-8）
+POSITIONS = {
+    "midgame-20": "f5f6e6d6c3e3d7c6f7g8f2f4e7d8b6a6",
+    "midgame-30": "d3c3c4c5f6f4f5f3f2g4e3g5h4f1g2e2c6g3e6c7c2g1b7a8b4b3",
+    "midgame-40": "c4c5e6c3b4f6b5c6d3e3f3a3a4e7e8d6d7b3e2c7c8a5f5f8a6d8g8a7f7b6c2c1b7f4b1a1",
+    "endgame-16": "d3c5c6c7e6f3e3f2c3b3d6f6c4b5b4a3c2d1g3h3c1f4c8b6e1d2g5g4a5a6g2a4a2b8b7a1a8h6f1a7f5h1d7h4",
+    "endgame-14": "d3c3c4c5b3c2f6e2b4a4d2a3c1e1c6b2f1g7e6d6h8g6a1g1c7b7a8e7h6d7a5a6f8b6d1f2h1e3c8f5g4h7g2f7g5a7",
+    "endgame-12": "c4c3d3e3f2b5b3b4c5b2a4f3d2c2a1f1b6c6d6c7e6c1e1d1a3a2g3h3d8a5a6e7d7e8e2c8f8g8f4f6g2h1f5b1g4a7a8g5",
+    "endgame-10": "f5f6e6d6c3e3d7c6f7g8f2f4e7d8b6a6e8f8c8b8b5a4g4e2c5g5g7g3a5d3a3h8h5h4a7h6h2c4d2f3g6c2b3c7c1e1d1b1g1b4",
+}
+
+
+def parse_moves(transcript: str) -> OthelloGame:
+    """棋譜（"f5d6c3..."）を初期局面から make_move で並べた局面を返す"""
+    game = OthelloGame()
+    for i in range(0, len(transcript), 2):
+        col = "abcdefgh".index(transcript[i])
+        row = int(transcript[i + 1]) - 1
+        result = game.make_move(row, col)
+        if result["status"] not in ("success", "pass"):
+            raise ValueError(f"illegal move {transcript[i:i + 2]} in {transcript}")
+    return game
+
+
+# ----------------------------------------------------------------------------
+# perft
+# ----------------------------------------------------------------------------
+def perft(game: OthelloGame, depth: int, passed: bool = False) -> int:
+    """apply_move / undo_move で数える perft（深さ 1 は合法手の数で済ませる）"""
+    if depth == 0:
+        return 1
+    mask = game.legal_mask(game.turn)
+    if not mask:
+        if passed:
+            return 1  # 終局
+        undo = game.apply_move(-1)
+        n = perft(game, depth - 1, True)
+        game.undo_move(undo)
+        return n
+    if depth == 1:
+        return mask.bit_count()
+    total = 0
+    for sq in bitboard.iter_squares(mask):
+        undo = game.apply_move(sq)
+        total += perft(game, depth - 1)
+        game.undo_move(undo)
+    return total
+
+
+def perft_api(game: OthelloGame, depth: int) -> int:
+    """valid_moves / make_move で数える perft。
+    make_move は相手がパスのとき手番を変えないので、そのパスを1手として数える"""
+    if depth == 0:
+        return 1
+    total = 0
+    for r, c in game.valid_moves(game.turn):
+        child = game.copy()
+        status = child.make_move(r, c)["status"]
+        if status == "game_over" or depth == 1:
+            total += 1
+        elif status == "pass":
+            total += perft_api(child, depth - 2) if depth > 2 else 1
+        else:
+            total += perft_api(child, depth - 1)
+    return total
+
+
+def run_perft(max_depth: int, method: str, log=print) -> List[Dict]:
+    count = perft if method == "bitboard" else perft_api
+    results = []
+    for depth in range(1, max_depth + 1):
+        start = time.perf_counter()
+        nodes = count(OthelloGame(), depth)
+        elapsed = time.perf_counter() - start
+        expected = PERFT_RESULTS.get(depth)
+        ok = expected is None or nodes == expected
+        results.append({"method": method, "depth": depth, "nodes": nodes, "expected": expected,
+                        "ok": ok, "elapsed": elapsed,
+                        "nps": nodes / elapsed if elapsed > 0 else 0.0})
+        log(f"perft[{method}] depth={depth} nodes={nodes} "
+            f"{'ok' if ok else f'MISMATCH (expected {expected})'} "
+            f"time={elapsed:.3f}s nps={results[-1]['nps']:.0f}")
+    return results
+
+
+# ----------------------------------------------------------------------------
+# 探索
+# ----------------------------------------------------------------------------
+def run_search(levels, positions=POSITIONS, time_limit=None, executor=None, log=print,
+               evaluator=None) -> List[Dict]:
+    """各レベル・各局面を新しい AI（置換表も空）で1回探索する。定跡は使わない"""
+    results = []
+    for level in levels:
+        for name, transcript in positions.items():
+            game = parse_moves(transcript)
+            ai = OthelloAI(level=level, collect_stats=True, evaluator=evaluator)
+            ai.use_book = False
+            if executor is not None:
+                move = executor.choose_move(ai, game, time_limit)
+            else:
+                move = ai.choose_move(game, time_limit)
+            stats = ai.last_stats
+            results.append({"level": level, "position": name, "move": move, **stats.as_dict()})
+            log(f"search level={level} {name}: move={move} {stats}")
+    return results
+
+
+def summarize(search: List[Dict]) -> Dict:
+    """レベルごとの合計（NPS はノード数の合計 / 時間の合計）"""
+    summary = {}
+    for r in search:
+        s = summary.setdefault(str(r["level"]), {"positions": 0, "nodes": 0, "elapsed": 0.0,
+                                                  "depth": 0, "tt_probes": 0, "tt_hits": 0})
+        s["positions"] += 1
+        s["nodes"] += r["nodes"]
+        s["elapsed"] += r["elapsed"]
+        s["depth"] += r["depth"]
+        s["tt_probes"] += r.get("tt_probes", 0)
+        s["tt_hits"] += r.get("tt_hits", 0)
+    for s in summary.values():
+        s["nps"] = s["nodes"] / s["elapsed"] if s["elapsed"] > 0 else 0.0
+        s["tt_hit_rate"] = s["tt_hits"] / s["tt_probes"] if s["tt_probes"] else None
+        s["mean_depth"] = s.pop("depth") / s["positions"]
+    return summary
+
+
+def compare(current: Dict, baseline: Dict, log=print):
+    """perft と探索の NPS を過去の結果と比べる"""
+    base_perft = {(r["method"], r["depth"]): r for r in baseline.get("perft", [])}
+    for r in current.get("perft", []):
+        b = base_perft.get((r["method"], r["depth"]))
+        if b and b["nps"]:
+            log(f"perft[{r['method']}] depth={r['depth']}: "
+                f"nps {b['nps']:.0f} -> {r['nps']:.0f} ({r['nps'] / b['nps']:.2f}x)")
+    base_summary = baseline.get("summary", {})
+    for level, s in current.get("summary", {}).items():
+        b = base_summary.get(level)
+        if b and b["nps"]:
+            log(f"search level={level}: nps {b['nps']:.0f} -> {s['nps']:.0f} "
+                f"({s['nps'] / b['nps']:.2f}x), mean depth {b['mean_depth']:.2f} -> "
+                f"{s['mean_depth']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Othello engine benchmark")
+    parser.add_argument("--perft-depth", type=int, default=8, help="perft の最大深さ（0 で省略）")
+    parser.add_argument("--perft-method", choices=("bitboard", "api", "both"), default="both")
+    parser.add_argument("--api-perft-depth", type=int, default=6,
+                        help="api の perft の最大深さ（make_move は局面をコピーするので遅い）")
+    parser.add_argument("--levels", type=float, nargs="*", default=[1, 2, 3, 4, 5],
+                        help="探索ベンチマークのレベル（指定なしで省略）")
+    parser.add_argument("--time", type=float, default=None,
+                        help="1局面あたりの探索時間(秒)。省略時はレベルの予算")
+    parser.add_argument("--evaluator", choices=EVALUATORS, default=None,
+                        help="評価関数（省略時は環境変数 AI_EVALUATOR。--pool のワーカーは環境変数に従う）")
+    parser.add_argument("--pool", action="store_true",
+                        help="AIExecutor のプロセスプールで探索する（レベル4以上は並列）")
+    parser.add_argument("--out", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--compare", help="比較する過去の JSON ファイル")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": batch_eval.available(),
+            "time_limit": args.time,
+            "pool": args.pool,
+            "evaluator": args.evaluator,
+        },
+        "perft": [],
+        "search": [],
+    }
+    if args.perft_depth > 0:
+        methods = ("bitboard", "api") if args.perft_method == "both" else (args.perft_method,)
+        for method in methods:
+            depth = args.perft_depth if method == "bitboard" else min(args.perft_depth,
+                                                                       args.api_perft_depth)
+            report["perft"] += run_perft(depth, method)
+
+    levels = [int(lv) if float(lv).is_integer() else lv for lv in args.levels]
+    if levels:
+        executor = None
+        if args.pool:
+            from ai_executor import AIExecutor
+            executor = AIExecutor(backend="process")
+        try:
+            report["search"] = run_search(levels, time_limit=args.time, executor=executor,
+                                          evaluator=args.evaluator)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        report["summary"] = summarize(report["search"])
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+    if not all(r["ok"] for r in report["perft"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""ビットボード演算
+
+黒・白それぞれの石を 64bit 整数1つで表す。
+マス番号は sq = row * 8 + col、対応するビットは 1 << sq。
+"""
+import random
+from typing import Iterator, List, Tuple
+
+FULL = 0xFFFFFFFFFFFFFFFF
+NOT_A_FILE = 0xFEFEFEFEFEFEFEFE  # col 0 以外
+NOT_H_FILE = 0x7F7F7F7F7F7F7F7F  # col 7 以外
+CORNERS = (1 << 0) | (1 << 7) | (1 << 56) | (1 << 63)
+# 横・斜め方向の走査で盤端を跨がないよう、A列/H列を除いたマスク
+INNER_COLS = 0x7E7E7E7E7E7E7E7E
+
+# 初期配置 (d4, e5 = 白 / e4, d5 = 黒)
+INIT_BLACK = (1 << 28) | (1 << 35)
+INIT_WHITE = (1 << 27) | (1 << 36)
+
+
+def legal_moves(p: int, o: int) -> int:
+    """手番側 p が打てるマスをビットマスクで返す（o は相手の石）"""
+    h = o & INNER_COLS
+    empty = ~(p | o) & FULL
+    moves = 0
+    for d, m in ((1, h), (8, o), (7, h), (9, h)):
+        # 正方向（左シフト）
+        t = m & (p << d)
+        t |= m & (t << d)
+        t |= m & (t << d)
+        t |= m & (t << d)
+        t |= m & (t << d)
+        t |= m & (t << d)
+        moves |= t << d
+        # 逆方向（右シフト）
+        t = m & (p >> d)
+        t |= m & (t >> d)
+        t |= m & (t >> d)
+        t |= m & (t >> d)
+        t |= m & (t >> d)
+        t |= m & (t >> d)
+        moves |= t >> d
+    return moves & empty
+
+
+def flips(p: int, o: int, sq: int) -> int:
+    """sq に打ったときに返る相手の石をビットマスクで返す（空きマスかは見ない）"""
+    x = 1 << sq
+    h = o & INNER_COLS
+    result = 0
+    for d, m in ((1, h), (8, o), (7, h), (9, h)):
+        f = 0
+        t = (x << d) & m
+        while t:
+            f |= t
+            t <<= d
+            if t & p:
+                result |= f
+                break
+            t &= m
+        f = 0
+        t = (x >> d) & m
+        while t:
+            f |= t
+            t >>= d
+            if t & p:
+                result |= f
+                break
+            t &= m
+    return result
+
+
+def neighbours(x: int) -> int:
+    """x の石に8方向で隣接するマスのマスク"""
+    e = (x << 1) & NOT_A_FILE
+    w = (x >> 1) & NOT_H_FILE
+    row = x | e | w
+    return (e | w | (row << 8) | (row >> 8)) & FULL
+
+
+def frontier(own: int, empty: int) -> int:
+    """own のうち空きマスに隣接している石（フロンティア石）"""
+    return own & neighbours(empty)
+
+
+def count(x: int) -> int:
+    return x.bit_count()
+
+
+def iter_squares(mask: int) -> Iterator[int]:
+    """mask の立っているビットのマス番号を小さい順に返す"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def to_board(black: int, white: int) -> List[List[int]]:
+    """ビットボードを従来の 8x8 リスト形式（黒=-1, 白=1, 空=0）に変換"""
+    return [[-1 if (black >> sq) & 1 else 1 if (white >> sq) & 1 else 0
+             for sq in range(r * 8, r * 8 + 8)]
+            for r in range(8)]
+
+
+def from_board(board: List[List[int]]) -> Tuple[int, int]:
+    """8x8 リスト形式の盤面を (black, white) のビットボードに変換"""
+    black = white = 0
+    for r in range(8):
+        for c in range(8):
+            cell = board[r][c]
+            if cell == -1:
+                black |= 1 << (r * 8 + c)
+            elif cell == 1:
+                white |= 1 << (r * 8 + c)
+    return black, white
+
+
+# ----------------------------------------------------------------------------
+# Zobrist ハッシュ
+# ----------------------------------------------------------------------------
+def _zobrist_keys():
+    rng = random.Random(0x0De110)  # 全プロセスで同じ値になるよう固定シード
+    black = [rng.getrandbits(64) for _ in range(64)]
+    white = [rng.getrandbits(64) for _ in range(64)]
+    turn = rng.getrandbits(64)
+    # 反転は「黒→白 / 白→黒」どちらでも black[sq] ^ white[sq] を XOR すればよいので、
+    # 1バイト（8マス）ごとの組み合わせを前計算しておく
+    flip_bytes = []
+    for i in range(8):
+        table = [0] * 256
+        for byte in range(1, 256):
+            low = byte & -byte
+            sq = i * 8 + low.bit_length() - 1
+            table[byte] = table[byte ^ low] ^ black[sq] ^ white[sq]
+        flip_bytes.append(table)
+    return black, white, turn, flip_bytes
+
+
+ZOBRIST_BLACK, ZOBRIST_WHITE, ZOBRIST_TURN, _ZOBRIST_FLIP_BYTES = _zobrist_keys()
+
+
+def zobrist_hash(black: int, white: int) -> int:
+    """石の配置だけから Zobrist ハッシュを計算する（手番は含まない）"""
+    h = 0
+    for sq in iter_squares(black):
+        h ^= ZOBRIST_BLACK[sq]
+    for sq in iter_squares(white):
+        h ^= ZOBRIST_WHITE[sq]
+    return h
+
+
+def zobrist_flip(flips: int) -> int:
+    """flips の石の色を反転させたときにハッシュへ XOR する値"""
+    t = _ZOBRIST_FLIP_BYTES
+    return (t[0][flips & 0xFF] ^ t[1][(flips >> 8) & 0xFF] ^
+            t[2][(flips >> 16) & 0xFF] ^ t[3][(flips >> 24) & 0xFF] ^
+            t[4][(flips >> 32) & 0xFF] ^ t[5][(flips >> 40) & 0xFF] ^
+            t[6][(flips >> 48) & 0xFF] ^ t[7][flips >> 56])
+
+
+# ----------------------------------------------------------------------------
+# 位置評価（マスごとの重み）の差分計算用テーブル
+# ----------------------------------------------------------------------------
+def weight_byte_tables(weights: List[int]) -> List[List[int]]:
+    """64マスの重み weights について、1バイト（8マス）ごとの重みの和を前計算する"""
+    tables = []
+    for i in range(8):
+        table = [0] * 256
+        for byte in range(1, 256):
+            low = byte & -byte
+            table[byte] = table[byte ^ low] + weights[i * 8 + low.bit_length() - 1]
+        tables.append(table)
+    return tables
+
+
+def weighted_sum(tables: List[List[int]], mask: int) -> int:
+    """weight_byte_tables で作ったテーブルで mask の石の重みの和を求める"""
+    return (tables[0][mask & 0xFF] + tables[1][(mask >> 8) & 0xFF] +
+            tables[2][(mask >> 16) & 0xFF] + tables[3][(mask >> 24) & 0xFF] +
+            tables[4][(mask >> 32) & 0xFF] + tables[5][(mask >> 40) & 0xFF] +
+            tables[6][(mask >> 48) & 0xFF] + tables[7][mask >> 56])
+
+
+# ----------------------------------------------------------------------------
+# 盤面の対称変換（回転・反転の8通り）
+# ----------------------------------------------------------------------------
+def flip_vertical(x: int) -> int:
+    """上下反転 (row -> 7 - row)"""
+    return int.from_bytes(x.to_bytes(8, "little"), "big")
+
+
+def mirror_horizontal(x: int) -> int:
+    """左右反転 (col -> 7 - col)"""
+    x = ((x >> 1) & 0x5555555555555555) | ((x & 0x5555555555555555) << 1)
+    x = ((x >> 2) & 0x3333333333333333) | ((x & 0x3333333333333333) << 2)
+    x = ((x >> 4) & 0x0F0F0F0F0F0F0F0F) | ((x & 0x0F0F0F0F0F0F0F0F) << 4)
+    return x
+
+
+def flip_diagonal(x: int) -> int:
+    """対角線反転 ((row, col) -> (col, row))"""
+    t = 0x0F0F0F0F00000000 & (x ^ (x << 28))
+    x ^= t ^ (t >> 28)
+    t = 0x3333000033330000 & (x ^ (x << 14))
+    x ^= t ^ (t >> 14)
+    t = 0x5500550055005500 & (x ^ (x << 7))
+    x ^= t ^ (t >> 7)
+    return x
+
+
+def _symmetry(diagonal: bool, vertical: bool, horizontal: bool):
+    def transform(x: int) -> int:
+        if horizontal:
+            x = mirror_horizontal(x)
+        if vertical:
+            x = flip_vertical(x)
+        if diagonal:
+            x = flip_diagonal(x)
+        return x
+    return transform
+
+
+# SYMMETRIES[0] は恒等変換。SYMMETRY_INVERSE[i] は SYMMETRIES[i] の逆変換の番号
+SYMMETRIES = [_symmetry(d, v, h) for d in (False, True) for v in (False, True) for h in (False, True)]
+
+
+def _symmetry_inverse():
+    probe = 0x0123456789ABCDEF
+    return [next(j for j, g in enumerate(SYMMETRIES) if g(f(probe)) == probe) for f in SYMMETRIES]
+
+
+SYMMETRY_INVERSE = _symmetry_inverse()
+
+
+def transform_square(sym: int, sq: int) -> int:
+    """マス番号 sq を対称変換 SYMMETRIES[sym] で移した先のマス番号"""
+    return SYMMETRIES[sym](1 << sq).bit_length() - 1
@@ -0,0 +1,159 @@
+"""ルームへの状態の送信（観戦者向けのまとめ送り）
+
+プレイヤー（v1 のルーム game_id・v2 のルーム game_id#v2）には局面が変わるたびに
+すぐ送る。観戦者（game_id#watch。人数に上限は無く、読み取り専用）には
+COALESCE_INTERVAL 秒ごとにまとめて送る:
+  - その間の差分は game_deltas 1回にまとめる（差分で表せない変化があれば
+    最新のスナップショット1回）
+  - 観戦を始めた人へのスナップショットは、同じ間に来た全員に宛先のリストで
+    1回の emit で送る
+ルームの状態のペイロード（プレイヤー一覧・game_state・スナップショット）は
+局面の版（seq とプレイヤー）ごとに1回だけ作り、同じ版の間は使い回す。
+使い回すので、返された dict は書き換えないこと（足すときは dict(payload, ...)）。
+
+使い回すのは dict までで、エンコードしたパケットは覚えない（パケットは
+Flask-SocketIO の emit が作るので、ここからは渡せない）。エンコードは emit ごとに
+1回で、局面の更新1回につき v1 のルームと v2 のルームに1回ずつ、観戦者には
+まとめ送り1回につき1〜2回（観戦を始めた人へのスナップショットと、それ以外への送信）。
+観戦者の人数ではエンコードの回数は増えない。
+
+  BROADCAST_COALESCE  観戦者への送信をまとめる間隔（秒。デフォルト: 0.1）
+"""
+import os
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+
+import protocol
+
+DEFAULT_COALESCE = float(os.environ.get("BROADCAST_COALESCE", 0.1))
+
+
+class _Pending:
+    """次の送信までに溜まった観戦者向けの更新"""
+    __slots__ = ("deltas", "snapshot", "status", "sids")
+
+    def __init__(self):
+        self.deltas: List[Dict] = []
+        self.snapshot = False   # 差分で表せない変化があった
+        self.status = "ongoing"
+        self.sids: Set[str] = set()  # スナップショットを待っている観戦者
+
+
+class Broadcaster:
+    CACHE_ROOMS = 1024  # ペイロードを覚えておくルーム数（最後に使われた順に残す）
+
+    def __init__(self, socketio, get_game: Callable, interval: float = DEFAULT_COALESCE):
+        """get_game は game_id からルームのレコード（無ければ None）を返す関数"""
+        self.socketio = socketio
+        self.get_game = get_game
+        self.interval = interval
+        # game_id → ((seq, プレイヤー), {名前: ペイロード})
+        self._payloads: "OrderedDict[str, tuple]" = OrderedDict()
+        self._pending: Dict[str, _Pending] = {}
+        self.built = 0      # 作ったペイロードの数
+        self.reused = 0     # 使い回したペイロードの数
+        self.flushes = 0    # 観戦者への送信の回数
+        self.coalesced = 0  # まとめ送りに含めた更新の数
+
+    # ------------------------------------------------------------------
+    # 版ごとのペイロード
+    # ------------------------------------------------------------------
+    def _cached(self, game_id: str, game_data, name: str, build: Callable[[], object]):
+        version = (game_data.seq, tuple((p.id, p.name, p.color) for p in game_data.players))
+        entry = self._payloads.get(game_id)
+        if entry is None or entry[0] != version:
+            entry = self._payloads[game_id] = (version, {})
+            while len(self._payloads) > self.CACHE_ROOMS:
+                self._payloads.popitem(last=False)
+        self._payloads.move_to_end(game_id)
+        payloads = entry[1]
+        payload = payloads.get(name)
+        if payload is None:
+            payload = payloads[name] = build()
+            self.built += 1
+        else:
+            self.reused += 1
+        return payload
+
+    def players(self, game_id: str, game_data) -> List[Dict]:
+        return self._cached(game_id, game_data, "players", lambda: [
+            {"id": p.id, "name": p.name, "color": p.color} for p in game_data.players])
+
+    def state(self, game_id: str, game_data, status: str = "ongoing") -> Dict:
+        """v1 の game_state の内容 {board, turn, players, status}"""
+        return self._cached(game_id, game_data, "state:" + status, lambda: {
+            "board": game_data.game.board,
+            "turn": game_data.game.turn,
+            "players": self.players(game_id, game_data),
+            "status": status,
+        })
+
+    def snapshot(self, game_id: str, game_data, status: str = "ongoing") -> Dict:
+        return self._cached(game_id, game_data, "snapshot:" + status,
+                            lambda: protocol.snapshot(game_id, game_data, status))
+
+    def forget(self, game_id: str):
+        """削除したルームのペイロードと予約を捨てる"""
+        self._payloads.pop(game_id, None)
+        self._pending.pop(game_id, None)
+
+    # ------------------------------------------------------------------
+    # 送信
+    # ------------------------------------------------------------------
+    def publish(self, game_id: str, game_data, event: str, payload: Dict,
+                delta: Optional[Dict] = None):
+        """v1 のルームに event/payload を、v2 のルームに差分（省略時はスナップショット）を
+        すぐ送り、観戦者への送信を予約する"""
+        status = payload.get("status", "ongoing")
+        self.socketio.emit(event, payload, room=game_id)
+        if delta is not None:
+            self.socketio.emit("game_delta", delta, room=protocol.v2_room(game_id))
+        else:
+            self.socketio.emit("game_snapshot", self.snapshot(game_id, game_data, status),
+                               room=protocol.v2_room(game_id))
+        pending = self._pend(game_id)
+        pending.status = status
+        if delta is not None and not pending.snapshot:
+            pending.deltas.append(delta)
+        else:
+            pending.snapshot = True
+            pending.deltas = []
+        self.coalesced += 1
+
+    def watch(self, game_id: str, sid: str):
+        """sid に次のまとめ送りでスナップショットを送る（観戦を始めたとき）"""
+        self._pend(game_id).sids.add(sid)
+
+    def _pend(self, game_id: str) -> _Pending:
+        pending = self._pending.get(game_id)
+        if pending is None:
+            pending = self._pending[game_id] = _Pending()
+            self.socketio.start_background_task(self._flush, game_id)
+        return pending
+
+    def _flush(self, game_id: str):
+        """interval 秒待ってから、溜まった更新を観戦者に送る"""
+        self.socketio.sleep(self.interval)
+        pending = self._pending.pop(game_id, None)
+        if pending is None:
+            return
+        game_data = self.get_game(game_id)
+        if game_data is None:
+            return
+        self.flushes += 1
+        room = protocol.watch_room(game_id)
+        sids = list(pending.sids)
+        if sids:
+            # 観戦を始めた人には最新の局面を送る（溜まった差分はそこに含まれている）
+            self.socketio.emit("game_snapshot", self.snapshot(game_id, game_data, pending.status),
+                               room=sids)
+        if pending.snapshot:
+            self.socketio.emit("game_snapshot", self.snapshot(game_id, game_data, pending.status),
+                               room=room, skip_sid=sids or None)
+        elif pending.deltas:
+            self.socketio.emit("game_deltas", {
+                "v": protocol.PROTOCOL_V2,
+                "game_id": game_id,
+                "seq": pending.deltas[-1]["seq"],
+                "deltas": pending.deltas,
+            }, room=room, skip_sid=sids or None)
@@ -0,0 +1,157 @@
+"""終盤の完全読み
+
+空きマスが少なくなったら評価関数を使わず、最終的な石数差を最大化する手を
+最後まで読み切って求める。ビットボード (手番側 p, 相手 o) の negamax で、
+
+  - 空きが多いうちは相手の着手可能数が少ない手から読む（fastest-first）
+  - 空きが少なくなったら偶数理論（空きが奇数個の象限を優先）で並べる
+  - 残り1マス・2マスは専用の関数で直接計算する
+"""
+import time
+
+import bitboard
+
+_FULL = bitboard.FULL
+_flips = bitboard.flips
+_legal_moves = bitboard.legal_moves
+
+# 象限ごとのマスク（偶数理論の領域）
+QUADRANTS = (0x000000000F0F0F0F, 0x00000000F0F0F0F0,
+             0x0F0F0F0F00000000, 0xF0F0F0F000000000)
+
+
+class SolverAborted(Exception):
+    """時間・ノード数の上限に達したときに送出される"""
+
+
+def final_score(p: int, o: int) -> int:
+    """終局時の石数差（手番側から見た値）。空きマスは勝った側に加える"""
+    pc, oc = p.bit_count(), o.bit_count()
+    diff = pc - oc
+    if diff > 0:
+        return diff + (64 - pc - oc)
+    if diff < 0:
+        return diff - (64 - pc - oc)
+    return 0
+
+
+class EndgameSolver:
+    FASTEST_FIRST_MIN = 7   # 空きがこの数以上のノードでは fastest-first で並べる
+    CHECK_INTERVAL = 1024   # このノード数ごとに上限をチェック
+
+    def __init__(self, deadline=None, node_limit=None, stop=None):
+        """deadline は time.perf_counter() の時刻。stop は真を返したら中断する関数"""
+        self.deadline = deadline
+        self.node_limit = node_limit
+        self.stop = stop
+        self.nodes = 0
+
+    def best_move(self, p: int, o: int):
+        """(最善手のマス番号, 最終石数差) を返す。合法手が無ければマス番号は -1"""
+        moves = _legal_moves(p, o)
+        if not moves:
+            return -1, self.solve(p, o)
+        alpha, best_sq = -65, -1
+        for sq in self._ordered(p, o, moves, ~(p | o) & _FULL):
+            f = _flips(p, o, sq)
+            v = -self._search(o ^ f, p | f | (1 << sq), -64, -alpha)
+            if v > alpha:
+                alpha, best_sq = v, sq
+        return best_sq, alpha
+
+    def solve(self, p: int, o: int, alpha: int = -64, beta: int = 64) -> int:
+        """手番側から見た最終石数差（alpha-beta 窓の外は境界値）"""
+        return self._search(p, o, alpha, beta)
+
+    def _check(self):
+        if ((self.deadline is not None and time.perf_counter() >= self.deadline)
+                or (self.node_limit is not None and self.nodes >= self.node_limit)
+                or (self.stop is not None and self.stop())):
+            raise SolverAborted()
+
+    def _search(self, p, o, alpha, beta):
+        self.nodes += 1
+        if not self.nodes % self.CHECK_INTERVAL:
+            self._check()
+        empty = ~(p | o) & _FULL
+        n_empty = empty.bit_count()
+        if n_empty == 1:
+            return self._last1(p, o, empty.bit_length() - 1)
+        if n_empty == 2:
+            low = empty & -empty
+            return self._last2(p, o, low.bit_length() - 1, (empty ^ low).bit_length() - 1,
+                               alpha, beta)
+
+        moves = _legal_moves(p, o)
+        if not moves:
+            if not _legal_moves(o, p):
+                return final_score(p, o)
+            return -self._search(o, p, -beta, -alpha)
+
+        best = -65
+        for sq in self._ordered(p, o, moves, empty):
+            f = _flips(p, o, sq)
+            v = -self._search(o ^ f, p | f | (1 << sq), -beta, -alpha)
+            if v > best:
+                best = v
+                if v > alpha:
+                    alpha = v
+                    if alpha >= beta:
+                        break
+        return best
+
+    def _ordered(self, p, o, moves, empty):
+        """着手の探索順。空きが多いときは fastest-first、少ないときは偶数理論"""
+        odd = 0
+        for q in QUADRANTS:
+            if (empty & q).bit_count() & 1:
+                odd |= q
+        if empty.bit_count() < self.FASTEST_FIRST_MIN:
+            return [*bitboard.iter_squares(moves & odd), *bitboard.iter_squares(moves & ~odd)]
+        scored = []
+        for sq in bitboard.iter_squares(moves):
+            f = _flips(p, o, sq)
+            # 相手の着手可能数が少ない手ほど先に。同数なら奇数領域の手を先に
+            mobility = _legal_moves(o ^ f, p | f | (1 << sq)).bit_count()
+            scored.append((mobility * 2 - (odd >> sq & 1), sq))
+        scored.sort()
+        return [sq for _, sq in scored]
+
+    def _last1(self, p, o, sq):
+        """残り1マス"""
+        self.nodes += 1
+        f = _flips(p, o, sq)
+        if f:
+            return 2 * (p.bit_count() + f.bit_count() + 1) - 64
+        f = _flips(o, p, sq)
+        if f:
+            return 64 - 2 * (o.bit_count() + f.bit_count() + 1)
+        return final_score(p, o)
+
+    def _last2(self, p, o, sq1, sq2, alpha, beta):
+        """残り2マス"""
+        self.nodes += 1
+        best = -65
+        for a, b in ((sq1, sq2), (sq2, sq1)):
+            f = _flips(p, o, a)
+            if f:
+                v = -self._last1(o ^ f, p | f | (1 << a), b)
+                if v > best:
+                    best = v
+                    if best >= beta:
+                        return best
+        if best > -65:
+            return best
+        # 手番側はパスして相手が打つ（相手は手番側の石数差を最小にする）
+        worst = 65
+        for a, b in ((sq1, sq2), (sq2, sq1)):
+            f = _flips(o, p, a)
+            if f:
+                v = self._last1(p ^ f, o | f | (1 << a), b)
+                if v < worst:
+                    worst = v
+                    if worst <= alpha:
+                        return worst
+        if worst < 65:
+            return worst
+        return final_score(p, o)
@@ -1,44 +1,209 @@
+import logging
+import os
+import time
 import uuid
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from othello import OthelloGame
 from othello_ai import OthelloAI    # 追加：AIクラスをインポート
-class Player:
-    def __init__(self, player_id: str, name: str = ""):
-        self.id = player_id
-        self.name = name
+from game_store import AI_PLAYER_ID, GameRecord, GameStore, Player, StaleRecord, create_store
+from move_log import write_archive
+
+logger = logging.getLogger(__name__)
+
+# ルームの保持期限と上限（環境変数で変更可）
+#   GAME_IDLE_TTL  最後に操作されてからこの秒数が経ったルームを削除（0 で無期限）
+#   MAX_GAMES      同時に保持するルーム数の上限。超えたら最も長く使われていないものから削除
+DEFAULT_IDLE_TTL = float(os.environ.get("GAME_IDLE_TTL", 3600))
+DEFAULT_MAX_GAMES = int(os.environ.get("MAX_GAMES", 1000))
+#   RECONNECT_GRACE  切断したプレイヤーをルームに残しておく秒数（この間に join_game で
+#                    戻れば同じ色で続けられる。0 ですぐに外す）
+DEFAULT_RECONNECT_GRACE = float(os.environ.get("RECONNECT_GRACE", 30))
+# 終局した対局の棋譜の追記先（move_log.py 参照。".bin" ならバイナリ、それ以外はテキスト。
+# 未設定なら書き出さない）
+DEFAULT_ARCHIVE = os.environ.get("GAME_ARCHIVE")
+
 
 class GameManager:
-    def __init__(self):
-        self.games: Dict[str, dict] = {}  # {game_id: {"game": OthelloGame, "players": list[Player]}}
-    
+    EVICT_BATCH = 256  # 1回の evict_idle で削除するルーム数の上限
+
+    def __init__(self, idle_ttl: float = DEFAULT_IDLE_TTL, max_games: int = DEFAULT_MAX_GAMES,
+                 store: Optional[GameStore] = None, clock=time.time,
+                 archive_path: Optional[str] = DEFAULT_ARCHIVE,
+                 reconnect_grace: float = DEFAULT_RECONNECT_GRACE):
+        # ルームの保持先（省略時は GAME_STORE 環境変数。デフォルトはプロセス内のメモリ）
+        # 時刻は複数プロセスで比べられるよう time.time を使う
+        self.store = store if store is not None else create_store()
+        self.idle_ttl = idle_ttl
+        self.max_games = max_games
+        self.clock = clock
+        self.archive_path = archive_path
+        self.reconnect_grace = reconnect_grace
+        # ルームを削除したときに呼ぶ関数 fn(game_id)（送信のキャッシュ・AI の処理の後始末）
+        self.on_removed = None
+        self.evicted = 0  # このプロセスで期限切れ・上限超過により削除したルーム数
+
     def create_game(self) -> str:
         """新しいゲームを作成し、game_idを返す"""
+        self.evict_idle()
+        if self.max_games > 0:
+            excess = len(self.store) - self.max_games + 1
+            if excess > 0:
+                for game_id in self.store.oldest(excess):
+                    self._evict(game_id)
         game_id = str(uuid.uuid4())
-        self.games[game_id] = {
-            "game": OthelloGame(),
-            "players": []
-        }
+        self.store.put(game_id, GameRecord(OthelloGame(), self.clock()))
         return game_id
+
     def add_ai(self, game_id, ai: OthelloAI):
-        self.games[game_id]["ai"] = ai
-    def get_game(self, game_id: str) -> Optional[dict]:
-        """game_idに対応するゲーム状態を取得"""
-        return self.games.get(game_id)
-    
+        game_data = self.store.get(game_id)
+        if game_data:
+            game_data.ai = ai
+            self.save_game(game_id, game_data)
+
+    def get_game(self, game_id: str) -> Optional[GameRecord]:
+        """game_idに対応するゲーム状態を取得（最終操作時刻も更新する）。
+        変更したら save_game で書き戻すこと"""
+        self.evict_idle()
+        now = self.clock()
+        self.store.touch(game_id, now)
+        return self.store.get(game_id)
+
+    def save_game(self, game_id: str, game_data: GameRecord) -> bool:
+        """get_game で取り出したレコードの変更をストアに書き戻す。
+        取り出した後にほかで局面が変わった・ルームが削除されたなら書き込まず False
+        （呼び出し側は変更を捨てること）"""
+        game_data.last_active = self.clock()
+        try:
+            self.store.put(game_id, game_data)
+        except StaleRecord:
+            logger.info("game %s changed since it was read; dropping the update", game_id)
+            return False
+        return True
+
+    SAVE_RETRIES = 3  # 書き戻しが衝突したときに読み直す回数
+
+    def _update(self, game_id: str, change) -> Optional[GameRecord]:
+        """レコードを読んで change(record) を当てて書き戻す。衝突したら読み直してやり直す。
+        change が False を返したら書き戻さない。書き戻したレコード（無ければ None）を返す"""
+        for _ in range(self.SAVE_RETRIES):
+            game_data = self.store.get(game_id)
+            if game_data is None or change(game_data) is False:
+                return None
+            if self.save_game(game_id, game_data):
+                return game_data
+        return None
+
+    @staticmethod
+    def find_player(game_data: GameRecord, player_id: str) -> Optional[Player]:
+        return next((p for p in game_data.players if p.id == player_id), None)
+
     def add_player(self, game_id: str, player_id: str, name: str = "") -> bool:
-        """ゲームにプレイヤーを参加させる"""
+        """ゲームにプレイヤーを参加させる（空いている色に。先に入った人が黒）"""
         game_data = self.get_game(game_id)
         if not game_data:
             return False
-        
-        if len(game_data["players"]) >= 2:
+
+        if len(game_data.players) >= 2:
             return False  # 2人まで
-        
-        game_data["players"].append(Player(player_id, name))
-        return True
-    
-    def remove_player(self, game_id: str, player_id: str):
-        """プレイヤーをゲームから退出させる"""
-        game_data = self.get_game(game_id)
+
+        taken = {p.color for p in game_data.players}
+        color = -1 if -1 not in taken else 1
+        game_data.players.append(Player(player_id, name, color))
+        return self.save_game(game_id, game_data)
+
+    def rejoin(self, game_id: str, player_id: str) -> Optional[GameRecord]:
+        """離席中のプレイヤーが戻った（同じ色のまま続ける）"""
+        def change(game_data):
+            player = self.find_player(game_data, player_id)
+            if player is None or player.away is None:
+                return False
+            player.away = None
+        return self._update(game_id, change)
+
+    def reset_players(self, game_id: str):
+        """ルームのプレイヤーを全員外す（AI 対戦の開始時など）"""
+        game_data = self.store.get(game_id)
         if game_data:
-            game_data["players"] = [p for p in game_data["players"] if p.id != player_id]
\ No newline at end of file
+            game_data.players = []
+            self.save_game(game_id, game_data)
+
+    def remove_player(self, game_id: str, player_id: str) -> bool:
+        """プレイヤーをゲームから退出させる。人間のプレイヤーが残らなければルームを削除し、
+        True を返す"""
+        removed = []
+
+        def change(game_data):
+            game_data.players = [p for p in game_data.players if p.id != player_id]
+            if not game_data.human_players():
+                removed.append(game_id)
+                return False
+        self._update(game_id, change)
+        return bool(removed) and self.remove_game(game_id)
+
+    def disconnect(self, player_id: str) -> List[str]:
+        """切断したプレイヤーを参加中の全ルームで離席中にし、対象のルームIDを返す。
+        reconnect_grace 秒のうちに rejoin しなければ expire_away で外す"""
+        now = self.clock()
+
+        def change(game_data):
+            player = self.find_player(game_data, player_id)
+            if player is None:
+                return False
+            player.away = now
+        game_ids = self.store.games_of(player_id)
+        for game_id in game_ids:
+            self._update(game_id, change)
+        return game_ids
+
+    def expire_away(self, game_id: str, player_id: str) -> bool:
+        """離席したまま reconnect_grace 秒が過ぎたプレイヤーを外す。ルームを削除したら True"""
+        game_data = self.store.get(game_id)
+        if not game_data:
+            return False
+        player = self.find_player(game_data, player_id)
+        if player is None or player.away is None:
+            return False
+        if self.clock() - player.away < self.reconnect_grace:
+            return False  # 戻ってから切断し直した（その切断の分で外す）
+        return self.remove_player(game_id, player_id)
+
+    def archive_game(self, game_data: GameRecord):
+        """終局した対局の棋譜を archive_path に追記する"""
+        if self.archive_path:
+            write_archive([game_data.log], self.archive_path,
+                          binary=self.archive_path.endswith(".bin"))
+
+    def remove_game(self, game_id: str) -> bool:
+        """ルームを削除する（AI とその置換表も解放される）"""
+        if not self.store.delete(game_id):
+            return False
+        self._removed(game_id)
+        return True
+
+    def _removed(self, game_id: str):
+        if self.on_removed is not None:
+            self.on_removed(game_id)
+
+    def evict_idle(self) -> int:
+        """最終操作から idle_ttl 秒を過ぎたルームを削除し、削除した数を返す"""
+        if self.idle_ttl <= 0:
+            return 0
+        expired = self.store.oldest(self.EVICT_BATCH, before=self.clock() - self.idle_ttl)
+        for game_id in expired:
+            self._evict(game_id)
+        return len(expired)
+
+    def _evict(self, game_id: str):
+        if self.remove_game(game_id):
+            self.evicted += 1
+
+    @property
+    def games(self):
+        """ルームの一覧（メモリストアのときのみ。デバッグ用）"""
+        return getattr(self.store, "games", None)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """保持しているルームのおおよそのメモリ使用量（バイト）"""
+        usage = self.store.memory_usage()
+        usage["evicted"] = self.evicted
+        return usage
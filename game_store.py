@@ -0,0 +1,454 @@
+"""ルームの状態を保持するストア
+
+GameManager はルームの読み書きをストアに任せる。
+
+  MemoryGameStore  プロセス内の辞書に保持する（デフォルト。1ワーカー向け）
+  SQLiteGameStore  SQLite (WAL) に保持する。同じファイルを開いた全ワーカーで
+                   ルームを共有でき、ワーカーが再起動しても対局が続く
+
+GAME_STORE 環境変数で選ぶ:
+  GAME_STORE=memory
+  GAME_STORE=sqlite:/var/lib/othello/games.db
+
+SQLite では局面を OthelloGame.to_bytes() の 17 バイトで、棋譜を MoveLog.to_bytes()
+（1手1バイト）で保存する。
+OthelloAI は保存せずレベルだけを残し、各プロセスで作り直して使い回す
+（置換表はプロセスごと）。ストアから取り出したレコードは複製なので、
+変更したら GameManager.save_game で書き戻すこと。
+
+書き戻しは seq の compare-and-set: 読み出した後に別の処理（別のワーカー）が
+局面を変えた・ルームを削除したレコードは書き込まず StaleRecord を送出する。
+長い処理（AI の探索）の間に持っていたレコードで新しい状態を上書きしたり、
+切断で削除されたルームを生き返らせたりしない。
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import move_log
+from move_log import MoveLog
+from othello import OthelloGame
+from othello_ai import OthelloAI
+
+AI_PLAYER_ID = "AI"  # AI 対戦でコンピュータ側に使うプレイヤーID
+
+
+class StaleRecord(Exception):
+    """読み出した後に更新・削除されたレコードを書き戻そうとした"""
+
+
+class Player:
+    __slots__ = ("id", "name", "color", "away")
+
+    def __init__(self, player_id: str, name: str = "", color: Optional[int] = None,
+                 away: Optional[float] = None):
+        self.id = player_id  # クライアントがタブごとに sessionStorage に持つID（接続し直しても変わらない）
+        self.name = name
+        self.color = color  # -1: 黒 / 1: 白
+        self.away = away    # 切断した時刻（接続中は None）
+
+
+class GameRecord:
+    """1ルーム分の状態。局面は play / pass_turn / set_turn / undo で変えること
+    （seq と棋譜を一緒に進める）"""
+    __slots__ = ("game", "players", "ai", "seq", "log", "created_at", "last_active",
+                 "stored_seq")
+
+    def __init__(self, game: OthelloGame, now: float):
+        self.game = game
+        self.seq = 0  # 局面が変わるたびに増やす（v2 プロトコルの差分の通し番号）
+        self.stored_seq: Optional[int] = None  # ストアから読んだ・書いたときの seq（新規は None）
+        self.log = MoveLog(game.to_bytes())
+        self.players: List[Player] = []
+        self.ai: Optional[OthelloAI] = None  # AI 対戦のときだけ設定
+        self.created_at = now
+        self.last_active = now
+
+    def human_players(self) -> List[Player]:
+        return [p for p in self.players if p.id != AI_PLAYER_ID]
+
+    def play(self, row: int, col: int) -> Dict:
+        """make_move して、局面が変わったら seq を進めて棋譜に残す"""
+        color = self.game.turn
+        result = self.game.make_move(row, col)
+        if "move" in result:
+            self.seq += 1
+            self.log.append(result["move"], self.game, color)
+        return result
+
+    def pass_turn(self):
+        """打てる手が無いので手番を相手に渡す"""
+        color = self.game.turn
+        self.game.turn = -self.game.turn
+        self.seq += 1
+        self.log.append(move_log.PASS, self.game, color)
+
+    def set_turn(self, turn: int):
+        """手番を直接決める（AI 対戦の開始時）"""
+        self.game.turn = turn
+        self.seq += 1
+        self.log.rebase(self.game, self.seq)
+
+    def undo(self, count: int):
+        """最後の count 手を取り消す。seq は戻さずに進める（差分ではなくスナップショットで送る）"""
+        self.game = self.log.undo(count)
+        self.seq += 1
+        self.log.rebase(self.game, self.seq)
+
+
+class GameStore:
+    """ストアのインターフェース"""
+
+    def get(self, game_id: str) -> Optional[GameRecord]:
+        raise NotImplementedError
+
+    def put(self, game_id: str, record: GameRecord):
+        """新しいレコードなら追加、読み出したレコードなら上書きする（プレイヤーの索引も
+        更新する）。読み出した後に seq が変わった・削除されたなら StaleRecord"""
+        raise NotImplementedError
+
+    def delete(self, game_id: str) -> bool:
+        raise NotImplementedError
+
+    def touch(self, game_id: str, now: float):
+        """最終操作時刻だけを更新する"""
+        raise NotImplementedError
+
+    def oldest(self, limit: int = 1, before: Optional[float] = None) -> List[str]:
+        """最終操作が古い順にルームIDを返す（before を渡すとそれより古いものだけ）"""
+        raise NotImplementedError
+
+    def games_of(self, player_id: str) -> List[str]:
+        """プレイヤーが参加しているルームのID（AI は含めない）"""
+        raise NotImplementedError
+
+    def logs(self) -> Iterator[Tuple[str, MoveLog]]:
+        """全ルームの (ルームID, 棋譜) を1つずつ返す（書き出し用）"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def __contains__(self, game_id: str) -> bool:
+        return self.get(game_id) is not None
+
+    def memory_usage(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _player_ids(record: GameRecord) -> Set[str]:
+    return {p.id for p in record.human_players()}
+
+
+class MemoryGameStore(GameStore):
+    """プロセス内の OrderedDict に保持する。最後に使われた順（古いものが先頭）に並ぶ"""
+
+    def __init__(self):
+        self.games: "OrderedDict[str, GameRecord]" = OrderedDict()
+        # プレイヤーID → 参加しているルーム。put の時点の参加者で更新する
+        self._player_games: Dict[str, Set[str]] = {}
+        self._indexed: Dict[str, Set[str]] = {}
+
+    def get(self, game_id):
+        return self.games.get(game_id)
+
+    def put(self, game_id, record):
+        current = self.games.get(game_id)
+        if record.stored_seq is None:
+            if current is not None:
+                raise StaleRecord(game_id)
+        elif current is None or (current is not record and current.seq != record.stored_seq):
+            raise StaleRecord(game_id)
+        record.stored_seq = record.seq
+        self.games[game_id] = record
+        self.games.move_to_end(game_id)
+        self._reindex(game_id, _player_ids(record))
+
+    def delete(self, game_id):
+        if self.games.pop(game_id, None) is None:
+            return False
+        self._reindex(game_id, set())
+        return True
+
+    def touch(self, game_id, now):
+        record = self.games.get(game_id)
+        if record is not None:
+            record.last_active = now
+            self.games.move_to_end(game_id)
+
+    def oldest(self, limit=1, before=None):
+        ids = []
+        for game_id, record in self.games.items():
+            if len(ids) >= limit or (before is not None and record.last_active >= before):
+                break
+            ids.append(game_id)
+        return ids
+
+    def games_of(self, player_id):
+        return list(self._player_games.get(player_id, ()))
+
+    def logs(self):
+        for game_id, record in list(self.games.items()):
+            yield game_id, record.log
+
+    def __len__(self):
+        return len(self.games)
+
+    def __contains__(self, game_id):
+        return game_id in self.games
+
+    def _reindex(self, game_id: str, players: Set[str]):
+        old = self._indexed.pop(game_id, set())
+        for player_id in old - players:
+            games = self._player_games.get(player_id)
+            if games is not None:
+                games.discard(game_id)
+                if not games:
+                    del self._player_games[player_id]
+        for player_id in players - old:
+            self._player_games.setdefault(player_id, set()).add(game_id)
+        if players:
+            self._indexed[game_id] = players
+
+    def memory_usage(self):
+        """おおよそのメモリ使用量（バイト）。置換表は確保済みのサイズ、
+        それ以外は sys.getsizeof の合計"""
+        record_bytes = (sys.getsizeof(self.games) + sys.getsizeof(self._player_games) +
+                        sys.getsizeof(self._indexed))
+        ai_count = tt_bytes = 0
+        for game_id, record in self.games.items():
+            record_bytes += (sys.getsizeof(game_id) + sys.getsizeof(record) +
+                             sys.getsizeof(record.game) + sys.getsizeof(record.players) +
+                             sys.getsizeof(record.log) + sys.getsizeof(record.log.moves) +
+                             sum(sys.getsizeof(p) for p in record.players))
+            if record.ai is not None:
+                ai_count += 1
+                record_bytes += sys.getsizeof(record.ai)
+                if record.ai.tt is not None:
+                    tt_bytes += record.ai.tt.nbytes
+        return {
+            "games": len(self.games),
+            "ais": ai_count,
+            "players": len(self._player_games),
+            "record_bytes": record_bytes,
+            "tt_bytes": tt_bytes,
+            "total_bytes": record_bytes + tt_bytes,
+        }
+
+
+class SQLiteGameStore(GameStore):
+    """SQLite (WAL) に保持する。複数プロセスから同じファイルを開いて使う"""
+
+    PRUNE_INTERVAL = 30.0  # ほかのワーカーが削除したルームの AI を探す最短の間隔（秒）
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS games (
+        game_id     TEXT PRIMARY KEY,
+        position    BLOB NOT NULL,      -- OthelloGame.to_bytes()
+        players     TEXT NOT NULL,      -- [[id, name, color, away], ...]
+        ai_level    REAL,               -- AI 対戦でなければ NULL
+        seq         INTEGER NOT NULL DEFAULT 0,
+        log         BLOB,               -- MoveLog.to_bytes()
+        created_at  REAL NOT NULL,
+        last_active REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS games_last_active ON games (last_active);
+    CREATE TABLE IF NOT EXISTS players (
+        player_id TEXT NOT NULL,
+        game_id   TEXT NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+        PRIMARY KEY (player_id, game_id)
+    );
+    CREATE INDEX IF NOT EXISTS players_game ON players (game_id);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # gevent のワーカーでは全グリーンレットが1つの接続を共有するのでロックで直列化する
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10.0, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(self.SCHEMA)
+        # 棋譜の列が無い古い DB には追加する（既存のルームの棋譜は今の局面から始まる）
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(games)")}
+        if "log" not in columns:
+            self._conn.execute("ALTER TABLE games ADD COLUMN log BLOB")
+        # このプロセスで作った AI（置換表を次の手に引き継ぐ）: game_id → OthelloAI
+        self._ais: Dict[str, OthelloAI] = {}
+        self._pruned_at = float("-inf")
+
+    def _ai_for(self, game_id: str, level) -> Optional[OthelloAI]:
+        if level is None:
+            self._ais.pop(game_id, None)
+            return None
+        level = int(level) if float(level).is_integer() else level
+        ai = self._ais.get(game_id)
+        if ai is None or ai.level != level:
+            ai = self._ais[game_id] = OthelloAI(level=level)
+        return ai
+
+    def get(self, game_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT position, players, ai_level, seq, log, created_at, last_active "
+                "FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        if row is None:
+            self._prune_ais()
+            return None
+        position, players, ai_level, seq, log, created_at, last_active = row
+        record = GameRecord(OthelloGame.from_bytes(position), created_at)
+        record.seq = record.stored_seq = seq
+        if log is not None:
+            record.log = MoveLog.from_bytes(log)
+        else:
+            record.log.rebase(record.game, seq)
+        # 色の無い古い行は並び順（先頭が黒）で補う
+        record.players = [Player(entry[0], entry[1], entry[2] if len(entry) > 2 else (-1, 1)[i],
+                                 entry[3] if len(entry) > 3 else None)
+                          for i, entry in enumerate(json.loads(players))]
+        record.ai = self._ai_for(game_id, ai_level)
+        record.last_active = last_active
+        return record
+
+    def put(self, game_id, record):
+        players = json.dumps([[p.id, p.name, p.color, p.away] for p in record.players])
+        ai_level = record.ai.level if record.ai is not None else None
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if record.stored_seq is None:
+                try:
+                    self._conn.execute(
+                        "INSERT INTO games (game_id, position, players, ai_level, seq, log, "
+                        "created_at, last_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (game_id, record.game.to_bytes(), players, ai_level, record.seq,
+                         record.log.to_bytes(), record.created_at, record.last_active))
+                except sqlite3.IntegrityError:
+                    raise StaleRecord(game_id) from None
+            else:
+                # 読み出したときの seq のままなら上書き（0 行なら更新・削除された）
+                cur = self._conn.execute(
+                    "UPDATE games SET position = ?, players = ?, ai_level = ?, seq = ?, log = ?, "
+                    "last_active = ? WHERE game_id = ? AND seq = ?",
+                    (record.game.to_bytes(), players, ai_level, record.seq,
+                     record.log.to_bytes(), record.last_active, game_id, record.stored_seq))
+                if cur.rowcount == 0:
+                    raise StaleRecord(game_id)
+            self._conn.execute("DELETE FROM players WHERE game_id = ?", (game_id,))
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO players (player_id, game_id) VALUES (?, ?)",
+                [(pid, game_id) for pid in _player_ids(record)])
+        record.stored_seq = record.seq
+        if record.ai is not None:
+            self._ais[game_id] = record.ai
+        else:
+            self._ais.pop(game_id, None)
+
+    def _prune_ais(self):
+        """ほかのワーカーが削除したルームの AI（と置換表）を捨てる
+        （全 AI を DB に問い合わせるので PRUNE_INTERVAL 秒に1回まで）"""
+        now = time.monotonic()
+        if now - self._pruned_at < self.PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        ids = list(self._ais)
+        alive = set()
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                alive.update(r[0] for r in self._conn.execute(
+                    "SELECT game_id FROM games WHERE game_id IN (%s)" % ",".join("?" * len(chunk)),
+                    chunk))
+        for game_id in ids:
+            if game_id not in alive:
+                self._ais.pop(game_id, None)
+
+    def delete(self, game_id):
+        self._ais.pop(game_id, None)
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+        return cur.rowcount > 0
+
+    def touch(self, game_id, now):
+        with self._lock:
+            self._conn.execute("UPDATE games SET last_active = ? WHERE game_id = ?", (now, game_id))
+
+    def oldest(self, limit=1, before=None):
+        with self._lock:
+            if before is None:
+                rows = self._conn.execute(
+                    "SELECT game_id FROM games ORDER BY last_active LIMIT ?", (limit,))
+            else:
+                rows = self._conn.execute(
+                    "SELECT game_id FROM games WHERE last_active < ? ORDER BY last_active LIMIT ?",
+                    (before, limit))
+            return [r[0] for r in rows.fetchall()]
+
+    def games_of(self, player_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT game_id FROM players WHERE player_id = ?", (player_id,)).fetchall()
+        return [r[0] for r in rows]
+
+    def logs(self):
+        # 書き出し中も他のワーカーが書き込めるよう、専用の接続で少しずつ読む
+        conn = sqlite3.connect(self.path, timeout=10.0)
+        try:
+            rows = conn.execute("SELECT game_id, position, seq, log FROM games")
+            for game_id, position, seq, log in rows:
+                yield game_id, MoveLog.from_bytes(log) if log is not None else MoveLog(position, seq)
+        finally:
+            conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def __contains__(self, game_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone() is not None
+
+    def memory_usage(self):
+        """DB ファイルのサイズと、このプロセスが持つ AI・置換表のサイズ（バイト）"""
+        self._prune_ais()
+        with self._lock:
+            games = self._conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+            players = self._conn.execute(
+                "SELECT COUNT(DISTINCT player_id) FROM players").fetchone()[0]
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        tt_bytes = sum(ai.tt.nbytes for ai in self._ais.values() if ai.tt is not None)
+        record_bytes = sys.getsizeof(self._ais) + sum(sys.getsizeof(ai) for ai in self._ais.values())
+        return {
+            "games": games,
+            "ais": len(self._ais),
+            "players": players,
+            "db_bytes": page_count * page_size,
+            "record_bytes": record_bytes,
+            "tt_bytes": tt_bytes,
+            "total_bytes": record_bytes + tt_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_store(spec: Optional[str] = None) -> GameStore:
+    """"memory" または "sqlite:<path>" からストアを作る（省略時は GAME_STORE 環境変数）"""
+    spec = spec or os.environ.get("GAME_STORE", "memory")
+    if spec == "memory":
+        return MemoryGameStore()
+    if spec.startswith("sqlite:"):
+        return SQLiteGameStore(spec[len("sqlite:"):])
+    raise ValueError(f"unknown game store: {spec}")
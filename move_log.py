@@ -0,0 +1,237 @@
+"""対局の棋譜（1手1バイトの追記ログ）
+
+GameRecord は局面を変えた操作を MoveLog に1バイトずつ追記する。
+  0..63  そのマス（row*8 + col）に OthelloGame.make_move で着手
+  64     パス（手番だけを相手に渡す。app.ai_pass）
+make_move が手番を据え置くパス（相手に打てる手が無い）は着手から再現できるので
+記録しない。
+
+k 番目（0 始まり）の操作を当てた局面の通し番号は base_seq + k + 1 で、
+v2 プロトコルの差分の seq と一致する。局面を直接書き換えたとき（AI 対戦の開始で
+手番を黒に戻す・undo）は rebase で対応を付け直し、それより前の seq からの差分は
+作らない（resync_from）。
+
+SNAPSHOT_INTERVAL 手ごとの局面（17 バイト）をメモリ上に覚えておき、途中の局面は
+直前のスナップショットから並べ直して作る。保存形式（to_bytes）は
+ヘッダ (base_seq, resync_from, 開始局面) の後に操作列を並べただけで、
+スナップショットは読み込み時に作り直す。
+
+終わった対局はまとめて書き出せる（write_archive / read_archive）:
+  テキスト  1行1局 "<棋譜> <黒の石数> <白の石数>"。棋譜は benchmark.parse_moves と
+           同じ "f5d6c3..."（パスは "--"）。初期局面から始まった対局だけを書く
+  バイナリ  MAGIC の後に (長さ uint16, MoveLog.to_bytes()) を繰り返す
+どちらも1局ずつ追記・読み出しするので、件数が多くてもメモリに載せきらない。
+定跡や評価関数の学習データにもそのまま使える。
+
+ストアにある終局済みの対局を書き出す:
+    python move_log.py --store sqlite:/var/lib/othello/games.db --out games.txt
+    python move_log.py --store sqlite:/var/lib/othello/games.db --out games.bin --binary
+"""
+import argparse
+import struct
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from othello import OthelloGame
+
+PASS = 64
+SNAPSHOT_INTERVAL = 16
+
+MAGIC = b"OML1"
+_HEADER = struct.Struct("<II17s")  # base_seq, resync_from, 開始局面（OthelloGame.to_bytes）
+_LENGTH = struct.Struct("<H")
+_INITIAL = OthelloGame().to_bytes()
+_COLS = "abcdefgh"
+
+
+def apply_op(game: OthelloGame, op: int) -> Dict:
+    """操作を1つ当てて make_move と同じ形の結果を返す（パスは move=None）"""
+    if op == PASS:
+        game.turn = -game.turn
+        return {"status": "pass", "move": None, "flips": 0}
+    result = game.make_move(op >> 3, op & 7)
+    if "move" not in result:
+        raise ValueError(f"illegal move {op} in move log")
+    return result
+
+
+class MoveLog:
+    """1局分の操作列"""
+    __slots__ = ("start", "moves", "base_seq", "resync_from", "_snapshots", "_movers")
+
+    def __init__(self, start: bytes = _INITIAL, base_seq: int = 0):
+        self.start = start
+        self.moves = bytearray()
+        self.base_seq = base_seq
+        self.resync_from = base_seq  # これより前の seq からは差分を作れない
+        # _snapshots[i] は i * SNAPSHOT_INTERVAL 個の操作を当てた局面
+        self._snapshots = [start]
+        # _movers[i] は i 番目の操作をした側（0: 黒 / 1: 白）
+        self._movers = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    @property
+    def seq(self) -> int:
+        """最後の操作を当てた局面の通し番号"""
+        return self.base_seq + len(self.moves)
+
+    def append(self, op: int, game: OthelloGame, color: int):
+        """color（-1: 黒 / 1: 白）の操作 op を記録する。game は op を当てた後の局面"""
+        self.moves.append(op)
+        self._movers.append(color > 0)
+        if len(self.moves) % SNAPSHOT_INTERVAL == 0:
+            self._snapshots.append(game.to_bytes())
+
+    def position(self, index: Optional[int] = None) -> OthelloGame:
+        """index 個の操作を当てた局面（省略時は最後の局面）"""
+        if index is None:
+            index = len(self.moves)
+        k = index // SNAPSHOT_INTERVAL
+        game = OthelloGame.from_bytes(self._snapshots[k])
+        for op in self.moves[k * SNAPSHOT_INTERVAL:index]:
+            apply_op(game, op)
+        return game
+
+    def replay(self, index: int = 0) -> Iterator[Tuple[int, Dict, OthelloGame]]:
+        """index 番目以降の操作を順に当て、(打った側, 結果, 当てた後の局面) を返す。
+        局面は同じオブジェクトを使い回すので、残すならコピーすること"""
+        game = self.position(index)
+        for op in self.moves[index:]:
+            color = game.turn
+            yield color, apply_op(game, op), game
+
+    def replay_since(self, seq: int) -> Optional[Iterator[Tuple[int, int, Dict, OthelloGame]]]:
+        """seq の局面より後の操作を (通し番号, 打った側, 結果, 局面) で返す。
+        rebase より前や未来の seq なら None"""
+        if not self.resync_from <= seq <= self.seq:
+            return None
+        index = seq - self.base_seq
+        return ((self.base_seq + index + i + 1, color, result, game)
+                for i, (color, result, game) in enumerate(self.replay(index)))
+
+    def rebase(self, game: OthelloGame, seq: int):
+        """局面を直接書き換えた後に呼ぶ。game が記録から作れない局面なら
+        そこから記録をやり直し、最後の操作の通し番号を seq にする"""
+        if game.to_bytes() != self.position().to_bytes():
+            self.start = game.to_bytes()
+            self.moves = bytearray()
+            self._movers = bytearray()
+            self._snapshots = [self.start]
+        self.base_seq = seq - len(self.moves)
+        self.resync_from = seq
+
+    def undo(self, count: int) -> OthelloGame:
+        """最後の count 個の操作を取り消し、取り消した後の局面を返す"""
+        count = min(count, len(self.moves))
+        del self.moves[len(self.moves) - count:]
+        del self._movers[len(self.moves):]
+        del self._snapshots[len(self.moves) // SNAPSHOT_INTERVAL + 1:]
+        return self.position()
+
+    def last_move_by(self, color: int) -> Optional[int]:
+        """color が最後に着手した操作の位置（無ければ None）"""
+        mover = color > 0
+        for i in range(len(self.moves) - 1, -1, -1):
+            if self.moves[i] != PASS and self._movers[i] == mover:
+                return i
+        return None
+
+    # ------------------------------------------------------------------
+    # 保存・書き出し
+    # ------------------------------------------------------------------
+    def to_bytes(self) -> bytes:
+        return _HEADER.pack(self.base_seq, self.resync_from, self.start) + bytes(self.moves)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "MoveLog":
+        base_seq, resync_from, start = _HEADER.unpack_from(data)
+        log = cls(start, base_seq)
+        log.resync_from = resync_from
+        log._load(data[_HEADER.size:])
+        return log
+
+    def _load(self, ops: bytes):
+        """ops を当てながら記録する（読み込み時にスナップショットを作り直す）"""
+        game = OthelloGame.from_bytes(self.start)
+        for op in ops:
+            color = game.turn
+            apply_op(game, op)
+            self.append(op, game, color)
+
+    def transcript(self) -> str:
+        """棋譜を "f5d6c3..." で返す（パスは "--"）"""
+        return "".join("--" if op == PASS else f"{_COLS[op & 7]}{(op >> 3) + 1}"
+                       for op in self.moves)
+
+    @classmethod
+    def from_transcript(cls, transcript: str, start: bytes = _INITIAL) -> "MoveLog":
+        ops = bytes(PASS if transcript[i:i + 2] == "--" else
+                    (int(transcript[i + 1]) - 1) * 8 + _COLS.index(transcript[i])
+                    for i in range(0, len(transcript), 2))
+        log = cls(start)
+        log._load(ops)
+        return log
+
+    def finished(self) -> bool:
+        return self.position().check_game_over()
+
+
+def write_archive(logs: Iterable[MoveLog], path: str, binary: bool = False) -> int:
+    """対局を1局ずつ path に追記し、書いた局数を返す"""
+    written = 0
+    if binary:
+        with open(path, "ab") as f:
+            if f.tell() == 0:
+                f.write(MAGIC)
+            for log in logs:
+                data = log.to_bytes()
+                f.write(_LENGTH.pack(len(data)) + data)
+                written += 1
+    else:
+        with open(path, "a") as f:
+            for log in logs:
+                if log.start != _INITIAL or not log.moves:
+                    continue
+                black, white = log.position().disc_counts()
+                f.write(f"{log.transcript()} {black} {white}\n")
+                written += 1
+    return written
+
+
+def read_archive(path: str) -> Iterator[MoveLog]:
+    """write_archive で書いたファイルから1局ずつ読み出す（形式は先頭で判別）"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) == MAGIC:
+            while True:
+                head = f.read(_LENGTH.size)
+                if len(head) < _LENGTH.size:
+                    return
+                yield MoveLog.from_bytes(f.read(_LENGTH.unpack(head)[0]))
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield MoveLog.from_transcript(line.split()[0])
+
+
+def main():
+    from game_store import create_store
+
+    parser = argparse.ArgumentParser(description="Export finished games from a game store")
+    parser.add_argument("--store", help="ゲームストア（省略時は GAME_STORE 環境変数）")
+    parser.add_argument("--out", required=True, help="追記先のファイル")
+    parser.add_argument("--binary", action="store_true", help="バイナリ形式で書き出す")
+    parser.add_argument("--all", action="store_true", help="終局していない対局も書き出す")
+    args = parser.parse_args()
+
+    store = create_store(args.store)
+    try:
+        logs = (log for _, log in store.logs() if args.all or log.finished())
+        written = write_archive(logs, args.out, args.binary)
+    finally:
+        store.close()
+    print(f"wrote {written} games to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
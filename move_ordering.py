@@ -0,0 +1,76 @@
+"""探索の手順付け
+
+alpha-beta は良い手から先に読むほど枝刈りが増える。合法手のビットマスクから
+各手に次の優先度を付け、高い順に並べる。
+
+  1. 置換表の最善手（前の深さ・前の探索で最善だった手）
+  2. キラー手（同じ手数の別の局面で beta カットを起こした手。1手数につき2つ）
+  3. ヒストリー（手番・マスごとに beta カットを起こした回数を深さ^2 で重み付けた値）
+  4. マスの静的な価値（VALUE_TABLE。隅を先に、X・C 打ちを後に）
+
+反転マスクはここで計算して返すので、探索側は apply_move にそのまま渡せる。
+"""
+from typing import List, Tuple
+
+import bitboard
+from othello import VALUE_TABLE
+
+MAX_PLY = 64  # パスも1手と数えるので、実際の手数より少し余裕を持たせる
+
+TT_MOVE_SCORE = 1 << 30
+KILLER_SCORES = (1 << 29, 1 << 28)
+HISTORY_LIMIT = 1 << 20  # これを超えたらヒストリーを半分にする
+
+# マスの静的な価値（VALUE_TABLE をマス番号順に並べたもの）
+SQUARE_SCORES = [w for row in VALUE_TABLE for w in row]
+
+
+class MoveOrdering:
+    """キラー手とヒストリーを保持する手順付け。AI ごとに1つ持ち、探索をまたいで使う"""
+
+    def __init__(self):
+        self.killers = [[-1, -1] for _ in range(MAX_PLY)]
+        # history[0] が黒番、history[1] が白番
+        self.history = [[0] * 64, [0] * 64]
+
+    def new_search(self):
+        """探索開始ごとに呼ぶ。キラー手は局面が変わると役に立たないので消し、
+        ヒストリーは半分にして古い情報ほど効かなくする"""
+        for k in self.killers:
+            k[0] = k[1] = -1
+        for table in self.history:
+            for sq in range(64):
+                table[sq] >>= 1
+
+    def order(self, p: int, o: int, color: int, tt_move: int = -1,
+              ply: int = 0) -> List[Tuple[int, int, int]]:
+        """手番側 p・相手 o の合法手を優先度の高い順に (優先度, マス番号, 反転マスク) で返す"""
+        history = self.history[color == 1]
+        killer1, killer2 = self.killers[ply] if ply < MAX_PLY else (-1, -1)
+        moves = []
+        for sq in bitboard.iter_squares(bitboard.legal_moves(p, o)):
+            if sq == tt_move:
+                score = TT_MOVE_SCORE
+            elif sq == killer1:
+                score = KILLER_SCORES[0]
+            elif sq == killer2:
+                score = KILLER_SCORES[1]
+            else:
+                score = history[sq] + SQUARE_SCORES[sq]
+            moves.append((score, sq, bitboard.flips(p, o, sq)))
+        moves.sort(reverse=True)
+        return moves
+
+    def cutoff(self, color: int, sq: int, depth: int, ply: int):
+        """sq で beta カットが起きたときに呼ぶ"""
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != sq:
+                killers[1] = killers[0]
+                killers[0] = sq
+        history = self.history[color == 1]
+        history[sq] += depth * depth
+        if history[sq] > HISTORY_LIMIT:
+            for table in self.history:
+                for i in range(64):
+                    table[i] >>= 1
@@ -0,0 +1,177 @@
+"""定跡（オープニングブック）
+
+序盤はどのルームも同じ初期局面から始まるので、探索結果をオフラインで作っておき、
+実行時は探索の前に引く。
+
+ファイル形式: ヘッダ (MAGIC, 件数 uint32) の後に、キー昇順で 12 バイトのレコード
+(key uint64, move uint8, depth uint8, score int16) が並ぶ。
+key は8通りの対称変換のうち (black, white) が最小になる向きに正規化した局面の
+Zobrist ハッシュ（手番込み）で、move もその向きでのマス番号。
+実行時は mmap で開くので、同じファイルを開いた全ワーカープロセスがページを共有する。
+
+作成:
+    python opening_book.py --plies 12 --width 4 --time 0.5 --out opening_book.bin
+"""
+import argparse
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Optional, Tuple
+
+import bitboard
+from othello import OthelloGame
+
+MAGIC = b"OBK1"
+HEADER = struct.Struct("<4sI")
+RECORD = struct.Struct("<QBBh")
+DEFAULT_PATH = os.environ.get(
+    "OTHELLO_BOOK",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_book.bin"))
+
+
+def canonical(black: int, white: int, turn: int) -> Tuple[int, int]:
+    """対称変換で正規化した局面のキーと、使った変換の番号を返す"""
+    best, best_sym = None, 0
+    for sym, transform in enumerate(bitboard.SYMMETRIES):
+        cand = (transform(black), transform(white))
+        if best is None or cand < best:
+            best, best_sym = cand, sym
+    key = bitboard.zobrist_hash(*best)
+    if turn == 1:
+        key ^= bitboard.ZOBRIST_TURN
+    return key, best_sym
+
+
+class OpeningBook:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"not an opening book: {path}")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _find(self, key: int):
+        """key のレコード (key, move, depth, score) を二分探索で探す"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            rec = RECORD.unpack_from(self._mm, HEADER.size + mid * RECORD.size)
+            if rec[0] < key:
+                lo = mid + 1
+            elif rec[0] > key:
+                hi = mid
+            else:
+                return rec
+        return None
+
+    def lookup(self, game: OthelloGame) -> Optional[Tuple[int, int]]:
+        """定跡手を (row, col) で返す。載っていなければ None"""
+        key, sym = canonical(game.black, game.white, game.turn)
+        rec = self._find(key)
+        if rec is None:
+            return None
+        sq = bitboard.transform_square(bitboard.SYMMETRY_INVERSE[sym], rec[1])
+        if not game.legal_mask(game.turn) >> sq & 1:
+            return None  # ハッシュ衝突
+        return divmod(sq, 8)
+
+    def close(self):
+        self._mm.close()
+
+
+_books: Dict[str, Optional[OpeningBook]] = {}
+
+
+def open_book(path: str = DEFAULT_PATH) -> Optional[OpeningBook]:
+    """プロセスごとに1回だけ開いて使い回す。ファイルが無ければ None"""
+    if path not in _books:
+        _books[path] = OpeningBook(path) if os.path.exists(path) else None
+    return _books[path]
+
+
+def write_book(path: str, entries: Dict[int, Tuple[int, int, int]]):
+    """entries {key: (move, depth, score)} をキー順に書き出す"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        for key in sorted(entries):
+            move, depth, score = entries[key]
+            f.write(RECORD.pack(key, move, min(depth, 255), max(-32768, min(32767, int(score)))))
+    os.replace(tmp, path)
+
+
+def build_book(plies: int = 12, width: int = 4, time_limit: float = 0.5, level=3,
+               log=print) -> Dict[int, Tuple[int, int, int]]:
+    """初期局面から plies 手目までの定跡を作る。
+
+    AI 側の手番では探索した最善手だけを、人間側の手番では評価の高い順に width 手を
+    展開する。AI が黒・白どちらを持つ場合も作るので、両方の手番の局面が載る。
+    """
+    from othello_ai import OthelloAI
+
+    ai = OthelloAI(level=level)
+    ai.use_book = False
+    entries = {}
+    start = time.perf_counter()
+    for ai_color in (-1, 1):
+        frontier = [OthelloGame()]
+        seen = set()
+        for ply in range(plies):
+            next_frontier = []
+            for game in frontier:
+                moves = game.valid_moves(game.turn)
+                if not moves:
+                    continue
+                key, sym = canonical(game.black, game.white, game.turn)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if game.turn == ai_color:
+                    if key not in entries:
+                        move = ai.choose_move(game, time_limit)
+                        score = ai.last_results[ai.last_depth][0]
+                        sq = move[0] * 8 + move[1]
+                        entries[key] = (bitboard.transform_square(sym, sq), ai.last_depth, score)
+                    else:
+                        inv = bitboard.SYMMETRY_INVERSE[sym]
+                        move = divmod(bitboard.transform_square(inv, entries[key][0]), 8)
+                    children = [move]
+                else:
+                    # 人間側は指しそうな手（手番側から見て評価が高い手）から width 手
+                    def score_of(m):
+                        undo = game.apply_move(m[0] * 8 + m[1])
+                        value = ai.evaluate(game) * -game.turn
+                        game.undo_move(undo)
+                        return value
+                    children = sorted(moves, key=score_of, reverse=True)[:width]
+                for r, c in children:
+                    child = game.copy()
+                    child.make_move(r, c)  # 相手がパスなら手番はそのまま
+                    next_frontier.append(child)
+            frontier = next_frontier
+            log(f"[book] ai={'black' if ai_color == -1 else 'white'} ply={ply + 1} "
+                f"entries={len(entries)} frontier={len(frontier)} "
+                f"elapsed={time.perf_counter() - start:.1f}s")
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Othello opening book")
+    parser.add_argument("--plies", type=int, default=12, help="定跡に含める手数")
+    parser.add_argument("--width", type=int, default=4, help="人間側の手番で展開する手の数")
+    parser.add_argument("--time", type=float, default=0.5, help="1局面あたりの探索時間(秒)")
+    parser.add_argument("--level", type=int, default=3, help="探索に使う AI のレベル")
+    parser.add_argument("--out", default=DEFAULT_PATH)
+    args = parser.parse_args()
+    entries = build_book(args.plies, args.width, args.time, args.level)
+    write_book(args.out, entries)
+    print(f"wrote {len(entries)} positions to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
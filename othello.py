@@ -1,13 +1,65 @@
+import struct
 from typing import List, Tuple, Dict
 
+import bitboard
+
+# マスごとの位置評価の重み（OthelloAI.evaluate の位置評価に使う）
+VALUE_TABLE = [
+    [100, -20, 10, 5, 5, 10, -20, 100],
+    [-20, -50, -2, -2, -2, -2, -50, -20],
+    [10, -2, 8, 0, 0, 8, -2, 10],
+    [5, -2, 0, 1, 1, 0, -2, 5],
+    [5, -2, 0, 1, 1, 0, -2, 5],
+    [10, -2, 8, 0, 0, 8, -2, 10],
+    [-20, -50, -2, -2, -2, -2, -50, -20],
+    [100, -20, 10, 5, 5, 10, -20, 100]
+]
+_WEIGHTS = [w for row in VALUE_TABLE for w in row]
+_WEIGHT_TABLES = bitboard.weight_byte_tables(_WEIGHTS)
+# 保存用の局面表現: 黒・白のビットボードと手番（17 バイト）
+_PACKED = struct.Struct("<QQb")
+
+
 class OthelloGame:
     DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1),
                   (0, -1),          (0, 1),
                   (1, -1),  (1, 0),  (1, 1)]
-    
+    # ルームごとに保持されるので、インスタンス辞書を持たせない
+    __slots__ = ("black", "white", "turn", "hash", "pos_score", "_legal_black", "_legal_white")
+
     def __init__(self):
-        self.board = self.init_board()
+        # 盤面は黒・白それぞれ 64bit のビットボードで保持する
+        self.black = bitboard.INIT_BLACK
+        self.white = bitboard.INIT_WHITE
         self.turn = -1  # 初期は黒
+        self._reset_derived()
+
+    @classmethod
+    def from_bitboards(cls, black: int, white: int, turn: int):
+        """ビットボードと手番から局面を作る"""
+        game = cls.__new__(cls)
+        game.black, game.white, game.turn = black, white, turn
+        game._reset_derived()
+        return game
+
+    def to_bytes(self) -> bytes:
+        """局面を 17 バイトに詰める（ストアへの保存用）"""
+        return _PACKED.pack(self.black, self.white, self.turn)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        return cls.from_bitboards(*_PACKED.unpack(data))
+
+    def _reset_derived(self):
+        """石の配置から差分更新している値を計算し直す"""
+        # 石の配置の Zobrist ハッシュ（手番は zobrist_key() で合成する）
+        self.hash = bitboard.zobrist_hash(self.black, self.white)
+        # VALUE_TABLE による位置評価（白 - 黒）
+        self.pos_score = (bitboard.weighted_sum(_WEIGHT_TABLES, self.white) -
+                          bitboard.weighted_sum(_WEIGHT_TABLES, self.black))
+        # 黒・白それぞれの合法手マスク（legal_mask で初めて必要になったときに計算し、
+        # 盤面が変わるまで使い回す。None は未計算）
+        self._legal_black = self._legal_white = None
 
     @staticmethod
     def init_board() -> List[List[int]]:
@@ -19,36 +71,74 @@ class OthelloGame:
     @staticmethod
     def inside_board(r: int, c: int) -> bool:
         return 0 <= r < 8 and 0 <= c < 8
+
+    @property
+    def board(self) -> List[List[int]]:
+        """従来形式の 8x8 盤面（黒=-1, 白=1, 空=0）。呼ぶたびに新しいリストを返す"""
+        return bitboard.to_board(self.black, self.white)
+
+    @board.setter
+    def board(self, board: List[List[int]]):
+        self.black, self.white = bitboard.from_board(board)
+        self._reset_derived()
+
+    def bitboards(self, turn: int) -> Tuple[int, int]:
+        """(turn 側の石, 相手の石) のビットボードを返す"""
+        if turn == -1:
+            return self.black, self.white
+        return self.white, self.black
+
     def copy(self):
-        """このゲーム状態のディープコピーを返す"""
-        new_game = OthelloGame()
-        # 盤面は行ごとにコピー
-        new_game.board = [row[:] for row in self.board]
-        # 手番もそのまま引き継ぎ
+        """このゲーム状態のコピーを返す"""
+        new_game = OthelloGame.__new__(OthelloGame)
+        new_game.black = self.black
+        new_game.white = self.white
         new_game.turn = self.turn
-        # もし他に持っている状態があればここでコピー
-        # 例: new_game.history = self.history.copy()
+        new_game.hash = self.hash
+        new_game.pos_score = self.pos_score
+        new_game._legal_black = self._legal_black
+        new_game._legal_white = self._legal_white
         return new_game
+
     def stones_to_flip(self, row: int, col: int, turn: int) -> List[Tuple[int, int]]:
-        flips = []
-        for dr, dc in self.DIRECTIONS:
-            path = []
-            r, c = row + dr, col + dc
-            while self.inside_board(r, c) and self.board[r][c] == -turn:
-                path.append((r, c))
-                r += dr
-                c += dc
-            if self.inside_board(r, c) and self.board[r][c] == turn and path:
-                flips.extend(path)
-        return flips
+        p, o = self.bitboards(turn)
+        return [divmod(sq, 8) for sq in bitboard.iter_squares(bitboard.flips(p, o, row * 8 + col))]
+
+    def legal_mask(self, turn: int) -> int:
+        """指定色 turn の合法手をビットマスクで返す（局面ごとに各色1回だけ計算する）"""
+        if turn == -1:
+            mask = self._legal_black
+            if mask is None:
+                mask = self._legal_black = bitboard.legal_moves(self.black, self.white)
+        else:
+            mask = self._legal_white
+            if mask is None:
+                mask = self._legal_white = bitboard.legal_moves(self.white, self.black)
+        return mask
 
     def valid_moves(self, turn: int) -> List[Tuple[int, int]]:
         """指定色 turn の合法手を (row, col) のリストで返す"""
-        return [(r, c) for r in range(8) for c in range(8)
-               if self.board[r][c] == 0 and self.stones_to_flip(r, c, turn)]
+        return [divmod(sq, 8) for sq in bitboard.iter_squares(self.legal_mask(turn))]
+
+    def mobility(self, turn: int) -> int:
+        """指定色 turn の合法手の数"""
+        return self.legal_mask(turn).bit_count()
+
+    def disc_counts(self) -> Tuple[int, int]:
+        """(黒の石数, 白の石数)"""
+        return self.black.bit_count(), self.white.bit_count()
+
+    def frontier_counts(self) -> Tuple[int, int]:
+        """空きマスに隣接している石の数 (黒, 白)"""
+        empty_nb = bitboard.neighbours(~(self.black | self.white) & bitboard.FULL)
+        return (self.black & empty_nb).bit_count(), (self.white & empty_nb).bit_count()
+
+    def zobrist_key(self) -> int:
+        """手番込みの局面ハッシュ（置換表のキー）"""
+        return (self.hash ^ bitboard.ZOBRIST_TURN) if self.turn == 1 else self.hash
 
     def has_valid_move(self, turn: int) -> bool:
-        return len(self.valid_moves(turn)) > 0
+        return self.legal_mask(turn) != 0
 
     def check_game_over(self) -> bool:
         """ゲーム終了条件をチェック"""
@@ -56,29 +146,88 @@ class OthelloGame:
         next_moves = self.has_valid_move(-self.turn)
         return not current_moves and not next_moves
 
+    # ------------------------------------------------------------------
+    # 探索専用 API（合法性チェック・終局判定・コピーを行わない）
+    # ------------------------------------------------------------------
+    def apply_move(self, sq: int, flips: int = None) -> Tuple[int, int, int, int, int]:
+        """sq (= row*8+col) に現在の手番で着手し、undo_move 用のレコード
+        (sq, 反転した石のマスク, 直前の手番, 直前のハッシュ, 直前の位置評価) を返す。
+        sq = -1 はパス。"""
+        prev = self.turn
+        prev_hash = self.hash
+        prev_pos = self.pos_score
+        if sq >= 0:
+            p, o = self.bitboards(prev)
+            if flips is None:
+                flips = bitboard.flips(p, o, sq)
+            p |= flips | (1 << sq)
+            o ^= flips
+            # 置いた石 + 反転した石（相手の分が減り自分の分が増えるので2倍）
+            gain = _WEIGHTS[sq] + 2 * bitboard.weighted_sum(_WEIGHT_TABLES, flips)
+            if prev == -1:
+                self.black, self.white = p, o
+                self.hash = prev_hash ^ bitboard.ZOBRIST_BLACK[sq] ^ bitboard.zobrist_flip(flips)
+                self.pos_score = prev_pos - gain
+            else:
+                self.white, self.black = p, o
+                self.hash = prev_hash ^ bitboard.ZOBRIST_WHITE[sq] ^ bitboard.zobrist_flip(flips)
+                self.pos_score = prev_pos + gain
+            self._legal_black = self._legal_white = None
+        else:
+            flips = 0
+        self.turn = -prev
+        return sq, flips, prev, prev_hash, prev_pos
+
+    def undo_move(self, record: Tuple[int, int, int, int, int]):
+        """apply_move で返されたレコードを使って局面を元に戻す"""
+        sq, flips, prev, prev_hash, prev_pos = record
+        if sq >= 0:
+            if prev == -1:
+                self.black ^= flips | (1 << sq)
+                self.white ^= flips
+            else:
+                self.white ^= flips | (1 << sq)
+                self.black ^= flips
+            self._legal_black = self._legal_white = None
+        self.turn = prev
+        self.hash = prev_hash
+        self.pos_score = prev_pos
+
+    def save_state(self) -> Tuple:
+        """探索を途中で打ち切るときのための局面のスナップショット"""
+        return self.black, self.white, self.turn, self.hash, self.pos_score
+
+    def restore_state(self, state: Tuple):
+        self.black, self.white, self.turn, self.hash, self.pos_score = state
+        self._legal_black = self._legal_white = None
+
+    def scores(self) -> Dict[str, int]:
+        return {"white": self.white.bit_count(), "black": self.black.bit_count()}
+
     def make_move(self, row: int, col: int) -> Dict:
+        sq = row * 8 + col
         # 1) すでに埋まっているセル
-        if self.board[row][col] != 0:
+        if (self.black | self.white) >> sq & 1:
             return {"status": "cell occupied"}
 
         # 2) ひっくり返せる石を調べる
-        flips = self.stones_to_flip(row, col, self.turn)
+        p, o = self.bitboards(self.turn)
+        flips = bitboard.flips(p, o, sq)
         if not flips:
             return {"status": "invalid move"}
 
-        # 3) 石を置いて反転
-        self.board[row][col] = self.turn
-        for r, c in flips:
-            self.board[r][c] = self.turn
+        # 3) 石を置いて反転（反転した石のマスクは結果の "flips" で返す）
+        self.apply_move(sq, flips)
+        self.turn = -self.turn  # 手番の更新は 5) 以降で判定する
 
         # 4) 全部置いたらゲーム終了チェック
         if self.check_game_over():
-            white = sum(cell == 1 for row in self.board for cell in row)
-            black = sum(cell == -1 for row in self.board for cell in row)
             return {
                 "status": "game_over",
                 "board": self.board,
-                "score": {"white": white, "black": black}
+                "score": self.scores(),
+                "move": sq,
+                "flips": flips
             }
 
         # 5) 次のターン候補
@@ -88,21 +237,21 @@ class OthelloGame:
             return {
                 "status": "pass",
                 "board": self.board,
-                "turn": self.turn
+                "turn": self.turn,
+                "move": sq,
+                "flips": flips
             }
 
         # 6) 正常にターンを更新
         self.turn = next_turn
 
-        # 7) スコア計算（任意で付け加え）
-        white = sum(cell == 1 for row in self.board for cell in row)
-        black = sum(cell == -1 for row in self.board for cell in row)
-
-        # 8) 正常終了レスポンス
+        # 7) 正常終了レスポンス
         return {
             "status":      "success",
             "board":       self.board,
             "turn":        self.turn,
             "legal_moves": self.valid_moves(self.turn),
-            "scores":      {"white": white, "black": black}
+            "scores":      self.scores(),
+            "move":        sq,
+            "flips":       flips
         }
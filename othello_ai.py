@@ -1,85 +1,128 @@
-from othello import OthelloGame
+from othello import OthelloGame, VALUE_TABLE
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+import batch_eval
+import bitboard
+import opening_book
+import pattern_eval
+from endgame import EndgameSolver, SolverAborted
+from move_ordering import MoveOrdering
+import search_stats
+from search_stats import SearchStats
+import logging
 import math
+import os
 import random # この行を追加
+import time
+
+logger = logging.getLogger(__name__)
+
+# 評価関数: "classic"（位置評価・モビリティなどの線形和）/ "pattern"（pattern_eval のパターン表）
+EVALUATORS = ("classic", "pattern")
+DEFAULT_EVALUATOR = os.environ.get("AI_EVALUATOR", "classic")
+PVS_EPSILON = 1e-6  # PVS の幅ゼロの窓（評価値は実数なので alpha + ε を上限にする）
+
+class SearchTimeout(Exception):
+    """探索予算（時間・ノード数）を使い切ったときに minimax から送出される"""
+
+
 class OthelloAI:
-     # 深さの設定を変更（レベル0.5追加）
-    LEVEL_DEPTH = {0.5: 1, 1:1, 2:2, 3:3}  # 変更
-    # 0.5は簡易評価、1は簡易評価+minimax、2以上は通常のminimax
-    
-    def __init__(self, level=0.5):
+    # レベルごとの探索予算: 1手あたりの持ち時間(秒)・ノード数上限・深さの上限・
+    # 1手の探索に使うプロセス数（parallel > 1 はルート分割の並列探索）・定跡を使うか・
+    # 完全読みに切り替える空きマス数（0 は使わない）・PVS（NegaScout）で探索するか
+    # 反復深化で予算内に完了した最も深い結果を使う
+    # 0.5は簡易評価のみ（探索なし）
+    LEVEL_BUDGET = {
+        0.5: {"time": 0.0,  "nodes": None, "max_depth": 1,  "parallel": 1, "book": False, "endgame": 0,  "pvs": False},
+        1:   {"time": 0.05, "nodes": None, "max_depth": 2,  "parallel": 1, "book": False, "endgame": 0,  "pvs": False},
+        2:   {"time": 0.3,  "nodes": None, "max_depth": 4,  "parallel": 1, "book": True,  "endgame": 8,  "pvs": True},
+        3:   {"time": 1.0,  "nodes": None, "max_depth": 8,  "parallel": 1, "book": True,  "endgame": 10, "pvs": True},
+        4:   {"time": 1.0,  "nodes": None, "max_depth": 10, "parallel": 4, "book": True,  "endgame": 11, "pvs": True},
+        5:   {"time": 2.0,  "nodes": None, "max_depth": 12, "parallel": 8, "book": True,  "endgame": 12, "pvs": True},
+    }
+    DEFAULT_LEVEL = 1
+    CHECK_INTERVAL = 256  # このノード数ごとに予算をチェック
+    BATCH_MIN = 6  # 子局面がこの数以上なら末端評価を NumPy でまとめて行う
+    ENDGAME_SHARE = 0.6  # 完全読みに使う予算の割合（残りは読み切れなかったときの探索用）
+
+    def __init__(self, level=0.5, tt_bytes=TranspositionTable.DEFAULT_MAX_BYTES,
+                 collect_stats=None, evaluator=None):
         self.level = level  # この行を追加
-        self.max_depth = self.LEVEL_DEPTH.get(level, 1)
+        budget = self.LEVEL_BUDGET.get(level, self.LEVEL_BUDGET[self.DEFAULT_LEVEL])
+        self.time_limit = budget["time"]
+        self.node_limit = budget["nodes"]
+        self.max_depth = budget["max_depth"]
+        self.parallel = budget["parallel"]
+        self.use_book = budget["book"]
+        self.endgame_empties = budget["endgame"]
+        self.use_pvs = budget["pvs"]
+        # 直近の choose_move の結果（完了した深さ・読み筋・深さごとの (評価値, 最善手)・
+        # 探索ノード数・深さごとの完了までの秒数。
+        # 完全読みのときは深さ = 空きマス数、評価値 = 白から見た最終石数差）
+        self.last_depth = 0
+        self.last_pv = []
+        self.last_results = {}
+        self.last_nodes = 0
+        self.last_depth_times = {}
+        self._nodes = 0
+        self._deadline = None
+        self._node_cap = None
+        self._stop = None  # 探索を外から打ち切るための関数（真を返したら中断）
+        self._analysis_depth = 0  # analyze で読み終えた深さ
+        # 直近の choose_move の探索統計。collect_stats が真なら詳細カウンタも数える
+        # （省略時は環境変数 AI_SEARCH_STATS に従う）
+        self.collect_stats = search_stats.STATS_ENABLED if collect_stats is None else collect_stats
+        self.last_stats = SearchStats(level)
+        self._stats = None  # 探索中だけ詳細カウンタの集計先（無効なら None）
     # …あとはそのまま…
 
-        self.value_table = [
-            [100, -20, 10, 5, 5, 10, -20, 100],
-            [-20, -50, -2, -2, -2, -2, -50, -20],
-            [10, -2, 8, 0, 0, 8, -2, 10],
-            [5, -2, 0, 1, 1, 0, -2, 5],
-            [5, -2, 0, 1, 1, 0, -2, 5],
-            [10, -2, 8, 0, 0, 8, -2, 10],
-            [-20, -50, -2, -2, -2, -2, -50, -20],
-            [100, -20, 10, 5, 5, 10, -20, 100]
-        ]
-     # トランスポジションテーブル（キャッシュ用）
-        self.tt = {}  # key: (board_tuple, turn, depth, maximizing_player)
+        # 位置評価の重み。OthelloGame.pos_score はこの表で差分更新されている
+        self.value_table = VALUE_TABLE
+     # トランスポジションテーブル（最初の探索時に tt_bytes 以内で確保）
+        self.tt_bytes = tt_bytes
+        self.tt = None
+        self._batch_weights = None  # evaluate_batch 用の石数ごとの重み表
+        # パターン表の評価関数（evaluator="pattern" のとき。省略時は環境変数 AI_EVALUATOR）。
+        # レベル0.5は常に簡易評価。重みのファイルが無ければ従来の評価関数を使う
+        self.evaluator = DEFAULT_EVALUATOR if evaluator is None else evaluator
+        if self.evaluator not in EVALUATORS:
+            raise ValueError(f"unknown evaluator: {self.evaluator}")
+        self.patterns = None
+        if self.evaluator == "pattern" and level != 0.5:
+            self.patterns = pattern_eval.open_patterns()
+            if self.patterns is None:
+                logger.warning("[AI] pattern weights not found (%s); using the classic evaluator",
+                               pattern_eval.DEFAULT_PATH)
+        # キラー手・ヒストリー（探索をまたいで引き継ぐ）
+        self.ordering = MoveOrdering()
     def evaluate(self, game: OthelloGame) -> float:
-        board = game.board
-        white_count = black_count = 0
-        position_score = 0
+        """白から見た評価値。盤面の走査はせず、OthelloGame が差分更新している
+        位置評価とビットボードの popcount だけで計算する。
+        パターン表の評価関数を使うときはその値（最終石数差の予測）を返す"""
+        if self.patterns is not None:
+            return self.patterns.evaluate(game)
+        black, white = game.black, game.white
 
         # 1) 石数カウント ＆ 位置評価
-        for r in range(8):
-            for c in range(8):
-                cell = board[r][c]
-                if cell == 1:
-                    white_count += 1
-                    position_score += self.value_table[r][c]
-                elif cell == -1:
-                    black_count += 1
-                    position_score -= self.value_table[r][c]
+        white_count = white.bit_count()
+        black_count = black.bit_count()
+        position_score = game.pos_score
 
         stone_count = white_count + black_count
         stone_diff  = white_count - black_count
 
         # 2) モビリティ（合法手の数の差）
-        my_moves = len(game.valid_moves(1))
-        op_moves = len(game.valid_moves(-1))
-        mobility_score = my_moves - op_moves
+        mobility_score = game.mobility(1) - game.mobility(-1)
 
         # 3) コーナー占拠
-        corners = [(0,0),(0,7),(7,0),(7,7)]
-        corner_score = 0
-        for r, c in corners:
-            if board[r][c] == 1:
-                corner_score += 100
-            elif board[r][c] == -1:
-                corner_score -= 100
+        corner_score = 100 * ((white & bitboard.CORNERS).bit_count() -
+                              (black & bitboard.CORNERS).bit_count())
 
         # 4) フロンティア石（空セルに隣接する石へのペナルティ）
-        dirs = [(-1,0),(1,0),(0,-1),(0,1),(-1,-1),(-1,1),(1,-1),(1,1)]
-        frontier_penalty = 0
-        for r in range(8):
-            for c in range(8):
-                if board[r][c] == 0:
-                    continue
-                for dr, dc in dirs:
-                    nr, nc = r+dr, c+dc
-                    if 0 <= nr < 8 and 0 <= nc < 8 and board[nr][nc] == 0:
-                        frontier_penalty += -1 if board[r][c] == 1 else +1
-                        break
-
-        # 5) 動的重み付けの条件分岐を追加
-        if self.level == 0.5:  # レベル0.5用の簡易評価
-            w_pos, w_mob, w_cor, w_fro, w_diff = 1.0, 0.5, 0.0, 0.0, 1.0
-        else:
-            # 既存の動的重み付けロジック
-            if stone_count < 20:
-                w_pos, w_mob, w_cor, w_fro, w_diff = 2.5, 5.0, 50.0, 1.0, 1.0
-            elif stone_count < 50:
-                w_pos, w_mob, w_cor, w_fro, w_diff = 2.0, 4.0, 60.0, 0.5, 2.0
-            else:
-                w_pos, w_mob, w_cor, w_fro, w_diff = 1.0, 2.0, 80.0, 0.1, 5.0
+        black_frontier, white_frontier = game.frontier_counts()
+        frontier_penalty = black_frontier - white_frontier
+
+        # 5) 動的重み付け
+        w_pos, w_mob, w_cor, w_fro, w_diff = self.eval_weights(stone_count)
 
         # 総合スコア
         score = (
@@ -91,9 +134,84 @@ class OthelloAI:
         )
         return score
 
-    def choose_move(self, game: OthelloGame):
+    def eval_weights(self, stone_count):
+        """評価の重み (w_pos, w_mob, w_cor, w_fro, w_diff)"""
+        if self.level == 0.5:  # レベル0.5用の簡易評価
+            return 1.0, 0.5, 0.0, 0.0, 1.0
+        # 既存の動的重み付けロジック
+        if stone_count < 20:
+            return 2.5, 5.0, 50.0, 1.0, 1.0
+        elif stone_count < 50:
+            return 2.0, 4.0, 60.0, 0.5, 2.0
+        else:
+            return 1.0, 2.0, 80.0, 0.1, 5.0
+
+    def evaluate_batch(self, boards):
+        """複数局面の評価値（白から見た値）をまとめて計算する。
+
+        boards は (N, 8, 8) の盤面配列、または (blacks, whites) のビットボード列の組。
+        NumPy があれば1回のベクトル演算で計算し、無ければ evaluate を順に呼ぶ。
+        パターン表の評価関数を使うときは常に evaluate を順に呼ぶ。
+        """
+        if self.patterns is not None or not batch_eval.available():
+            if isinstance(boards, tuple):
+                pairs = zip(*boards)
+            else:
+                pairs = (bitboard.from_board(b) for b in boards)
+            return [self.evaluate(OthelloGame.from_bitboards(int(b), int(w), 1)) for b, w in pairs]
+        if isinstance(boards, tuple):
+            blacks, whites = batch_eval.as_bitboards(boards[0]), batch_eval.as_bitboards(boards[1])
+        else:
+            blacks, whites = batch_eval.pack_boards(boards)
+        if self._batch_weights is None:
+            self._batch_weights = batch_eval.np.array(
+                [self.eval_weights(n) for n in range(65)], dtype=float)
+        return batch_eval.evaluate(blacks, whites, self._batch_weights)
+
+    def _evaluate_children(self, game: OthelloGame, moves):
+        """moves（get_sorted_moves の戻り値）で1手進めた各局面の評価値"""
+        p, o = game.bitboards(game.turn)
+        movers = [p | flips | (1 << sq) for _, sq, flips in moves]
+        others = [o ^ flips for _, _, flips in moves]
+        if game.turn == -1:
+            return self.evaluate_batch((movers, others))
+        return self.evaluate_batch((others, movers))
+
+    def choose_move(self, game: OthelloGame, time_limit=None, node_limit=None, root_mask=None,
+                    stop=None):
+        """最善手を (row, col) で返す。合法手が無ければ None。
+
+        time_limit（秒）/ node_limit を省略するとレベルの予算を使う。
+        深さ 1 から反復深化し、予算内に完了した最も深い探索の最善手を返す。
+        root_mask を渡すとルートではそのマスの手だけを探索する（並列探索の分担用）。
+        stop は引数なしの関数で、真を返すと予算切れと同じように探索を打ち切る
+        （先読みの取り消し用）。
+        探索の統計は self.last_stats（SearchStats）に残る。
+        """
+        stats = SearchStats(self.level, detailed=self.collect_stats)
+        self._stats = stats if self.collect_stats else None
+        self._stop = stop
+        start = time.perf_counter()
+        try:
+            move = self._choose_move(game, time_limit, node_limit, root_mask, stats)
+        finally:
+            self._stats = None
+            self._stop = None
+        stats.elapsed = time.perf_counter() - start
+        stats.depth = self.last_depth
+        stats.nodes = self.last_nodes
+        stats.depth_times = dict(self.last_depth_times)
+        self.last_stats = stats
+        if root_mask is None:
+            search_stats.log_stats(logger, stats)
+        return move
+
+    def _choose_move(self, game: OthelloGame, time_limit, node_limit, root_mask, stats):
         # レベル0.5用の簡易選択ロジック
         if self.level == 0.5:
+            stats.mode = search_stats.MODE_RANDOM
+            self.last_depth, self.last_pv, self.last_results, self.last_nodes = 0, [], {}, 0
+            self.last_depth_times = {}
             valid = game.valid_moves(game.turn)
             if not valid:
                 return None
@@ -102,125 +220,423 @@ class OthelloAI:
             if random.random() < 0.3:
                 return random.choice(valid)
             
-            # 70%で簡易評価ベースの選択
-            best_score = -math.inf
-            best_moves = []
-            for r, c in valid:
-                clone = game.copy()
-                clone.make_move(r, c)
-                score = self.evaluate(clone)
-                if score > best_score:
-                    best_score = score
-                    best_moves = [(r, c)]
-                elif score == best_score:
-                    best_moves.append((r, c))
+            # 70%で簡易評価ベースの選択（全候補をまとめて評価）
+            moves = self.get_sorted_moves(game, game.turn)
+            scores = self._evaluate_children(game, moves)
+            self.last_depth, self.last_nodes = 1, len(moves)
+            stats.leaf_evals += len(moves)
+            best_score = max(scores)
+            best_moves = [divmod(sq, 8) for (_, sq, _), score in zip(moves, scores)
+                          if score == best_score]
             return random.choice(best_moves) if best_moves else None
 
-        # レベル1以上のAIは minimax を使用
-        # ① まず現在の盤面での合法手一覧を出力
-        valid = game.valid_moves(game.turn)
-        print(f"[AI] ■turn={game.turn} の合法手: {valid}")
+        # 定跡に載っている局面なら探索しない
+        if root_mask is None:
+            move = self.book_move(game)
+            if move is not None:
+                stats.mode = search_stats.MODE_BOOK
+                self.last_depth, self.last_pv, self.last_results = 0, [move], {}
+                self.last_nodes = 0
+                self.last_depth_times = {}
+                return move
 
-        # ② minimax 呼び出し
-        _, move = self.minimax(game, self.max_depth, -math.inf, math.inf, True)
-        valid = game.valid_moves(game.turn)
+        time_limit = self.time_limit if time_limit is None else time_limit
+        node_limit = self.node_limit if node_limit is None else node_limit
+        # 終盤は完全読み。読み切りには予算の ENDGAME_SHARE までしか使わず、
+        # 読み切れなければ残りの予算で通常の探索に戻る（深さ1の手で終わらせない）
+        solver_nodes = 0
+        if root_mask is None and self.in_endgame(game):
+            start = time.perf_counter()
+            move = self.solve_endgame(
+                game,
+                time_limit * self.ENDGAME_SHARE if time_limit is not None else None,
+                int(node_limit * self.ENDGAME_SHARE) if node_limit is not None else None)
+            if move is not None:
+                stats.mode = search_stats.MODE_ENDGAME
+                return move
+            solver_nodes = self.last_nodes
+            if time_limit is not None:
+                time_limit = max(0.0, time_limit - (time.perf_counter() - start))
+            if node_limit is not None:
+                node_limit = max(0, node_limit - solver_nodes)
+
+        # レベル1以上のAIは反復深化で minimax を使用
+        move = self.iterative_deepening(game, time_limit, node_limit, root_mask)
+
+        self.last_nodes = self._nodes + solver_nodes
 
         # if minimax failed to pick a valid move, just take the first legal one
+        valid = game.valid_moves(game.turn)
         if move not in valid:
-                    move = valid[0] if valid else None
-
-        print(f"[AI] → choose_move returns: {move}")
+            move = valid[0] if valid else None
         return move
 
 
     
-    def minimax(self, game: OthelloGame, depth, alpha, beta, maximizing_player):
+    def in_endgame(self, game: OthelloGame) -> bool:
+        """完全読みに切り替える局面か"""
+        return 64 - (game.black | game.white).bit_count() <= self.endgame_empties
+
+    def solve_endgame(self, game: OthelloGame, time_limit=None, node_limit=None):
+        """最終石数差を最大にする手を読み切って (row, col) で返す。
+        予算内に読み切れなければ None（呼び出し側は通常の探索を行う）"""
+        start = time.perf_counter()
+        deadline = start + time_limit if time_limit is not None else None
+        solver = EndgameSolver(deadline, node_limit, self._stop)
+        p, o = game.bitboards(game.turn)
+        try:
+            sq, score = solver.best_move(p, o)
+        except SolverAborted:
+            self.last_nodes = solver.nodes
+            return None
+        self.last_nodes = solver.nodes
+        if sq < 0:
+            return None
+        move = divmod(sq, 8)
+        empties = 64 - (game.black | game.white).bit_count()
+        self.last_depth, self.last_pv = empties, [move]
+        self.last_results = {empties: (score * game.turn, move)}
+        self.last_depth_times = {empties: time.perf_counter() - start}
+        return move
+
+    def book_move(self, game: OthelloGame):
+        """定跡手を (row, col) で返す。定跡を使わないレベル・定跡外の局面では None"""
+        if not self.use_book:
+            return None
+        book = opening_book.open_book()
+        return book.lookup(game) if book is not None else None
+
+    def iterative_deepening(self, game: OthelloGame, time_limit, node_limit=None, root_mask=None):
+        """深さ 1, 2, ... と探索し、予算切れの直前に完了した深さの最善手を返す。
+        各深さの読み筋は置換表に残り、次の深さの手順付けに使われる。"""
+        if self.tt is None:
+            self.tt = TranspositionTable(self.tt_bytes)
+        self.tt.new_search()
+        self.ordering.new_search()
+        maximizing = game.turn == 1
+        snapshot = game.save_state()
+        start = time.perf_counter()
+        self._nodes = 0
+        self._deadline = None
+        self._node_cap = None
+        stop, self._stop = self._stop, None
+        best_move, self.last_depth, self.last_pv, self.last_results = None, 0, [], {}
+        self.last_depth_times = {}
+
+        for depth in range(1, self.max_depth + 1):
+            try:
+                score, move = self.minimax(game, depth, -math.inf, math.inf, maximizing, root_mask)
+            except SearchTimeout:
+                # 途中で打ち切った探索は捨て、盤面を探索前に戻す
+                game.restore_state(snapshot)
+                break
+            best_move, self.last_depth = move, depth
+            self.last_results[depth] = (score, move)
+            self.last_depth_times[depth] = time.perf_counter() - start
+            self.last_pv = self.principal_variation(game, depth, move)
+            # 深さ 1 は必ず完了させ、以降は予算を有効にする
+            if time_limit is not None:
+                self._deadline = start + time_limit
+                if time.perf_counter() >= self._deadline:
+                    break
+            if node_limit is not None:
+                self._node_cap = node_limit
+                if self._nodes >= node_limit:
+                    break
+            if stop is not None:
+                self._stop = stop
+                if stop():
+                    break
+
+        self._deadline = self._node_cap = None
+        self._stop = stop
+        return best_move
+
+    def principal_variation(self, game: OthelloGame, depth, first_move=None):
+        """置換表の最善手をたどって読み筋 [(row, col), ...] を返す。
+        first_move を渡すと初手はそれを使う（ルートを置換表に保存しない分担探索用）"""
+        pv = []
+        undo_stack = []
+        if first_move is not None:
+            pv.append(first_move)
+            undo_stack.append(game.apply_move(first_move[0] * 8 + first_move[1]))
+            depth -= 1
+        for _ in range(depth):
+            entry = self.tt.lookup(game.zobrist_key())
+            if entry is None or entry[3] < 0 or not game.legal_mask(game.turn) >> entry[3] & 1:
+                break
+            pv.append(divmod(entry[3], 8))
+            undo_stack.append(game.apply_move(entry[3]))
+        while undo_stack:
+            game.undo_move(undo_stack.pop())
+        return pv
+
+    @staticmethod
+    def merge_root_results(results, maximizing_player):
+        """ルート分割した各探索の last_results をまとめて (評価値, 最善手, 深さ) を返す。
+        全員が完了した最も深い深さで比較する"""
+        results = [r for r in results if r]
+        if not results:
+            return None, None, 0
+        depth = min(max(r) for r in results)
+        pick = max if maximizing_player else min
+        score, move = pick((r[depth] for r in results), key=lambda sm: sm[0])
+        return score, move, depth
+
+    def analyze(self, game: OthelloGame, time_limit=None, node_limit=None):
+        """全合法手の評価値と読み筋を返す（multi-PV。ヒント・検討用）。
+
+        ルートの各手を全幅の窓で探索するので、最善手以外の評価値も正確な値になる。
+        深さ 1 から反復深化し、予算内に全部の手を読み終えた最も深い結果を返す。
+        終盤（完全読みの空きマス数以下）は各手を読み切り、評価値は最終石数差になる。
+        戻り値は {"depth", "mode", "nodes", "elapsed", "moves"} で、moves は
+        {"move": マス番号, "score": 白から見た評価値, "pv": [マス番号, ...]} を
+        手番側から見て良い順に並べたもの。last_* や last_stats は変えない。
+        """
+        time_limit = self.time_limit if time_limit is None else time_limit
+        node_limit = self.node_limit if node_limit is None else node_limit
+        start = time.perf_counter()
+        moves = self.get_sorted_moves(game, game.turn)
+        result = {"depth": 0, "mode": search_stats.MODE_SEARCH, "nodes": 0, "moves": []}
+        if moves:
+            scored = None
+            if self.in_endgame(game):
+                scored = self._analyze_endgame(game, moves, start + time_limit, node_limit)
+                if scored is not None:
+                    result["mode"] = search_stats.MODE_ENDGAME
+                    result["depth"] = 64 - (game.black | game.white).bit_count()
+            if scored is None:
+                scored = self._analyze_search(game, moves, time_limit, node_limit)
+                result["depth"] = self._analysis_depth
+            result["nodes"] = self._nodes
+            ranked = sorted(scored.items(), key=lambda item: item[1][0] * game.turn, reverse=True)
+            result["moves"] = [{"move": sq, "score": score, "pv": pv}
+                               for sq, (score, pv) in ranked]
+        result["elapsed"] = time.perf_counter() - start
+        return result
+
+    def _analyze_search(self, game: OthelloGame, moves, time_limit, node_limit):
+        """反復深化の multi-PV。{マス番号: (白から見た評価値, 読み筋)} を返す"""
+        if self.tt is None:
+            self.tt = TranspositionTable(self.tt_bytes)
+        self.tt.new_search()
+        self.ordering.new_search()
+        maximizing = game.turn == 1
+        snapshot = game.save_state()
+        start = time.perf_counter()
+        self._nodes = 0
+        self._deadline = self._node_cap = None
+        scored, self._analysis_depth = {}, 0
+
+        for depth in range(1, self.max_depth + 1):
+            current = {}
+            try:
+                for _, sq, flips in moves:
+                    undo = game.apply_move(sq, flips)
+                    score, _ = self.minimax(game, depth - 1, -math.inf, math.inf,
+                                            not maximizing, ply=1)
+                    pv = [sq] + [r * 8 + c for r, c in self.principal_variation(game, depth - 1)]
+                    game.undo_move(undo)
+                    current[sq] = (score, pv)
+            except SearchTimeout:
+                game.restore_state(snapshot)
+                break
+            scored, self._analysis_depth = current, depth
+            # 次の深さは良かった手から読む（置換表が効きやすい）
+            moves = sorted(moves, key=lambda m: scored[m[1]][0], reverse=maximizing)
+            # 深さ 1 は必ず完了させ、以降は予算を有効にする
+            if time_limit is not None:
+                self._deadline = start + time_limit
+                if time.perf_counter() >= self._deadline:
+                    break
+            if node_limit is not None:
+                self._node_cap = node_limit
+                if self._nodes >= node_limit:
+                    break
+
+        self._deadline = self._node_cap = None
+        return scored
+
+    def _analyze_endgame(self, game: OthelloGame, moves, deadline, node_limit):
+        """各手を読み切って {マス番号: (白から見た最終石数差, [マス番号])} を返す。
+        予算内に読み切れなければ None"""
+        solver = EndgameSolver(deadline, node_limit)
+        p, o = game.bitboards(game.turn)
+        scored = {}
+        try:
+            for _, sq, flips in moves:
+                score = -solver.solve(o ^ flips, p | flips | (1 << sq))
+                scored[sq] = (score * game.turn, [sq])
+        except SolverAborted:
+            return None
+        finally:
+            self._nodes = solver.nodes
+        return scored
+
+    def minimax(self, game: OthelloGame, depth, alpha, beta, maximizing_player, root_mask=None,
+                ply=0):
+        """game を apply_move / undo_move でその場で動かしながら探索する。
+        maximizing_player は game.turn == 1（白番）と一致させて呼ぶこと。
+        評価値は常に白から見た値で、置換表にもそのまま格納する。
+        root_mask を渡したノードは、その手だけを探索し置換表を使わない。
+        ply はルートからの手数（キラー手の記録先）。
+        use_pvs が真なら、2手目以降を幅ゼロの窓で調べる PVS（NegaScout）で探索する。"""
+        if self.tt is None:
+            self.tt = TranspositionTable(self.tt_bytes)
+        tt = self.tt
+
+        # 予算チェック（iterative_deepening から呼ばれたときのみ有効）
+        self._nodes += 1
+        if not self._nodes % self.CHECK_INTERVAL:
+            if ((self._deadline is not None and time.perf_counter() >= self._deadline)
+                    or (self._node_cap is not None and self._nodes >= self._node_cap)
+                    or (self._stop is not None and self._stop())):
+                raise SearchTimeout()
+
         # Transposition lookup
-        board_tuple = tuple(tuple(row) for row in game.board)
-        key = (board_tuple, game.turn, depth, maximizing_player)
-        if key in self.tt:
-            return self.tt[key]
-
-        # depth, playerごとに合法手を出力
-        print(f"[AI][depth={depth}][maximizing={maximizing_player}] turn={game.turn} の手の候補:", game.valid_moves(game.turn))
-        
+        key = game.zobrist_key()
+        entry = tt.lookup(key)
+        stats = self._stats
+        if stats is not None:
+            stats.tt_probes += 1
+            if entry is not None:
+                stats.tt_hits += 1
+        tt_move = -1
+        if entry is not None:
+            e_depth, flag, value, tt_move = entry
+            if e_depth >= depth and root_mask is None:
+                move = divmod(tt_move, 8) if tt_move >= 0 else None
+                if flag == EXACT:
+                    return value, move
+                if flag == LOWER:
+                    alpha = max(alpha, value)
+                elif flag == UPPER:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value, move
+
         # 終端条件
-        if depth == 0 or (not game.has_valid_move(game.turn) and not game.has_valid_move(-game.turn)):
+        if depth == 0:
+            if stats is not None:
+                stats.leaf_evals += 1
             val = self.evaluate(game)
-            self.tt[key] = (val, None)
+            tt.store(key, 0, EXACT, val)
             return val, None
 
-        best_move = None
-        if maximizing_player:
-            max_eval = -math.inf
-            moves = self.get_sorted_moves(game, 1)
-            
-            if not moves:
-                eval_score, _ = self.minimax(game, depth-1, alpha, beta, False)
-                self.tt[key] = (eval_score, None)
-                return eval_score, None
-
-            for _, (r,c), flips in moves:
-                clone = game.copy()  # 効率的なコピーメソッド推奨
-                clone.make_move(r, c)
-                eval_score, _ = self.minimax(clone, depth-1, alpha, beta, False)
-                
-                if eval_score > max_eval:
-                    max_eval, best_move = eval_score, (r, c)
-                alpha = max(alpha, eval_score)
-                if beta <= alpha:
-                    break
+        p, o = game.bitboards(game.turn)
+        moves = self.ordering.order(p, o, game.turn, tt_move, ply)
+        if root_mask is not None:
+            moves = [m for m in moves if root_mask >> m[1] & 1]
+        if not moves:
+            if not game.has_valid_move(-game.turn):
+                if stats is not None:
+                    stats.leaf_evals += 1
+                val = self.evaluate(game)
+                tt.store(key, depth, EXACT, val)
+                return val, None
+            # パス: 手番だけ入れ替えて探索を続ける
+            undo = game.apply_move(-1)
+            best, _ = self.minimax(game, depth-1, alpha, beta, not maximizing_player, ply=ply + 1)
+            game.undo_move(undo)
+            tt.store(key, depth, self._bound(best, alpha, beta), best)
+            return best, None
 
-            self.tt[key] = (max_eval, best_move)
-            return max_eval, best_move
+        # 末端の1つ手前: 子局面をまとめて評価する
+        if (depth == 1 and len(moves) >= self.BATCH_MIN and self.patterns is None
+                and batch_eval.available()):
+            self._nodes += len(moves)
+            if stats is not None:
+                stats.leaf_evals += len(moves)
+            scores = self._evaluate_children(game, moves)
+            pick = max if maximizing_player else min
+            i = pick(range(len(moves)), key=scores.__getitem__)
+            best, best_sq = float(scores[i]), moves[i][1]
+            if root_mask is None:
+                tt.store(key, depth, self._bound(best, alpha, beta), best, best_sq)
+            return best, divmod(best_sq, 8)
+
+        ordering = self.ordering
+        pvs = self.use_pvs
+        a, b = alpha, beta
+        best_sq = -1
+        if maximizing_player:
+            best = -math.inf
+            for i, (_, sq, flips) in enumerate(moves):
+                undo = game.apply_move(sq, flips)
+                if pvs and i:
+                    # 最善手の候補より良いかだけを幅ゼロの窓で調べ、良ければ読み直す
+                    eval_score, _ = self.minimax(game, depth-1, a, a + PVS_EPSILON, False,
+                                                 ply=ply + 1)
+                    if a < eval_score < b:
+                        eval_score, _ = self.minimax(game, depth-1, a, b, False, ply=ply + 1)
+                else:
+                    eval_score, _ = self.minimax(game, depth-1, a, b, False, ply=ply + 1)
+                game.undo_move(undo)
 
+                if eval_score > best:
+                    best, best_sq = eval_score, sq
+                a = max(a, eval_score)
+                if b <= a:
+                    ordering.cutoff(1, sq, depth, ply)
+                    if stats is not None:
+                        stats.cutoffs += 1
+                    break
         else:
-            min_eval = math.inf
-            moves = self.get_sorted_moves(game, -1)
-            
-            if not moves:
-                eval_score, _ = self.minimax(game, depth-1, alpha, beta, True)
-                self.tt[key] = (eval_score, None)
-                return eval_score, None
-
-            for _, (r,c), flips in moves:
-                clone = game.copy()
-                clone.make_move(r, c)
-                eval_score, _ = self.minimax(clone, depth-1, alpha, beta, True)
-                
-                if eval_score < min_eval:
-                    min_eval, best_move = eval_score, (r, c)
-                beta = min(beta, eval_score)
-                if beta <= alpha:
+            best = math.inf
+            for i, (_, sq, flips) in enumerate(moves):
+                undo = game.apply_move(sq, flips)
+                if pvs and i:
+                    eval_score, _ = self.minimax(game, depth-1, b - PVS_EPSILON, b, True,
+                                                 ply=ply + 1)
+                    if a < eval_score < b:
+                        eval_score, _ = self.minimax(game, depth-1, a, b, True, ply=ply + 1)
+                else:
+                    eval_score, _ = self.minimax(game, depth-1, a, b, True, ply=ply + 1)
+                game.undo_move(undo)
+
+                if eval_score < best:
+                    best, best_sq = eval_score, sq
+                b = min(b, eval_score)
+                if b <= a:
+                    ordering.cutoff(-1, sq, depth, ply)
+                    if stats is not None:
+                        stats.cutoffs += 1
                     break
 
-            self.tt[key] = (min_eval, best_move)
-            return min_eval, best_move
+        if root_mask is None:
+            tt.store(key, depth, self._bound(best, alpha, beta), best, best_sq)
+        return best, divmod(best_sq, 8)
+
+    @staticmethod
+    def _bound(value, alpha, beta):
+        """探索窓 (alpha, beta) に対する value の境界フラグ"""
+        if value <= alpha:
+            return UPPER
+        if value >= beta:
+            return LOWER
+        return EXACT
 
     def get_sorted_moves(self, game, player):
-         """合法手のソート処理を共通化"""
-         moves = []
-         for r in range(8):
-                for c in range(8):
-                    flips = game.stones_to_flip(r, c, player)
-                    if flips:
-                        if self.level == 0.5:
-                            score = len(flips)  # コーナー優先なし
-                        else:
-                            score = (1000 if (r,c) in [(0,0),(0,7),(7,0),(7,7)] else 0) + len(flips)
-                        moves.append((score, (r,c), flips))
-
-            # レベル0.5用の処理を適切な位置に移動
-         if self.level == 0.5:
-                random.shuffle(moves)  # ランダムシャッフル
-         else:
-                moves.sort(reverse=(player == 1))
-            
-         return moves
+        """合法手を良さそうな順に (スコア, マス番号, 反転マスク) のリストで返す
+        （置換表の最善手・キラー手・ヒストリー・マスの価値の順。レベル0.5はランダム順）"""
+        p, o = game.bitboards(player)
+        if self.level == 0.5:
+            moves = [(0, sq, bitboard.flips(p, o, sq))
+                     for sq in bitboard.iter_squares(bitboard.legal_moves(p, o))]
+            random.shuffle(moves)
+            return moves
+        tt_move = -1
+        if self.tt is not None:
+            entry = self.tt.lookup(game.zobrist_key())
+            if entry is not None:
+                tt_move = entry[3]
+        return self.ordering.order(p, o, player, tt_move)
+
 
-        
     def evaluate_move(self, game, move):
         """与えられた move を実行したときの評価値を返す"""
-        clone = game.clone()
-        clone.make_move(*move)
-        return self.evaluate(clone)
+        r, c = move
+        undo = game.apply_move(r * 8 + c)
+        score = self.evaluate(game)
+        game.undo_move(undo)
+        return score
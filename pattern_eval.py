@@ -0,0 +1,340 @@
+"""パターン表による評価関数
+
+盤上の決まったマスの並び（パターン）ごとに、その並びの石の配置（空き・黒・白の3通り）を
+3進数の番号にし、番号ごとの重みを表から引いて足し合わせる。重みはパターンの形
+（ファミリー）ごとに1つの表を持ち、回転・反転で重なる位置（インスタンス）で共有する。
+進行度（石数）で段階を分け、段階ごとに別の重みを使う。
+
+  edge2x     辺の8マス + 2つの X 打ち（4か所）
+  corner3x3  隅の 3x3（4か所）
+  corner2x5  隅から辺に沿った 2x5（8か所）
+  diag8..5   長さ 8〜5 の斜めの列
+
+このほかに段階ごとのモビリティ（合法手数の差）の重みを持つ。
+評価値は白から見た最終石数差の予測値（石数）。
+
+番号の計算は盤面を走査しない。各インスタンスのマスを「同じ行」「同じ列」「列が
+すべて異なる（斜め）」のいずれかのまとまりに分け、まとまりごとにシフトとマスク
+（列・斜めは定数の掛け算で1バイトに集める）で 8bit を取り出し、256 要素の表で
+3進数の番号の一部に変換して足す。
+
+重みはオフラインで自己対戦の結果から学習し、バイナリファイルに置く（NumPy が必要）。
+
+    python pattern_eval.py --games 8000 --seed 7 --out pattern_weights.bin
+
+ファイル形式: ヘッダ (MAGIC, 段階数 uint16, ファミリー数 uint16, 1段階の重みの数 uint32,
+SCALE uint32) の後に、int16（リトルエンディアン）の重みを段階ごとに
+[各ファミリーの表..., モビリティ] の順で並べて zlib で圧縮したもの。
+重みは SCALE 倍した整数で保存する。
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import bitboard
+from othello import OthelloGame
+
+MAGIC = b"OPT1"
+HEADER = struct.Struct("<4sHHII")
+SCALE = 64  # 重みは 1/64 石単位の整数で保存する
+PHASES = 6
+DEFAULT_PATH = os.environ.get(
+    "OTHELLO_PATTERNS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "pattern_weights.bin"))
+
+
+def phase_of(discs: int) -> int:
+    """石数から進行度の段階（0..PHASES-1）"""
+    return min(PHASES - 1, max(0, (discs - 5) * PHASES // 60))
+
+
+_PHASE_OF = [phase_of(n) for n in range(65)]
+
+# ファミリーごとの基準の形（左上の向き。並び順が3進数の桁の順になる）
+FAMILIES = {
+    "edge2x": [(0, c) for c in range(8)] + [(1, 1), (1, 6)],
+    "corner3x3": [(r, c) for r in range(3) for c in range(3)],
+    "corner2x5": [(r, c) for r in range(2) for c in range(5)],
+    "diag8": [(i, i) for i in range(8)],
+    "diag7": [(i, i + 1) for i in range(7)],
+    "diag6": [(i, i + 2) for i in range(6)],
+    "diag5": [(i, i + 3) for i in range(5)],
+}
+
+_FILE_MAGIC = 0x0102040810204080  # 1つの列のマスを行の順に1バイトへ集める
+_DIAG_MAGIC = 0x0101010101010101  # 列がすべて異なるマスを列の順に1バイトへ集める
+
+
+def _instances(squares: List[Tuple[int, int]]) -> List[List[int]]:
+    """基準の形を8通りの対称変換で移したマス番号の列（マスの集合が同じものは1つにする）"""
+    result, seen = [], set()
+    for sym in range(len(bitboard.SYMMETRIES)):
+        sqs = [bitboard.transform_square(sym, r * 8 + c) for r, c in squares]
+        if frozenset(sqs) not in seen:
+            seen.add(frozenset(sqs))
+            result.append(sqs)
+    return result
+
+
+def _extract(bb: int, shift: int, mask: int, magic: int) -> int:
+    bits = (bb >> shift) & mask
+    return ((bits * magic) >> 56) & 0xFF if magic else bits
+
+
+def _split(sqs: List[int]) -> List[Tuple[int, int, int, List[int]]]:
+    """インスタンスのマスを、1回の取り出しで済むまとまり (shift, mask, magic, マス) に分ける。
+    行ごと・列ごと・斜め（列がすべて異なる）のうち、まとまりの数が最も少ない分け方を使う"""
+    rows, files = {}, {}
+    for sq in sqs:
+        rows.setdefault(sq >> 3, []).append(sq)
+        files.setdefault(sq & 7, []).append(sq)
+    candidates = [
+        [(8 * r, sum(1 << (s & 7) for s in group), 0, group) for r, group in rows.items()],
+        [(c, sum(1 << (s - c) for s in group), _FILE_MAGIC, group) for c, group in files.items()],
+    ]
+    if len(files) == len(sqs):
+        candidates.append([(0, sum(1 << s for s in sqs), _DIAG_MAGIC, list(sqs))])
+    return min(candidates, key=len)
+
+
+def _part_table(shift: int, mask: int, magic: int, group: List[int],
+                digit: Dict[int, int]) -> List[int]:
+    """取り出した 8bit から、そのマスに石があるときの3進数の桁の値の合計への表"""
+    table = [0] * 256
+    seen = set()
+    for subset in range(1 << len(group)):
+        bb = sum(1 << sq for i, sq in enumerate(group) if subset >> i & 1)
+        bits = _extract(bb, shift, mask, magic)
+        if bits in seen:
+            raise AssertionError(f"pattern extraction is not injective: {group}")
+        seen.add(bits)
+        table[bits] = sum(3 ** digit[sq] for i, sq in enumerate(group) if subset >> i & 1)
+    return table
+
+
+def _build_layout():
+    """ファミリーの重みの位置と、インスタンスごとの取り出し方を作る"""
+    offsets, sizes, parts = {}, {}, []
+    total = 0
+    for name, squares in FAMILIES.items():
+        offsets[name] = total
+        sizes[name] = 3 ** len(squares)
+        total += sizes[name]
+        for sqs in _instances(squares):
+            digit = {sq: i for i, sq in enumerate(sqs)}
+            inst = []
+            for shift, mask, magic, group in _split(sqs):
+                black = _part_table(shift, mask, magic, group, digit)
+                white = [2 * v for v in black]  # 白は桁の値 2
+                inst.append((shift, mask, magic, black, white))
+            parts.append((offsets[name], tuple(inst)))
+    return offsets, sizes, parts, total
+
+
+FAMILY_OFFSETS, FAMILY_SIZES, INSTANCES, PATTERN_WEIGHTS = _build_layout()
+MOBILITY = PATTERN_WEIGHTS        # 1段階の重みの中でのモビリティの重みの位置
+STAGE_SIZE = PATTERN_WEIGHTS + 1  # 1段階の重みの数
+
+
+def pattern_indexes(black: int, white: int) -> List[int]:
+    """各インスタンスの重みの位置（段階内の通し番号）"""
+    result = []
+    for offset, inst in INSTANCES:
+        idx = offset
+        for shift, mask, magic, btab, wtab in inst:
+            b = (black >> shift) & mask
+            w = (white >> shift) & mask
+            if magic:
+                b = ((b * magic) >> 56) & 0xFF
+                w = ((w * magic) >> 56) & 0xFF
+            idx += btab[b] + wtab[w]
+        result.append(idx)
+    return result
+
+
+class PatternEvaluator:
+    def __init__(self, weights: array, scale: int = SCALE):
+        if len(weights) != PHASES * STAGE_SIZE:
+            raise ValueError("pattern weights do not match the pattern layout")
+        self.weights = weights
+        self.scale = float(scale)
+
+    @classmethod
+    def load(cls, path: str) -> "PatternEvaluator":
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, phases, families, stage, scale = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"not a pattern weights file: {path}")
+        if (phases, families, stage) != (PHASES, len(FAMILIES), STAGE_SIZE):
+            raise ValueError(f"pattern weights file does not match the pattern layout: {path}")
+        weights = array("h")
+        weights.frombytes(zlib.decompress(data[HEADER.size:]))
+        if sys.byteorder != "little":
+            weights.byteswap()
+        return cls(weights, scale)
+
+    def save(self, path: str):
+        weights = array("h", self.weights)
+        if sys.byteorder != "little":
+            weights.byteswap()
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, PHASES, len(FAMILIES), STAGE_SIZE, int(self.scale)))
+            f.write(zlib.compress(weights.tobytes(), 9))
+        os.replace(tmp, path)
+
+    def evaluate(self, game: OthelloGame) -> float:
+        """白から見た評価値（最終石数差の予測）"""
+        black, white = game.black, game.white
+        weights = self.weights
+        base = _PHASE_OF[(black | white).bit_count()] * STAGE_SIZE
+        score = weights[base + MOBILITY] * (game.mobility(1) - game.mobility(-1))
+        for offset, inst in INSTANCES:
+            idx = base + offset
+            for shift, mask, magic, btab, wtab in inst:
+                b = (black >> shift) & mask
+                w = (white >> shift) & mask
+                if magic:
+                    b = ((b * magic) >> 56) & 0xFF
+                    w = ((w * magic) >> 56) & 0xFF
+                idx += btab[b] + wtab[w]
+            score += weights[idx]
+        return score / self.scale
+
+
+_evaluators: Dict[str, Optional[PatternEvaluator]] = {}
+
+
+def open_patterns(path: str = DEFAULT_PATH) -> Optional[PatternEvaluator]:
+    """プロセスごとに1回だけ読み込んで使い回す。ファイルが無ければ None"""
+    if path not in _evaluators:
+        _evaluators[path] = PatternEvaluator.load(path) if os.path.exists(path) else None
+    return _evaluators[path]
+
+
+# ----------------------------------------------------------------------------
+# 学習（オフライン）
+# ----------------------------------------------------------------------------
+def self_play(games: int, seed: int = 0, random_plies: int = 8, epsilon: float = 0.05,
+              exact_empties: int = 10, depth: int = 2, log=print) -> List[Tuple[int, int, float]]:
+    """自己対戦で (黒, 白, 白から見た最終石数差) の局面の列を作る。
+
+    序盤 random_plies 手はランダム、以降は従来の評価関数による depth 手読み（確率 epsilon で
+    ランダム）で打ち、空きマスが exact_empties 以下になったら完全読みの結果を最終石数差とする。
+    """
+    from endgame import EndgameSolver
+    from othello_ai import OthelloAI
+
+    rng = random.Random(seed)
+    ai = OthelloAI(level=1, evaluator="classic")
+    ai.max_depth = depth
+    samples = []
+    start = time.perf_counter()
+    for n in range(games):
+        game = OthelloGame()
+        positions = []
+        passed = False
+        while True:
+            mask = game.legal_mask(game.turn)
+            empties = 64 - (game.black | game.white).bit_count()
+            if not mask:
+                if passed or not game.legal_mask(-game.turn):
+                    result = game.white.bit_count() - game.black.bit_count()
+                    break
+                passed = True
+                game.apply_move(-1)
+                continue
+            passed = False
+            positions.append((game.black, game.white))
+            if empties <= exact_empties:
+                p, o = game.bitboards(game.turn)
+                _, score = EndgameSolver().best_move(p, o)
+                result = score * game.turn
+                break
+            squares = list(bitboard.iter_squares(mask))
+            if len(positions) <= random_plies or rng.random() < epsilon:
+                sq = rng.choice(squares)
+            elif depth > 1:
+                r, c = ai.choose_move(game, time_limit=None)
+                sq = r * 8 + c
+            else:
+                moves = ai.get_sorted_moves(game, game.turn)
+                scores = [ai.evaluate_move(game, divmod(m[1], 8)) * game.turn for m in moves]
+                sq = moves[max(range(len(moves)), key=scores.__getitem__)][1]
+            game.apply_move(sq)
+        samples.extend((b, w, float(result)) for b, w in positions[random_plies:])
+        if (n + 1) % 500 == 0:
+            log(f"[patterns] self-play {n + 1}/{games} games, {len(samples)} positions, "
+                f"{time.perf_counter() - start:.1f}s")
+    return samples
+
+
+def train(samples: List[Tuple[int, int, float]], epochs: int = 200, l2: float = 0.1,
+          lr: float = 0.5, log=print) -> PatternEvaluator:
+    """最終石数差への二乗誤差（L2 正則化つき）を全データの勾配降下（Adam）で最小化する。
+    黒白を入れ替えた局面（符号を反転）も学習に使う"""
+    import numpy as np
+
+    black = [b for b, _, _ in samples] + [w for _, w, _ in samples]
+    white = [w for _, w, _ in samples] + [b for b, _, _ in samples]
+    target = np.array([y for _, _, y in samples] + [-y for _, _, y in samples])
+    rows = []
+    mobility = np.empty(len(black))
+    for i, (b, w) in enumerate(zip(black, white)):
+        base = _PHASE_OF[(b | w).bit_count()] * STAGE_SIZE
+        rows.append([base + idx for idx in pattern_indexes(b, w)] + [base + MOBILITY])
+        mobility[i] = (bitboard.legal_moves(w, b).bit_count() -
+                       bitboard.legal_moves(b, w).bit_count())
+    index = np.array(rows, dtype=np.int64)
+    value = np.ones(index.shape)
+    value[:, -1] = mobility
+    n = PHASES * STAGE_SIZE
+    counts = np.bincount(index.ravel(), minlength=n)
+
+    weights = np.zeros(n)
+    m, v = np.zeros(n), np.zeros(n)
+    beta1, beta2 = 0.9, 0.999
+    for epoch in range(1, epochs + 1):
+        pred = (weights[index] * value).sum(axis=1)
+        err = pred - target
+        grad = np.bincount(index.ravel(), weights=(value * err[:, None]).ravel(), minlength=n)
+        grad = grad / np.maximum(counts, 1) + l2 * weights
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad * grad
+        weights -= lr * (m / (1 - beta1 ** epoch)) / (np.sqrt(v / (1 - beta2 ** epoch)) + 1e-8)
+        if epoch % 50 == 0 or epoch == epochs:
+            log(f"[patterns] epoch {epoch}: rmse={np.sqrt((err * err).mean()):.3f} discs")
+    quantized = np.clip(np.round(weights * SCALE), -32768, 32767).astype(np.int16)
+    return PatternEvaluator(array("h", quantized.tobytes()), SCALE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the pattern evaluation tables")
+    parser.add_argument("--games", type=int, default=8000, help="自己対戦の対局数")
+    parser.add_argument("--random-plies", type=int, default=8, help="序盤でランダムに打つ手数")
+    parser.add_argument("--epsilon", type=float, default=0.05, help="序盤以降にランダムに打つ確率")
+    parser.add_argument("--depth", type=int, default=2, help="自己対戦の探索の深さ")
+    parser.add_argument("--exact", type=int, default=10,
+                        help="完全読みで最終石数差を求める空きマス数")
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--l2", type=float, default=0.1, help="L2 正則化の係数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=DEFAULT_PATH)
+    args = parser.parse_args()
+    samples = self_play(args.games, args.seed, args.random_plies, args.epsilon, args.exact,
+                        args.depth)
+    evaluator = train(samples, args.epochs, args.l2)
+    evaluator.save(args.out)
+    print(f"wrote {len(evaluator.weights)} weights from {len(samples)} positions "
+          f"to {args.out} ({os.path.getsize(args.out)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""game_state の送信形式
+
+  v1  従来どおり毎回 8x8 の盤面とプレイヤー一覧を送る（game_state / ai_move）
+  v2  参加時にだけ盤面のスナップショット（game_snapshot）を送り、以降は1手ごとの
+      差分（game_delta）だけを送る。クライアントが join_game / start_ai_game で
+      protocol: 2 を指定したときに使う
+
+v2 のクライアントはルーム game_id ではなく game_id + "#v2" に入る。
+観戦者（watch_game）は game_id + "#watch" に入り、v2 の形式で受け取る。
+マスは 0..63（row*8 + col）の整数で表す。
+
+  game_snapshot  {v, game_id, seq, board, turn, status, players, hash}
+                 board は 64 文字（"." 空き / "x" 黒 / "o" 白）
+  game_delta     {v, seq, move, color, flips, turn, status, hash, scores, ...}
+                 move は置いたマス（パスは null）、flips は反転したマス
+
+  game_deltas    {v, game_id, seq, deltas}
+                 resync / join_game で since（最後に反映した seq）を渡されたときに、
+                 その後の差分を棋譜（move_log.py）から作り直してまとめて送る
+
+seq は局面が変わるたびに1ずつ増える。hash は盤面と手番の 32bit FNV-1a で、
+クライアントは差分を当てた後の盤面から同じ値を計算して照合する。
+seq が飛んだら resync に since を付けて取りこぼした差分だけを取り直す。
+hash が合わないとき・棋譜から作れないとき（undo の前の seq など）・
+取りこぼしが REPLAY_LIMIT 手を超えるときはスナップショットを送る。
+"""
+from typing import Dict, List, Optional
+
+import bitboard
+from othello import OthelloGame
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+
+_FNV_OFFSET = 0x811C9DC5
+_FNV_PRIME = 0x01000193
+_CELL_CHARS = ".xo"  # 空き・黒・白
+# 差分1つはスナップショットの半分弱の大きさなので、これより多く取りこぼしたら
+# スナップショットを送り直す方が小さい
+REPLAY_LIMIT = 8
+
+
+def v2_room(game_id: str) -> str:
+    """v2 のクライアントが入るルーム名"""
+    return game_id + "#v2"
+
+
+def watch_room(game_id: str) -> str:
+    """観戦者が入るルーム名（v2 の差分・スナップショットを broadcast.py がまとめて送る）"""
+    return game_id + "#watch"
+
+
+def requested_protocol(data: Dict) -> int:
+    """クライアントが要求したプロトコル（指定が無ければ v1）"""
+    try:
+        return PROTOCOL_V2 if int(data.get("protocol", PROTOCOL_V1)) >= PROTOCOL_V2 else PROTOCOL_V1
+    except (TypeError, ValueError):
+        return PROTOCOL_V1
+
+
+def squares(mask: int) -> List[int]:
+    return list(bitboard.iter_squares(mask))
+
+
+def board_string(game: OthelloGame) -> str:
+    """盤面を 64 文字で表す（"." 空き / "x" 黒 / "o" 白）"""
+    black, white = game.black, game.white
+    return "".join(_CELL_CHARS[(black >> sq & 1) | (white >> sq & 1) << 1] for sq in range(64))
+
+
+def board_hash(game: OthelloGame) -> int:
+    """盤面 64 マス（0 空き / 1 黒 / 2 白）と手番（0 黒 / 1 白）の 32bit FNV-1a。
+    templates/othello.html の boardHash と同じ計算"""
+    black, white = game.black, game.white
+    h = _FNV_OFFSET
+    for sq in range(64):
+        h = ((h ^ ((black >> sq & 1) | (white >> sq & 1) << 1)) * _FNV_PRIME) & 0xFFFFFFFF
+    return ((h ^ (1 if game.turn == 1 else 0)) * _FNV_PRIME) & 0xFFFFFFFF
+
+
+def snapshot(game_id: str, game_data, status: str = "ongoing") -> Dict:
+    game = game_data.game
+    return {
+        "v": PROTOCOL_V2,
+        "game_id": game_id,
+        "seq": game_data.seq,
+        "board": board_string(game),
+        "turn": game.turn,
+        "status": status,
+        "players": [{"id": p.id, "name": p.name, "color": p.color} for p in game_data.players],
+        "hash": board_hash(game),
+    }
+
+
+def delta(game_data, move: Optional[int], color: int, flips: int, status: str, **extra) -> Dict:
+    """1手分の差分。move=None はパス。extra（eval など）はそのまま載せる"""
+    return _delta(game_data.seq, game_data.game, move, color, flips, status, extra)
+
+
+def _delta(seq: int, game: OthelloGame, move: Optional[int], color: int, flips: int,
+           status: str, extra: Dict) -> Dict:
+    payload = {
+        "v": PROTOCOL_V2,
+        "seq": seq,
+        "move": move,
+        "color": color,
+        "flips": squares(flips),
+        "turn": game.turn,
+        "status": status,
+        "hash": board_hash(game),
+        "scores": game.scores(),
+    }
+    payload.update(extra)
+    return payload
+
+
+def replay(game_data, since) -> Optional[List[Dict]]:
+    """since の局面から今の局面までの差分を棋譜から作り直す。
+    作れないとき・スナップショットの方が小さいときは None"""
+    if not isinstance(since, int) or not 0 <= game_data.seq - since <= REPLAY_LIMIT:
+        return None
+    if game_data.log.seq != game_data.seq:
+        return None
+    steps = game_data.log.replay_since(since)
+    if steps is None:
+        return None
+    deltas = []
+    for seq, color, result, game in steps:
+        extra = {"score": result["score"]} if result["status"] == "game_over" else {}
+        deltas.append(_delta(seq, game, result["move"], color, result["flips"],
+                             result["status"], extra))
+    return deltas
+
+
+def deltas_payload(game_id: str, game_data, deltas: List[Dict]) -> Dict:
+    return {"v": PROTOCOL_V2, "game_id": game_id, "seq": game_data.seq, "deltas": deltas}
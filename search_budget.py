@@ -0,0 +1,142 @@
+"""負荷に応じた1手の探索予算（持ち時間）
+
+AI_ADAPTIVE_BUDGET を有効にすると、run_ai_move は AI の持ち時間を
+SearchBudget.time_limit で決める。レベルごとに下限（LEVEL_FLOOR）と上限
+（OthelloAI.LEVEL_BUDGET の time）があり、その間を倍率 scale（0..1）で決める:
+
+  負荷 = max(探索中・待機中のジョブ数 / 同時実行数,
+            プールで走っている・プールを待っている投入の数 / プールのプロセス数,
+            待ち行列の先頭のジョブの待ち時間 / AI_BUDGET_TARGET_WAIT,
+            1分間のロードアベレージ / CPU 数)
+  プールの投入には AI の手番の探索のほか、先読み・検討・評価値も含む。
+  負荷 > 1（ジョブが待たされている・CPU が足りない） → scale を半分にする
+                                                    （MIN_SCALE 未満は 0）
+  負荷 < IDLE_LOAD（空いている）                    → scale を INCREASE ずつ戻す
+
+倍率の見直しは ADJUST_INTERVAL 秒に1回まで（同時に来たジョブでまとめて下げない）。
+混んでいる間は全ルームの持ち時間が短くなり、AI の応答時間が待ち行列の長さで
+際限なく延びるのを防ぐ。無効のとき（デフォルト）は常にレベルの持ち時間を使う。
+
+実際に使った予算は used で求める（先読みの結果を使った手はレベルの持ち時間、
+定跡の手は 0）。ai_move と v2 の差分の budget に載せ、統計にも残す。
+
+  AI_ADAPTIVE_BUDGET=1     負荷に応じて持ち時間を変える（デフォルト: 無効）
+  AI_BUDGET_TARGET_WAIT    ジョブの待ち時間の目安（秒。デフォルト: 0.25）
+"""
+import os
+import time
+from typing import Dict, Optional
+
+import search_stats
+from othello_ai import OthelloAI
+from search_stats import SearchStats
+
+ADAPTIVE_ENABLED = os.environ.get("AI_ADAPTIVE_BUDGET", "0").lower() in ("1", "true", "yes", "on")
+DEFAULT_TARGET_WAIT = float(os.environ.get("AI_BUDGET_TARGET_WAIT", 0.25))
+
+# レベルごとの持ち時間の下限（秒）。上限はレベルの持ち時間
+# （0.5 は探索しないので変えない）
+LEVEL_FLOOR = {
+    1: 0.02,
+    2: 0.1,
+    3: 0.25,
+    4: 0.25,
+    5: 0.5,
+}
+
+
+class SearchBudget:
+    ADJUST_INTERVAL = 0.5  # 倍率を見直す最短の間隔（秒）
+    DECREASE = 0.5         # 混んでいるときに scale に掛ける値
+    INCREASE = 0.1         # 空いているときに scale に足す値
+    MIN_SCALE = 0.01       # これより小さくなったら 0（下限の持ち時間）にする
+    IDLE_LOAD = 0.5
+
+    def __init__(self, scheduler, executor=None, enabled: Optional[bool] = None,
+                 target_wait: float = DEFAULT_TARGET_WAIT):
+        """scheduler は AIScheduler（待ち行列の長さ・待ち時間を負荷として使う）、
+        executor は AIExecutor（プールの混み具合を負荷として使う）"""
+        self.scheduler = scheduler
+        self.executor = executor
+        self.enabled = ADAPTIVE_ENABLED if enabled is None else enabled
+        self.target_wait = target_wait
+        self.scale = 1.0
+        self.load = 0.0
+        self._adjusted_at = 0.0
+        # 統計
+        self.decreases = 0
+        self.increases = 0
+        self._used: Dict[object, list] = {}  # レベル → [手数, 持ち時間の合計, 直近の持ち時間]
+
+    def _cpu_load(self) -> float:
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            return 0.0
+
+    def measure(self) -> float:
+        """今の負荷（1 を超えたら混んでいる）"""
+        s = self.scheduler
+        occupancy = (s.running + s.queued) / s.max_jobs
+        pool = 0.0
+        if self.executor is not None:
+            load = self.executor.pool_load()
+            pool = (load["running"] + load["queued"]) / load["pool_size"]
+        wait = s.oldest_wait() / self.target_wait if self.target_wait > 0 else 0.0
+        return max(occupancy, pool, wait, self._cpu_load())
+
+    def adjust(self, now: Optional[float] = None):
+        """負荷を測って倍率を見直す（ADJUST_INTERVAL 秒以内の再呼び出しは何もしない）"""
+        now = time.monotonic() if now is None else now
+        if now - self._adjusted_at < self.ADJUST_INTERVAL:
+            return
+        self._adjusted_at = now
+        self.load = self.measure()
+        if self.load > 1.0:
+            scale = self.scale * self.DECREASE
+            if scale < self.MIN_SCALE:
+                scale = 0.0
+            if scale != self.scale:
+                self.decreases += 1
+                self.scale = scale
+        elif self.load < self.IDLE_LOAD and self.scale < 1.0:
+            self.increases += 1
+            self.scale = min(1.0, self.scale + self.INCREASE)
+
+    def time_limit(self, ai: OthelloAI) -> float:
+        """ai の今回の持ち時間（秒）"""
+        ceiling = ai.time_limit
+        if not self.enabled:
+            return ceiling
+        floor = min(LEVEL_FLOOR.get(ai.level, ceiling), ceiling)
+        self.adjust()
+        return floor + (ceiling - floor) * self.scale
+
+    def used(self, ai: OthelloAI, time_limit: float, stats: SearchStats) -> Dict:
+        """持ち時間 time_limit で choose_move した結果の stats から、実際に使った予算を
+        {time, elapsed, depth, mode, pondered} で返し、統計に残す"""
+        if stats.mode in (search_stats.MODE_BOOK, search_stats.MODE_RANDOM):
+            budget = 0.0
+        elif stats.pondered:
+            budget = ai.time_limit  # 先読みはレベルの持ち時間で探索している
+        else:
+            budget = time_limit
+        used = self._used.setdefault(ai.level, [0, 0.0, 0.0])
+        used[0] += 1
+        used[1] += budget
+        used[2] = budget
+        return {"time": budget, "elapsed": stats.elapsed, "depth": stats.depth,
+                "mode": stats.mode, "pondered": stats.pondered}
+
+    def metrics(self) -> Dict:
+        return {
+            "adaptive": self.enabled,
+            "scale": self.scale,
+            "load": self.load,
+            "decreases": self.decreases,
+            "increases": self.increases,
+            "levels": {
+                str(level): {"moves": n, "time_avg": total / n, "time_last": last}
+                for level, (n, total, last) in self._used.items()
+            },
+        }
@@ -0,0 +1,123 @@
+"""探索の統計情報
+
+OthelloAI.choose_move は1手ごとに SearchStats を作り、ai.last_stats に残す。
+ノード数・到達深さ・経過時間は常に記録する（1手に1回の計算なので軽い）。
+末端評価数・置換表の参照/ヒット数・beta カットの数は collect_stats が有効な
+ときだけ数える。無効なときは探索ノードごとに None 判定が1回入るだけ。
+
+  AI_SEARCH_STATS=1        詳細カウンタを有効にする（デフォルト: 無効）
+  AI_STATS_LOG_LEVEL=INFO  1手ごとの統計を logging に出すレベル（デフォルト: DEBUG）
+"""
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+STATS_ENABLED = os.environ.get("AI_SEARCH_STATS", "0").lower() in ("1", "true", "yes", "on")
+STATS_LOG_LEVEL = logging.getLevelName(os.environ.get("AI_STATS_LOG_LEVEL", "DEBUG").upper())
+if not isinstance(STATS_LOG_LEVEL, int):
+    STATS_LOG_LEVEL = logging.DEBUG
+
+# 探索の方法
+MODE_RANDOM = "random"    # レベル0.5の手選び
+MODE_BOOK = "book"        # 定跡
+MODE_ENDGAME = "endgame"  # 完全読み
+MODE_SEARCH = "search"    # 反復深化の minimax
+
+
+class SearchStats:
+    """1手分の探索統計。詳細カウンタ（leaf_evals 以下）は有効時のみ数える"""
+    COUNTERS = ("nodes", "leaf_evals", "tt_probes", "tt_hits", "cutoffs")
+
+    def __init__(self, level=None, detailed: bool = False):
+        self.level = level
+        self.detailed = detailed
+        self.mode = MODE_SEARCH
+        self.depth = 0
+        self.elapsed = 0.0
+        self.nodes = 0
+        self.leaf_evals = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.cutoffs = 0
+        self.workers = 1
+        self.pondered = False  # 人間の手番のうちに先読みしていた探索の結果か
+        self.depth_times = {}  # {深さ: 探索開始からその深さを完了するまでの秒数}
+
+    @property
+    def nps(self) -> float:
+        """1秒あたりの探索ノード数"""
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def tt_hit_rate(self) -> Optional[float]:
+        if not self.tt_probes:
+            return None
+        return self.tt_hits / self.tt_probes
+
+    def as_dict(self) -> Dict:
+        d = {
+            "level": self.level,
+            "mode": self.mode,
+            "depth": self.depth,
+            "nodes": self.nodes,
+            "elapsed": self.elapsed,
+            "nps": self.nps,
+            "workers": self.workers,
+            "pondered": self.pondered,
+            "depth_times": dict(self.depth_times),
+        }
+        if self.detailed:
+            for name in self.COUNTERS[1:]:
+                d[name] = getattr(self, name)
+            d["tt_hit_rate"] = self.tt_hit_rate
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "SearchStats":
+        """as_dict の逆（ワーカープロセスから受け取った統計を戻す）"""
+        stats = cls(d.get("level"), detailed="leaf_evals" in d)
+        for name in ("mode", "depth", "elapsed", "workers", "pondered") + cls.COUNTERS:
+            if name in d:
+                setattr(stats, name, d[name])
+        stats.depth_times = {int(k): v for k, v in d.get("depth_times", {}).items()}
+        return stats
+
+    @classmethod
+    def merge(cls, parts: Iterable["SearchStats"], depth: int, elapsed: float) -> "SearchStats":
+        """ルート分割した各探索の統計を1手分にまとめる。
+        カウンタは合計し、深さ・経過時間は呼び出し側が決めた値を使う"""
+        parts = list(parts)
+        merged = cls(parts[0].level if parts else None,
+                     detailed=bool(parts) and all(p.detailed for p in parts))
+        for p in parts:
+            for name in cls.COUNTERS:
+                setattr(merged, name, getattr(merged, name) + getattr(p, name))
+        # 深さが揃うのは全員がその深さを終えたとき
+        for d in range(1, depth + 1):
+            times = [p.depth_times.get(d) for p in parts]
+            if times and None not in times:
+                merged.depth_times[d] = max(times)
+        merged.depth = depth
+        merged.elapsed = elapsed
+        merged.workers = len(parts)
+        return merged
+
+    def __str__(self):
+        s = (f"level={self.level} mode={self.mode} depth={self.depth} nodes={self.nodes} "
+             f"time={self.elapsed * 1000:.1f}ms nps={self.nps:.0f}")
+        if self.workers > 1:
+            s += f" workers={self.workers}"
+        if self.pondered:
+            s += " pondered"
+        if self.detailed:
+            rate = self.tt_hit_rate
+            s += (f" leaf_evals={self.leaf_evals} tt={self.tt_hits}/{self.tt_probes}"
+                  f"({rate * 100 if rate is not None else 0:.1f}%) cutoffs={self.cutoffs}")
+        return s
+
+
+def log_stats(logger: logging.Logger, stats: SearchStats, level: int = None):
+    """統計を1行で出力する（ログレベルが無効なら文字列も作らない）"""
+    level = STATS_LOG_LEVEL if level is None else level
+    if logger.isEnabledFor(level):
+        logger.log(level, "[AI] %s", stats)
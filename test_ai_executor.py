@@ -0,0 +1,129 @@
+"""AIExecutor の中断フラグのテスト（プロセスプールを使うので数秒かかる）
+
+    python -m unittest test_ai_executor
+"""
+import random
+import time
+import unittest
+
+import ai_executor
+from ai_executor import AIExecutor
+from othello import OthelloGame
+from othello_ai import OthelloAI
+
+
+def midgame(seed=1, plies=16) -> OthelloGame:
+    """定跡を外れた中盤の局面（人間＝黒の手番）"""
+    rng = random.Random(seed)
+    while True:
+        game = OthelloGame()
+        for _ in range(plies):
+            moves = game.valid_moves(game.turn)
+            if not moves:
+                break
+            game.make_move(*rng.choice(moves))
+        if game.turn == -1 and game.has_valid_move(-1):
+            return game
+
+
+def children(game: OthelloGame):
+    """game の合法手それぞれを指した後の局面"""
+    for move in game.valid_moves(game.turn):
+        child = game.copy()
+        child.make_move(*move)
+        yield child
+
+
+def wait_done(futures, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not all(f.done() for f in futures):
+        if time.monotonic() > deadline:
+            raise AssertionError("search did not finish")
+        time.sleep(0.01)
+
+
+class CancelSlotTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = AIExecutor(backend="process", pool_size=2, ponder_width=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def ponder(self, room, level=2):
+        self.executor.ponder(OthelloAI(level=level), midgame(), room)
+        jobs = list(self.executor._ponders[room].values())
+        self.assertEqual(len(jobs), 1)
+        return jobs[0]
+
+    def test_finished_ponder_does_not_stop_other_room(self):
+        job = self.ponder("A")
+        wait_done([job.future])
+        # A の先読みが終わったので、B の探索が同じスロットを使う
+        future, slot = self.executor._submit_stoppable(
+            ai_executor._search, 3, ai_executor.encode_position(midgame(2)), 0.5, None, False)
+        self.assertEqual(slot, job.slot)
+        self.executor.cancel_ponder("A")
+        self.assertEqual(self.executor._flags.buf[slot], 0)
+        self.assertIs(self.executor._slots.get(slot), future)
+        wait_done([future])
+
+    def test_running_ponder_is_stopped(self):
+        job = self.ponder("A", level=3)
+        while not job.future.running():
+            time.sleep(0.01)
+        self.executor.cancel_ponder("A")
+        self.assertEqual(self.executor._flags.buf[job.slot], 1)
+        wait_done([job.future])
+
+    def test_ponder_at_other_level_is_cancelled(self):
+        game = midgame()
+        job = self.ponder("A", level=3)
+        # 先読みした局面（人間が指した後）を、レベルを変えて探索する
+        key = next(iter(self.executor._ponders["A"]))
+        child = next(c for c in children(game) if c.zobrist_key() == key)
+        self.executor.choose_move(OthelloAI(level=2), child, room="A")
+        self.assertTrue(job.future.cancelled() or self.executor._flags.buf[job.slot] == 1)
+        wait_done([job.future])
+        self.assertEqual(self.executor._acquire_slot(), job.slot)
+
+    def test_stop_skips_finished_split(self):
+        submit = self.executor._submit_stoppable
+        position = ai_executor.encode_position(midgame())
+        done, done_slot = submit(ai_executor._search, 1, position, 0.05, None, False)
+        wait_done([done])
+        # 終わった分担のスロットを別のルームの探索が使う
+        other, other_slot = submit(ai_executor._search, 3, ai_executor.encode_position(midgame(2)),
+                                   0.5, None, False)
+        self.assertEqual(other_slot, done_slot)
+        mine, mine_slot = submit(ai_executor._search, 3, position, 5.0, None, False)
+        started = time.monotonic()
+        self.executor.wait(mine, lambda: True, [(done, done_slot), (mine, mine_slot)])
+        self.assertLess(time.monotonic() - started, 2.0)
+        self.assertEqual(self.executor._flags.buf[other_slot], 0)
+        wait_done([other])
+
+
+class PriorityTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = AIExecutor(backend="process", pool_size=2, ponder_width=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_moves_run_before_speculative_work(self):
+        submit = self.executor._submit
+        busy = [submit(ai_executor.PRIORITY_MOVE, time.sleep, 0.3) for _ in range(2)]
+        analysis = submit(ai_executor.PRIORITY_ANALYZE, time.sleep, 0)
+        move = submit(ai_executor.PRIORITY_MOVE, time.sleep, 0)
+        self.assertEqual(self.executor.pool_load()["queued"], 2)
+        # プールが埋まっている間は先読みを始めない
+        self.executor.ponder(OthelloAI(level=2), midgame(), "A")
+        self.assertNotIn("A", self.executor._ponders)
+        self.executor.wait(analysis)
+        # 検討は最後の1プロセスを使わないので、手番の探索が全部終わってから走る
+        self.assertTrue(move.done())
+        self.assertTrue(all(f.done() for f in busy))
+
+
+if __name__ == "__main__":
+    unittest.main()
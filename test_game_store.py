@@ -0,0 +1,107 @@
+"""ゲームストアの書き戻し（seq の compare-and-set）のテスト
+
+SQLite は同じファイルを開いた2つのストアを2つのワーカーに見立てる。
+
+    python -m unittest test_game_store
+"""
+import os
+import tempfile
+import unittest
+
+from game_store import GameRecord, MemoryGameStore, SQLiteGameStore, StaleRecord
+from othello import OthelloGame
+from othello_ai import OthelloAI
+
+
+class StoreTests:
+    """MemoryGameStore・SQLiteGameStore に共通のテスト"""
+
+    def open_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.open_store()
+        self.store.put("g", GameRecord(OthelloGame(), 0.0))
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_put_after_read(self):
+        record = self.store.get("g")
+        record.play(2, 3)
+        self.store.put("g", record)
+        record.play(2, 2)
+        self.store.put("g", record)
+        self.assertEqual(self.store.get("g").seq, 2)
+
+    def test_new_record_does_not_overwrite(self):
+        with self.assertRaises(StaleRecord):
+            self.store.put("g", GameRecord(OthelloGame(), 0.0))
+
+    def test_deleted_room_is_not_restored(self):
+        record = self.store.get("g")
+        self.store.delete("g")
+        record.play(2, 3)
+        with self.assertRaises(StaleRecord):
+            self.store.put("g", record)
+        self.assertIsNone(self.store.get("g"))
+
+
+class MemoryGameStoreTest(StoreTests, unittest.TestCase):
+    def open_store(self):
+        return MemoryGameStore()
+
+
+class SQLiteGameStoreTest(StoreTests, unittest.TestCase):
+    def open_store(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.other = SQLiteGameStore(self.path)
+        return SQLiteGameStore(self.path)
+
+    def tearDown(self):
+        super().tearDown()
+        self.other.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_update_from_other_worker_wins(self):
+        stale = self.store.get("g")
+        fresh = self.other.get("g")
+        fresh.play(2, 3)
+        self.other.put("g", fresh)
+        stale.play(3, 2)
+        with self.assertRaises(StaleRecord):
+            self.store.put("g", stale)
+        self.assertEqual(self.store.get("g").log.transcript(), "d3")
+
+    def test_ai_of_room_deleted_elsewhere_is_pruned(self):
+        record = self.store.get("g")
+        record.ai = OthelloAI(level=2)
+        self.store.put("g", record)
+        self.store.put("h", GameRecord(OthelloGame(), 0.0))
+        record = self.store.get("h")
+        record.ai = OthelloAI(level=2)
+        self.store.put("h", record)
+        self.assertEqual(self.store.memory_usage()["ais"], 2)
+        self.other.delete("g")
+        self.other.delete("h")
+        # 見つからなかったルームの分だけでなく、ほかの AI も捨てる
+        self.store._pruned_at = float("-inf")
+        self.assertIsNone(self.store.get("g"))
+        self.assertEqual(self.store._ais, {})
+
+    def test_prune_is_rate_limited(self):
+        record = self.store.get("g")
+        record.ai = OthelloAI(level=2)
+        self.store.put("g", record)
+        self.store.memory_usage()
+        self.other.delete("g")
+        # 直前に探したばかりなので、見つからないルームが続いても DB に問い合わせない
+        self.assertIsNone(self.store.get("x"))
+        self.assertIn("g", self.store._ais)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,243 @@
+"""AI 同士の対局によるレベルの強さ・処理コストの計測
+
+指定した AI の設定の総当たりで、ランダムな序盤から対局させる。
+各序盤は先後を入れ替えて2局ずつ打つ。対局はプロセスプールに分散し、
+Flask / Socket.IO は使わず OthelloGame と OthelloAI だけで進める。
+
+設定は "レベル[,キー=値...]" で指定する。キーは次のとおり（省略時はレベルの予算）
+  time   1手の持ち時間(秒)
+  nodes  1手のノード数上限
+  depth  深さの上限
+  pvs    PVS を使うか（0/1）
+  book   定跡を使うか（0/1）
+  eval   評価関数（classic / pattern）
+
+    python tournament.py --players 1 2 3 --openings 20
+    python tournament.py --players 3 3,pvs=0 --openings 50 --jobs 8 --out t.json
+    python tournament.py --players 3 3,eval=pattern --openings 20
+
+勝率は引き分けを 0.5 勝として数える。1手の平均時間・NPS は
+その設定が探索した手（定跡・パスを除く）だけで計算する。
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+import bitboard
+import search_stats
+from othello import OthelloGame
+from othello_ai import EVALUATORS, OthelloAI
+
+_OPTIONS = {
+    "time": ("time_limit", float),
+    "nodes": ("node_limit", int),
+    "depth": ("max_depth", int),
+    "pvs": ("use_pvs", lambda v: v not in ("0", "false", "no", "off")),
+    "book": ("use_book", lambda v: v not in ("0", "false", "no", "off")),
+    "eval": ("evaluator", str),
+}
+
+
+def parse_spec(spec: str) -> Tuple[float, Dict]:
+    """"3,time=0.2,pvs=0" を (レベル, {属性名: 値}) にする"""
+    level, *options = spec.split(",")
+    level = float(level)
+    if level.is_integer():
+        level = int(level)
+    if level not in OthelloAI.LEVEL_BUDGET:
+        raise ValueError(f"unknown level: {level}")
+    overrides = {}
+    for option in options:
+        key, _, value = option.partition("=")
+        if key not in _OPTIONS:
+            raise ValueError(f"unknown option {key!r} in {spec!r}")
+        attr, convert = _OPTIONS[key]
+        overrides[attr] = convert(value.lower() if key in ("pvs", "book", "eval") else value)
+    if overrides.get("evaluator", "classic") not in EVALUATORS:
+        raise ValueError(f"unknown evaluator in {spec!r}")
+    return level, overrides
+
+
+def make_ai(spec: str) -> OthelloAI:
+    level, overrides = parse_spec(spec)
+    ai = OthelloAI(level=level, evaluator=overrides.pop("evaluator", None))
+    for attr, value in overrides.items():
+        setattr(ai, attr, value)
+    return ai
+
+
+def random_openings(count: int, plies: int, seed: int) -> List[List[int]]:
+    """初期局面から plies 手ランダムに打った序盤を重複なしで count 個返す（マス番号の列）"""
+    rng = random.Random(seed)
+    openings, seen = [], set()
+    attempts = 0
+    while len(openings) < count and attempts < count * 100:
+        attempts += 1
+        game = OthelloGame()
+        moves = []
+        for _ in range(plies):
+            mask = game.legal_mask(game.turn)
+            if not mask:
+                break
+            sq = rng.choice(list(bitboard.iter_squares(mask)))
+            game.apply_move(sq)
+            moves.append(sq)
+        if game.zobrist_key() not in seen:
+            seen.add(game.zobrist_key())
+            openings.append(moves)
+    return openings
+
+
+def play_game(black: str, white: str, opening: List[int], seed: int) -> Dict:
+    """1局打って結果を返す（プロセスプールのワーカーで実行される）"""
+    random.seed(seed)  # レベル0.5の手選びを再現できるように
+    ais = {-1: make_ai(black), 1: make_ai(white)}
+    side = {-1: {"moves": 0, "time": 0.0, "nodes": 0},
+            1: {"moves": 0, "time": 0.0, "nodes": 0}}
+    game = OthelloGame()
+    for sq in opening:
+        game.apply_move(sq)
+    start = time.perf_counter()
+    while True:
+        turn = game.turn
+        if not game.has_valid_move(turn):
+            if not game.has_valid_move(-turn):
+                break
+            game.apply_move(-1)
+            continue
+        move = ais[turn].choose_move(game)
+        stats = ais[turn].last_stats
+        if stats.mode != search_stats.MODE_BOOK:
+            side[turn]["moves"] += 1
+            side[turn]["time"] += stats.elapsed
+            side[turn]["nodes"] += stats.nodes
+        game.apply_move(move[0] * 8 + move[1])
+    black_count, white_count = game.disc_counts()
+    return {
+        "black": black,
+        "white": white,
+        "opening": opening,
+        "score": {"black": black_count, "white": white_count},
+        "winner": "black" if black_count > white_count else
+                  "white" if white_count > black_count else "draw",
+        "elapsed": time.perf_counter() - start,
+        "stats": {"black": side[-1], "white": side[1]},
+    }
+
+
+def summarize(games: List[Dict], players: List[str]) -> Dict:
+    """設定ごとの勝敗・勝率・1手の平均時間・NPS と、組み合わせごとの勝敗"""
+    summary = {p: {"games": 0, "wins": 0, "draws": 0, "losses": 0, "discs": 0,
+                   "moves": 0, "time": 0.0, "nodes": 0} for p in players}
+    pairs = {}
+    for g in games:
+        for color, opponent in (("black", "white"), ("white", "black")):
+            s = summary[g[color]]
+            s["games"] += 1
+            s["discs"] += g["score"][color] - g["score"][opponent]
+            if g["winner"] == color:
+                s["wins"] += 1
+            elif g["winner"] == "draw":
+                s["draws"] += 1
+            else:
+                s["losses"] += 1
+            for name in ("moves", "time", "nodes"):
+                s[name] += g["stats"][color][name]
+        a, b = sorted((g["black"], g["white"]), key=players.index)
+        pair = pairs.setdefault(f"{a} vs {b}", {"wins": 0, "draws": 0, "losses": 0})
+        winner = g[g["winner"]] if g["winner"] != "draw" else None
+        pair["draws" if winner is None else "wins" if winner == a else "losses"] += 1
+    for s in summary.values():
+        s["win_rate"] = (s["wins"] + 0.5 * s["draws"]) / s["games"] if s["games"] else None
+        s["disc_diff"] = s.pop("discs") / s["games"] if s["games"] else 0.0
+        s["time_per_move"] = s["time"] / s["moves"] if s["moves"] else 0.0
+        s["nps"] = s["nodes"] / s["time"] if s["time"] > 0 else 0.0
+    return {"players": summary, "pairs": pairs}
+
+
+def run_tournament(players: List[str], openings: List[List[int]], jobs: int = None,
+                   seed: int = 0, log=print) -> List[Dict]:
+    """総当たりで各序盤を先後入れ替えて打つ。jobs はプロセス数（省略時は CPU 数）"""
+    tasks = []
+    for a, b in itertools.combinations(players, 2):
+        for opening in openings:
+            tasks.append((a, b, opening, seed + len(tasks)))
+            tasks.append((b, a, opening, seed + len(tasks)))
+    games = []
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(play_game, *task) for task in tasks]
+        for future in as_completed(futures):
+            g = future.result()
+            games.append(g)
+            log(f"[{len(games)}/{len(tasks)}] {g['black']} (black) {g['score']['black']} - "
+                f"{g['score']['white']} {g['white']} (white) {g['elapsed']:.1f}s")
+    return games
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Othello AI tournament")
+    parser.add_argument("--players", nargs="+", default=["1", "2", "3"],
+                        help='AI の設定（"レベル[,time=秒][,nodes=N][,depth=N][,pvs=0/1][,book=0/1]'
+                             '[,eval=classic/pattern]"）')
+    parser.add_argument("--openings", type=int, default=10, help="序盤の数（各序盤を先後入れ替えて2局）")
+    parser.add_argument("--random-plies", type=int, default=4, help="序盤でランダムに打つ手数")
+    parser.add_argument("--jobs", type=int, default=None, help="プロセス数（省略時は CPU 数）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="結果を書き出す JSON ファイル")
+    args = parser.parse_args()
+
+    if len(set(args.players)) != len(args.players) or len(args.players) < 2:
+        parser.error("--players には異なる設定を2つ以上指定してください")
+    for spec in args.players:
+        try:
+            parse_spec(spec)
+        except ValueError as e:
+            parser.error(str(e))
+
+    openings = random_openings(args.openings, args.random_plies, args.seed)
+    start = time.perf_counter()
+    games = run_tournament(args.players, openings, args.jobs, args.seed)
+    elapsed = time.perf_counter() - start
+    summary = summarize(games, args.players)
+
+    print(f"\n{len(games)} games in {elapsed:.1f}s ({len(games) / elapsed:.2f} games/s)")
+    print(f"{'player':<20} {'games':>5} {'W-D-L':>11} {'win%':>6} {'discs':>6} "
+          f"{'ms/move':>8} {'nps':>8}")
+    for spec, s in summary["players"].items():
+        print(f"{spec:<20} {s['games']:>5} {s['wins']:>3}-{s['draws']}-{s['losses']:<3} "
+              f"{s['win_rate'] * 100:>5.1f}% {s['disc_diff']:>+6.1f} "
+              f"{s['time_per_move'] * 1000:>8.1f} {s['nps']:>8.0f}")
+    for pair, r in summary["pairs"].items():
+        print(f"{pair}: {r['wins']}-{r['draws']}-{r['losses']}")
+
+    if args.out:
+        report = {
+            "meta": {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": sys.version.split()[0],
+                "cpu_count": os.cpu_count(),
+                "jobs": args.jobs or os.cpu_count(),
+                "openings": len(openings),
+                "random_plies": args.random_plies,
+                "seed": args.seed,
+                "elapsed": elapsed,
+                "games_per_second": len(games) / elapsed if elapsed > 0 else 0.0,
+            },
+            "summary": summary,
+            "games": games,
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""固定サイズのトランスポジションテーブル
+
+Zobrist ハッシュ（OthelloGame.zobrist_key）をキーに、探索深さ・評価値・
+境界フラグ・最善手を保持する。エントリは型付き array に詰めて確保するので、
+メモリ使用量は max_bytes を超えず、探索を続けても増えない。
+"""
+from array import array
+
+EMPTY, EXACT, LOWER, UPPER = 0, 1, 2, 3
+
+
+class TranspositionTable:
+    # key(Q) + value(d) + depth(b) + flag(B) + move(b) + age(B)
+    ENTRY_BYTES = 8 + 8 + 1 + 1 + 1 + 1
+    DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        # エントリ数は max_bytes に収まる最大の 2 のべき乗
+        n = 1 << max(0, (max_bytes // self.ENTRY_BYTES).bit_length() - 1)
+        self.size = n
+        self.mask = n - 1
+        self.keys = array('Q', [0]) * n
+        self.values = array('d', [0.0]) * n
+        self.depths = array('b', [0]) * n
+        self.flags = array('B', [EMPTY]) * n
+        self.moves = array('b', [-1]) * n
+        self.ages = array('B', [0]) * n
+        self.age = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.ENTRY_BYTES
+
+    def new_search(self):
+        """探索開始ごとに呼ぶ。古い世代のエントリは優先的に置き換えられる"""
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        self.flags = array('B', [EMPTY]) * self.size
+        self.age = 0
+
+    def lookup(self, key: int):
+        """(depth, flag, value, move) を返す。見つからなければ None"""
+        i = key & self.mask
+        if self.flags[i] == EMPTY or self.keys[i] != key:
+            return None
+        return self.depths[i], self.flags[i], self.values[i], self.moves[i]
+
+    def store(self, key: int, depth: int, flag: int, value: float, move: int = -1):
+        """深さ優先＋世代による置き換え:
+        空き・同一局面・古い世代・同じか深い探索結果のときだけ上書きする"""
+        i = key & self.mask
+        if (self.flags[i] != EMPTY and self.keys[i] != key
+                and self.ages[i] == self.age and depth < self.depths[i]):
+            return
+        if move < 0 and self.keys[i] == key and self.flags[i] != EMPTY:
+            move = self.moves[i]  # 最善手が分からない結果で既存の最善手を消さない
+        self.keys[i] = key
+        self.values[i] = value
+        self.depths[i] = depth
+        self.flags[i] = flag
+        self.moves[i] = move
+        self.ages[i] = self.age